@@ -0,0 +1,7 @@
+"""
+FarmGuard AI training helpers shared by the Kaggle training scripts.
+
+Keep this folder next to the script you run (or upload it to Kaggle as a
+utility script) so that ``import farmguard_train`` resolves, or install it
+with ``pip install ./kaggle_training`` and run ``farmguard-train --help``.
+"""
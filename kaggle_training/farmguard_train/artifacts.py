@@ -0,0 +1,148 @@
+"""
+Content-addressed cache of training and export outputs.
+
+Each stage of a run is keyed by a SHA-256 of everything that determines
+its output: the content of the dataset (the index's SHA-1s, else file
+sizes and mtimes, and the subset of every file), the config fields the
+stage depends on and the code version (this package's sources and the
+TensorFlow version). A stage whose key is in the cache copies its stored
+outputs into the output folder instead of running; otherwise it runs and
+its outputs are stored under the key. The trainer uses it only with
+``artifact_cache=True``: it keeps a second copy of every output.
+
+The dataset index, split manifest and feature cache already check their
+own inputs. The cached stages are training (with evaluation,
+distillation and the embedding index) and the tfjs export (conversion,
+quantization report and ZIPs): changing only export settings reuses the
+trained model, and a rerun with nothing changed skips both.
+
+Layout, one folder per stage and key:
+
+    <cache_dir>/<stage>/<key>/meta.json   inputs, stored paths, results
+    <cache_dir>/<stage>/<key>/files/...   outputs, relative to the output folder
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import tensorflow as tf
+
+CACHE_FORMAT = 'farmguard-artifacts-v1'
+
+
+def code_version():
+    """SHA-256 of this package's sources (.py, .js) and the TensorFlow version."""
+    package = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256(tf.__version__.encode('utf-8'))
+    for name in sorted(os.listdir(package)):
+        if name.endswith(('.py', '.js')):
+            digest.update(name.encode('utf-8'))
+            with open(os.path.join(package, name), 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()
+
+
+def dataset_fingerprint(root, subsets, index=None):
+    """
+    SHA-256 of ``subsets`` ({name: DirectoryDataset or DirectoryIterator}):
+    every file's path relative to ``root``, label and content (its SHA-1
+    from the DatasetIndex ``index``, else its size and mtime). For a shard
+    folder the manifest stands for the content.
+    """
+    from .shards import MANIFEST_NAME, is_shard_dir
+    digest = hashlib.sha256()
+    if is_shard_dir(root):
+        with open(os.path.join(root, MANIFEST_NAME), 'rb') as f:
+            digest.update(f.read())
+    sha1 = {e['path']: e['sha1'] for e in index.entries} if index is not None else {}
+    for name, data in sorted(subsets.items()):
+        for filename, label in zip(data.filenames, data.classes):
+            path = os.path.relpath(os.path.join(root, filename), root)
+            content = sha1.get(path)
+            if content is None and os.path.exists(os.path.join(root, path)):
+                stat = os.stat(os.path.join(root, path))
+                content = f'{stat.st_size}:{stat.st_mtime_ns}'
+            digest.update(f'{name}\t{path}\t{label}\t{content}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def stage_key(stage, inputs):
+    """SHA-256 of a stage name and its JSON-serialisable ``inputs``."""
+    text = json.dumps({'format': CACHE_FORMAT, 'stage': stage, 'inputs': inputs}, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _copy(src, dst):
+    os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+class ArtifactCache:
+    """Stored stage outputs under ``directory``, one entry per (stage, key)."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def entry(self, stage, key):
+        return os.path.join(self.directory, stage, key)
+
+    def restore(self, stage, key, output_dir):
+        """
+        Copy the outputs stored for (stage, key) into ``output_dir``,
+        replacing what is there. Returns the stored results dict, or None
+        if the stage has not run with these inputs.
+        """
+        entry = self.entry(stage, key)
+        meta_path = os.path.join(entry, 'meta.json')
+        if not os.path.exists(meta_path):
+            return None
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get('format') != CACHE_FORMAT:
+            return None
+        start = time.perf_counter()
+        for path in meta['paths']:
+            target = os.path.join(output_dir, path)
+            _remove(target)
+            _copy(os.path.join(entry, 'files', path), target)
+        print(f"Artifact cache hit for {stage} ({key[:12]}): restored {len(meta['paths'])} outputs "
+              f"in {time.perf_counter() - start:.1f}s")
+        return meta['results']
+
+    def store(self, stage, key, output_dir, paths, inputs=None, results=None):
+        """
+        Copy the existing ``paths`` (relative to ``output_dir``) into the
+        cache as the outputs of (stage, key), with ``results`` (JSON) to
+        hand back on a hit. A concurrent store of the same key wins.
+        """
+        entry = self.entry(stage, key)
+        staging = f'{entry}.tmp{os.getpid()}'
+        _remove(staging)
+        stored = []
+        for path in paths:
+            source = os.path.join(output_dir, path)
+            if os.path.exists(source):
+                _copy(source, os.path.join(staging, 'files', path))
+                stored.append(path)
+        os.makedirs(staging, exist_ok=True)
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump({'format': CACHE_FORMAT, 'stage': stage, 'key': key, 'created': time.time(),
+                       'inputs': inputs, 'paths': stored, 'results': results or {}}, f, indent=2, default=str)
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging)
+        print(f"Stored {stage} outputs in the artifact cache ({key[:12]})")
@@ -0,0 +1,347 @@
+"""
+Reproducible training and inference benchmarks on a synthetic dataset.
+
+Generates a small PlantVillage-shaped folder (the 15 pepper / potato /
+tomato classes, 256 px JPEGs, fixed seed) so the suite runs on a CPU box
+without Kaggle or ImageNet downloads, then times
+
+    pipeline   images/sec of the ImageDataGenerator, tf.data and packed
+               shard loaders (the 'input_pipeline' / shard options)
+    train      median step time of phase 1 (frozen backbone on images),
+               phase 1 on cached features, and phase 2 (fine-tuning)
+    inference  latency at batch sizes 1 / 8 / 32 of the Keras model and of
+               float16 and 8-bit weight-quantized builds
+
+and writes everything, plus the environment, to a JSON file. The training
+options come from a preset plus overrides, so two variants can be compared:
+
+    python -m farmguard_train.benchmark --preset fast -o fast.json
+    python -m farmguard_train.benchmark --preset fixed -o fixed.json --compare fast.json
+
+The float16 / uint8 tfjs exports cannot run in Python, so their inference
+numbers come from TFLite models with the same weight quantization (float16
+weights, 8-bit dynamic-range weights), run by the TFLite CPU interpreter.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+from dataclasses import replace
+
+import numpy as np
+import tensorflow as tf
+
+from .callbacks import peak_memory_mb
+from .data import find_classes
+from .features import feature_extractor, head_model
+from .precision import set_precision
+from .shards import pack_shards
+from .train import build_model, compile_model, load_data, preset, unfreeze
+
+PLANTVILLAGE_CLASSES = [
+    'Pepper__bell___Bacterial_spot', 'Pepper__bell___healthy',
+    'Potato___Early_blight', 'Potato___Late_blight', 'Potato___healthy',
+    'Tomato_Bacterial_spot', 'Tomato_Early_blight', 'Tomato_Late_blight',
+    'Tomato_Leaf_Mold', 'Tomato_Septoria_leaf_spot',
+    'Tomato_Spider_mites_Two_spotted_spider_mite', 'Tomato__Target_Spot',
+    'Tomato__Tomato_YellowLeaf__Curl_Virus', 'Tomato__Tomato_mosaic_virus',
+    'Tomato_healthy',
+]
+
+BATCH_SIZES = (1, 8, 32)
+
+
+def make_synthetic_dataset(directory, num_classes=15, per_class=24, size=256, seed=0):
+    """
+    Write ``per_class`` JPEG "leaves" per class: a class-tinted ellipse with
+    spots on a noisy background. Deterministic for a given seed; an existing
+    folder with the same parameters is reused.
+    """
+    params = {'num_classes': num_classes, 'per_class': per_class, 'size': size, 'seed': seed}
+    meta_path = os.path.join(directory, 'synthetic.json')
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            if json.load(f) == params:
+                return directory
+        shutil.rmtree(directory)
+
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size] / size
+    for c, name in enumerate(PLANTVILLAGE_CLASSES[:num_classes]):
+        os.makedirs(os.path.join(directory, name), exist_ok=True)
+        tint = rng.uniform(40, 200, 3)
+        for i in range(per_class):
+            image = rng.normal(120, 30, (size, size, 3))
+            cy, cx = rng.uniform(0.4, 0.6, 2)
+            ry, rx = rng.uniform(0.25, 0.4), rng.uniform(0.2, 0.35)
+            leaf = ((yy - cy) / ry) ** 2 + ((xx - cx) / rx) ** 2 < 1
+            image[leaf] = tint + rng.normal(0, 15, (leaf.sum(), 3))
+            for _ in range(c % 5 + 1):
+                sy, sx, r = rng.uniform(0.3, 0.7), rng.uniform(0.3, 0.7), rng.uniform(0.02, 0.05)
+                image[((yy - sy) ** 2 + (xx - sx) ** 2 < r ** 2) & leaf] = tint[::-1] * 0.5
+            jpeg = tf.io.encode_jpeg(np.clip(image, 0, 255).astype(np.uint8), quality=90)
+            tf.io.write_file(os.path.join(directory, name, f'image_{i:04d}.JPG'), jpeg)
+
+    with open(meta_path, 'w') as f:
+        json.dump(params, f)
+    return directory
+
+
+def environment():
+    gpus = tf.config.list_physical_devices('GPU')
+    return {
+        'tensorflow': tf.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'gpus': [tf.config.experimental.get_device_details(g).get('device_name', g.name) for g in gpus],
+    }
+
+
+def _timed(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def _summary_ms(times):
+    ms = np.asarray(times) * 1000
+    return {'median_ms': float(np.median(ms)), 'p90_ms': float(np.percentile(ms, 90)),
+            'min_ms': float(ms.min())}
+
+
+def bench_pipeline(config, num_batches=10):
+    """images/sec of one pass over ``num_batches`` training batches per loader."""
+    results = {}
+    shard_dir = tempfile.mkdtemp(prefix='farmguard_bench_shards_')
+    try:
+        pack_shards(config.dataset, shard_dir, img_size=config.img_size)
+        loaders = {
+            'generator': replace(config, input_pipeline='generator'),
+            'tf_data': replace(config, input_pipeline='tf_data'),
+            'tf_data_shards': replace(config, input_pipeline='tf_data', dataset=shard_dir),
+        }
+        for name, loader_config in loaders.items():
+            train_data, _ = load_data(loader_config)
+            data = train_data if name == 'generator' else train_data.dataset
+            iterator = iter(data)
+            next(iterator)  # warm-up: threads, first file reads
+            images = 0
+            start = time.perf_counter()
+            for _ in range(num_batches):
+                try:
+                    x, _ = next(iterator)
+                except StopIteration:
+                    iterator = iter(data)
+                    x, _ = next(iterator)
+                images += len(x)
+            seconds = time.perf_counter() - start
+            results[name] = {'images_per_sec': images / seconds, 'images': images}
+            print(f"  {name:<16}{images / seconds:8.1f} images/sec")
+    finally:
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return results
+
+
+class _StepTimes(tf.keras.callbacks.Callback):
+    def __init__(self):
+        super().__init__()
+        self.times = []
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._start = time.perf_counter()
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.times.append(time.perf_counter() - self._start)
+
+
+def _fit_steps(model, data, steps, batch_size):
+    timer = _StepTimes()
+    model.fit(data, epochs=1, steps_per_epoch=steps + 1, callbacks=[timer], verbose=0)
+    # The first step traces / compiles
+    times = timer.times[1:]
+    return {**_summary_ms(times), 'images_per_sec': batch_size / statistics.median(times),
+            'peak_memory_mb': peak_memory_mb()}
+
+
+def bench_train(config, num_classes, steps=10):
+    """Median step time of the three training phases on random batches."""
+    set_precision(config.precision)
+    rng = np.random.default_rng(0)
+    batch = config.batch_size
+    labels = tf.one_hot(rng.integers(0, num_classes, batch), num_classes)
+    # One fixed batch, repeated: measures the step, not the input pipeline
+    images = tf.data.Dataset.from_tensors((
+        rng.uniform(0, 1, (batch, config.img_size, config.img_size, 3)).astype(np.float32), labels
+    )).repeat()
+
+    model, base_model = build_model(config, num_classes)
+    results = {}
+
+    compile_model(config, model, config.learning_rate)
+    results['phase1_images'] = _fit_steps(model, images, steps, batch)
+
+    head = head_model(model)
+    compile_model(config, head, config.learning_rate)
+    dim = feature_extractor(base_model).output_shape[-1]
+    features = tf.data.Dataset.from_tensors((
+        rng.normal(size=(batch, dim)).astype(np.float32), labels
+    )).repeat()
+    results['phase1_features'] = _fit_steps(head, features, steps, batch)
+
+    unfreeze(config, base_model)
+    compile_model(config, model, config.learning_rate * config.fine_tune_lr_factor)
+    results['phase2'] = _fit_steps(model, images, steps, batch)
+
+    for name, r in results.items():
+        print(f"  {name:<16}{r['median_ms']:8.1f} ms/step  {r['images_per_sec']:8.1f} images/sec")
+    tf.keras.mixed_precision.set_global_policy('float32')
+    return results
+
+
+def _tflite(model, quantization):
+    saved_model_dir = tempfile.mkdtemp(prefix='farmguard_bench_savedmodel_')
+    try:
+        if hasattr(model, 'export'):
+            model.export(saved_model_dir, verbose=False)
+        else:
+            tf.saved_model.save(model, saved_model_dir)
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_dir)
+        if quantization != 'float32':
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        if quantization == 'float16':
+            converter.target_spec.supported_types = [tf.float16]
+        return converter.convert()
+    finally:
+        shutil.rmtree(saved_model_dir, ignore_errors=True)
+
+
+def _tflite_runner(flatbuffer, batch_size, img_size):
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')  # "moving to ai_edge_litert" notice on TF >= 2.18
+        interpreter = tf.lite.Interpreter(model_content=flatbuffer, num_threads=os.cpu_count())
+    index = interpreter.get_input_details()[0]['index']
+    interpreter.resize_tensor_input(index, [batch_size, img_size, img_size, 3])
+    interpreter.allocate_tensors()
+    interpreter.set_tensor(index, np.zeros((batch_size, img_size, img_size, 3), np.float32))
+    return interpreter.invoke
+
+
+def bench_inference(model, img_size, batch_sizes=BATCH_SIZES, repeats=20,
+                    quantizations=('float16', 'uint8')):
+    """Latency per batch size of the Keras model and of quantized TFLite builds."""
+    forward = tf.function(lambda x: model(x, training=False), reduce_retracing=True)
+    results = {'keras_float32': {}}
+    for batch_size in batch_sizes:
+        x = tf.zeros([batch_size, img_size, img_size, 3])
+        results['keras_float32'][batch_size] = _summary_ms(
+            _timed(lambda: forward(x).numpy(), repeats))
+
+    for quantization in quantizations:
+        name = f'tflite_{quantization}'
+        try:
+            flatbuffer = _tflite(model, quantization)
+        except Exception as error:  # converter support varies across TF versions
+            results[name] = {'error': f'{type(error).__name__}: {error}'}
+            continue
+        results[name] = {'model_bytes': len(flatbuffer)}
+        for batch_size in batch_sizes:
+            results[name][batch_size] = _summary_ms(
+                _timed(_tflite_runner(flatbuffer, batch_size, img_size), repeats))
+
+    for name, r in results.items():
+        if 'error' in r:
+            print(f"  {name:<16}failed: {r['error']}")
+            continue
+        print(f"  {name:<16}" + "  ".join(
+            f"b{b}: {r[b]['median_ms']:7.1f} ms" for b in batch_sizes))
+    return results
+
+
+def compare(current, baseline, prefix=''):
+    """Print every timing that moved by more than 5% between two result files."""
+    for key, value in current.items():
+        if key not in baseline or key == 'environment':
+            continue
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            compare(value, baseline[key], name + '.')
+        elif isinstance(value, (int, float)) and (key.endswith('_ms') or key == 'images_per_sec'):
+            old = baseline[key]
+            if old and abs(value - old) / old > 0.05:
+                better = (value < old) == key.endswith('_ms')
+                print(f"  {name}: {old:.1f} -> {value:.1f} ({(value - old) / old * 100:+.0f}%, "
+                      f"{'faster' if better else 'SLOWER'})")
+
+
+def run_benchmarks(config, output, steps=10, pipeline_batches=10, repeats=20, seed=0):
+    tf.keras.utils.set_random_seed(seed)
+    num_classes = len(find_classes(config.dataset))
+    results = {'environment': environment(), 'config': {
+        k: getattr(config, k) for k in ('dataset', 'img_size', 'batch_size', 'preprocessing', 'head',
+                                        'unfreeze_layers', 'freeze_batchnorm', 'precision', 'jit_compile')
+    }}
+
+    print("\nData pipeline")
+    results['pipeline'] = bench_pipeline(config, pipeline_batches)
+    print("\nTraining steps")
+    results['train'] = bench_train(config, num_classes, steps)
+    print("\nInference latency")
+    model, _ = build_model(config, num_classes)
+    results['inference'] = bench_inference(model, config.img_size, repeats=repeats)
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\nWrote {output}")
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--preset', default='main')
+    parser.add_argument('--config', help="JSON file of TrainConfig overrides")
+    parser.add_argument('--dataset', help="benchmark on this folder instead of the synthetic one")
+    parser.add_argument('--synthetic-dir', default=os.path.join(tempfile.gettempdir(), 'farmguard_synthetic'))
+    parser.add_argument('--classes', type=int, default=15)
+    parser.add_argument('--per-class', type=int, default=24)
+    parser.add_argument('--steps', type=int, default=10, help="timed train steps per phase")
+    parser.add_argument('--pipeline-batches', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=20, help="timed inference calls per batch size")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', '-o', default='benchmark.json')
+    parser.add_argument('--compare', help="earlier benchmark.json to diff against")
+    args = parser.parse_args(argv)
+
+    # No ImageNet download: timings do not depend on the weight values
+    overrides = {'weights': None}
+    if args.config:
+        with open(args.config) as f:
+            overrides.update(json.load(f))
+    dataset = args.dataset or make_synthetic_dataset(
+        args.synthetic_dir, args.classes, args.per_class, seed=args.seed)
+    config = preset(args.preset, dataset=dataset, **overrides)
+
+    results = run_benchmarks(config, args.output, args.steps, args.pipeline_batches,
+                             args.repeats, args.seed)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"\nChanges vs {args.compare}:")
+        compare(json.loads(json.dumps(results, default=str)), baseline)
+
+
+if __name__ == '__main__':
+    main()
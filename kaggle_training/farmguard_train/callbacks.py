@@ -0,0 +1,225 @@
+"""
+Keras callbacks used by the training scripts.
+"""
+
+import json
+import os
+import resource
+import statistics
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .export import batches
+
+
+def host_peak_memory_mb():
+    """Peak RSS of this process in MB (never goes down)."""
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def device_peak_memory_mb():
+    """Peak memory of the first GPU in MB since the last reset, None without a GPU."""
+    if tf.config.list_physical_devices('GPU'):
+        return tf.config.experimental.get_memory_info('GPU:0')['peak'] / 2**20
+    return None
+
+
+def peak_memory_mb():
+    """Peak memory in MB: first GPU if there is one, else the process' peak RSS."""
+    device = device_peak_memory_mb()
+    return device if device is not None else host_peak_memory_mb()
+
+
+def reset_peak_memory():
+    if tf.config.list_physical_devices('GPU'):
+        tf.config.experimental.reset_memory_stats('GPU:0')
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 2)
+
+
+class PerformanceTelemetry(tf.keras.callbacks.Callback):
+    """
+    Where the time of one ``fit`` goes, logged per epoch under ``phase``.
+
+    Per epoch: wall time split into training and validation, images/sec,
+    every train step's wall time (median / p90 too), the host gap between
+    steps (callbacks, Python) and host / device memory peaks. The first step
+    of a fit (tracing / XLA compilation) is reported separately.
+
+    After the first epoch, if ``data`` (the training input) is given, a
+    one-off probe times ``probe_batches`` batches of input alone and the
+    model's own compiled train step (same XLA / precision settings and
+    optimizer update as ``fit``) on one cached batch. Input wait per step is
+    then step time minus that compute time, which tells whether the input
+    pipeline or the model is the bottleneck. The probe puts weights,
+    BatchNorm statistics, optimizer and metric state back afterwards.
+
+    ``profile_steps=(first, last)`` captures a TensorBoard profiler trace of
+    those steps (counted from 1 across the fit) into ``profile_dir``.
+
+    Results go into ``log[phase]``; pass the same dict to every fit of a run
+    and write it with write_telemetry().
+    """
+
+    def __init__(self, log, phase, num_images, data=None, probe_batches=5,
+                 profile_steps=None, profile_dir=None, label=None, verbose=1):
+        super().__init__()
+        self.log = log
+        self.phase = phase
+        self.num_images = num_images
+        self.data = data
+        self.probe_batches = probe_batches
+        self.profile_steps = profile_steps
+        self.profile_dir = profile_dir
+        self.label = label or phase
+        self.verbose = verbose
+        self._profiling = False
+
+    @property
+    def entry(self):
+        return self.log.setdefault(self.phase, {'epochs': []})
+
+    def on_train_begin(self, logs=None):
+        self._step = 0
+        self._first_step_ms = None
+        self._last_step_end = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        reset_peak_memory()
+        self._step_times = []
+        self._gaps = []
+        self._train_seconds = None
+        self._epoch_start = time.perf_counter()
+
+    def on_train_batch_begin(self, batch, logs=None):
+        self._step += 1
+        if self.profile_steps and self._step == self.profile_steps[0]:
+            tf.profiler.experimental.start(self.profile_dir)
+            self._profiling = True
+        now = time.perf_counter()
+        if self._last_step_end is not None and batch > 0:
+            self._gaps.append(now - self._last_step_end)
+        self._step_start = now
+
+    def on_train_batch_end(self, batch, logs=None):
+        self._last_step_end = time.perf_counter()
+        elapsed = self._last_step_end - self._step_start
+        if self._first_step_ms is None:
+            self._first_step_ms = _ms(elapsed)
+        else:
+            self._step_times.append(elapsed)
+        if self._profiling and self._step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+    def on_test_begin(self, logs=None):
+        if self._train_seconds is None:
+            self._train_seconds = time.perf_counter() - self._epoch_start
+
+    def on_epoch_end(self, epoch, logs=None):
+        wall = time.perf_counter() - self._epoch_start
+        train_seconds = self._train_seconds if self._train_seconds is not None else wall
+        steps = sorted(self._step_times)
+        record = {
+            'epoch': epoch + 1,
+            'wall_seconds': round(wall, 3),
+            'train_seconds': round(train_seconds, 3),
+            'validation_seconds': round(wall - train_seconds, 3),
+            'images_per_sec': round(self.num_images / train_seconds, 2) if train_seconds > 0 else 0.0,
+            'step_ms_median': _ms(statistics.median(steps)) if steps else None,
+            'step_ms_p90': _ms(steps[int(0.9 * (len(steps) - 1))]) if steps else None,
+            'host_gap_ms_median': _ms(statistics.median(self._gaps)) if self._gaps else None,
+            'host_peak_mb': round(host_peak_memory_mb(), 1),
+            'device_peak_mb': device_peak_memory_mb(),
+            'step_ms': [_ms(t) for t in self._step_times],
+        }
+        if self._first_step_ms is not None and not self.entry['epochs']:
+            self.entry['first_step_ms'] = self._first_step_ms
+        self.entry['epochs'].append(record)
+
+        if self.data is not None and 'probe' not in self.entry and steps:
+            self.entry['probe'] = self._probe(statistics.median(steps))
+
+        if logs is not None:
+            logs['images_per_sec'] = record['images_per_sec']
+            if steps:
+                logs['step_ms'] = record['step_ms_median']
+        if self.verbose:
+            memory = record['device_peak_mb'] or record['host_peak_mb']
+            step = f"{record['step_ms_median']:.1f}" if steps else '-'
+            print(f"Epoch {epoch + 1} [{self.label}]: {record['images_per_sec']:.1f} images/sec "
+                  f"({train_seconds:.1f}s training), {step} ms/step (median), peak memory {memory:.0f} MB")
+
+    def on_train_end(self, logs=None):
+        if self._profiling:
+            self._stop_profiler()
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self._profiling = False
+        self.entry['profile'] = {'steps': list(self.profile_steps), 'logdir': self.profile_dir}
+        if self.verbose:
+            print(f"Profiler trace of steps {self.profile_steps[0]}-{self.profile_steps[1]} "
+                  f"written to {self.profile_dir} (tensorboard --logdir {self.profile_dir})")
+
+    def _probe(self, step_seconds):
+        """Time input alone and the compiled train step alone (see class docstring)."""
+        iterator = iter(batches(self.data))
+        x, y = next(iterator)[:2]  # also the warm-up batch
+        start = time.perf_counter()
+        pulled = 0
+        for _ in range(self.probe_batches):
+            try:
+                next(iterator)
+            except StopIteration:
+                break
+            pulled += 1
+        input_seconds = (time.perf_counter() - start) / pulled if pulled else None
+
+        model = self.model
+        # The train step updates weights, BatchNorm statistics, optimizer and metrics: put them back after
+        optimizer_variables = model.optimizer.variables
+        if callable(optimizer_variables):  # a method on Keras 2's legacy optimizers
+            optimizer_variables = optimizer_variables()
+        variables = (list(model.variables) + list(optimizer_variables)
+                     + list(getattr(model, 'metrics_variables', [])))
+        saved = [v.numpy() for v in variables]
+        train_function = model.make_train_function()
+        iterator = iter(tf.data.Dataset.from_tensors((x, y)).repeat())
+        train_function(iterator)  # traces / compiles for the cached batch's shape
+        times = []
+        for _ in range(self.probe_batches):
+            start = time.perf_counter()
+            logs = train_function(iterator)
+            tf.nest.map_structure(np.asarray, logs)  # wait for the device
+            times.append(time.perf_counter() - start)
+        for variable, value in zip(variables, saved):
+            variable.assign(value)
+        compute_seconds = statistics.median(times) if times else step_seconds
+        input_wait = max(0.0, step_seconds - compute_seconds)
+
+        probe = {
+            'step_ms': _ms(step_seconds),
+            'input_ms_per_batch': _ms(input_seconds) if input_seconds is not None else None,
+            'compute_ms_per_batch': _ms(compute_seconds),
+            'input_wait_ms_per_step': _ms(input_wait),
+            # Input-bound when fit waits on the pipeline for a noticeable share of the step
+            'bottleneck': 'input' if input_wait > 0.1 * step_seconds else 'compute',
+        }
+        if self.verbose:
+            print(f"[{self.label}] input {probe['input_ms_per_batch']} ms/batch, compute "
+                  f"{probe['compute_ms_per_batch']} ms/batch, ~{probe['input_wait_ms_per_step']} ms "
+                  f"input wait per step -> {probe['bottleneck']}-bound")
+        return probe
+
+
+def write_telemetry(log, path):
+    """Write the shared PerformanceTelemetry log to ``path`` as JSON."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(log, f, indent=2)
+    os.replace(path + '.tmp', path)
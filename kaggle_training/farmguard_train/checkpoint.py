@@ -0,0 +1,229 @@
+"""
+Resumable, phase-aware training checkpoints.
+
+A run is a sequence of named phases (``phase1``, ``phase2``, ``prune``,
+``distill``). While a phase trains, PhaseCheckpoint writes the full training
+state at the end of every epoch into ``<directory>/<phase>/``:
+
+    model.weights.h5   model weights
+    optimizer.npz      optimizer variables (iteration count, learning rate,
+                       Adam slots, loss scale)
+    callbacks.npz      EarlyStopping best weights
+    epoch.json         epochs done, learning rate and the EarlyStopping /
+                       ReduceLROnPlateau / ModelCheckpoint counters
+
+When a phase finishes, its final weights are stored as
+``<phase>.weights.h5`` and the phase is marked done in ``state.json``. A rerun
+of the script skips finished phases (restoring their weights), continues an
+interrupted phase from its last epoch with ``fit(initial_epoch=...)`` and
+picks up the same learning-rate schedule. Checkpoints are per epoch, so the
+data position is the epoch counter: at most one epoch of work is repeated.
+"""
+
+import json
+import os
+import shutil
+import warnings
+
+import numpy as np
+import tensorflow as tf
+
+STATE_NAME = 'state.json'
+
+# Counters of the stock callbacks that need to survive a restart
+_CALLBACK_STATE = {
+    'EarlyStopping': ('wait', 'best', 'best_epoch', 'stopped_epoch'),
+    'ReduceLROnPlateau': ('wait', 'best', 'cooldown_counter'),
+    'ModelCheckpoint': ('best',),
+}
+
+
+def _write_json(path, data):
+    # Written to a temp file first so a session killed mid-write leaves the
+    # previous checkpoint intact
+    with open(path + '.tmp', 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _save_weights(model, path):
+    temp = path.replace('.weights.h5', '.tmp.weights.h5')
+    model.save_weights(temp)
+    os.replace(temp, path)
+
+
+def _to_json(value):
+    if isinstance(value, (np.floating, np.integer)):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return str(value)
+    return value
+
+
+def _from_json(value):
+    if value in ('inf', '-inf', 'nan'):
+        return float(value)
+    return value
+
+
+class TrainingCheckpoint:
+    """
+    Checkpoint folder of one training run.
+
+    ``config`` (any JSON-able dict) is stored with the state; when a rerun
+    passes a different config the old checkpoints are discarded instead of
+    being resumed into a different experiment.
+    """
+
+    def __init__(self, directory, config=None):
+        self.directory = directory
+        self.config = config or {}
+        os.makedirs(directory, exist_ok=True)
+        self.state = {'config': self.config, 'completed_phases': []}
+
+        path = os.path.join(directory, STATE_NAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('config') == self.config:
+                self.state = state
+            else:
+                print(f"Config changed since the checkpoint in {directory}, starting fresh")
+                self.reset()
+        self._save_state()
+
+        done = self.state['completed_phases']
+        running = [p for p in os.listdir(directory) if self.initial_epoch(p)]
+        if done or running:
+            print(f"Resuming from {directory}: done {done or 'nothing'}"
+                  + (f", {running[0]} at epoch {self.initial_epoch(running[0])}" if running else ""))
+
+    def _save_state(self):
+        _write_json(os.path.join(self.directory, STATE_NAME), self.state)
+
+    def _phase_dir(self, phase):
+        return os.path.join(self.directory, phase)
+
+    def reset(self):
+        """Delete every checkpoint in the folder."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        self.state = {'config': self.config, 'completed_phases': []}
+
+    def phase_done(self, phase):
+        return phase in self.state['completed_phases']
+
+    def initial_epoch(self, phase):
+        """Epochs of ``phase`` already trained (pass to ``fit(initial_epoch=...)``)."""
+        path = os.path.join(self._phase_dir(phase), 'epoch.json')
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f)['epoch']
+
+    def remember(self, key, compute):
+        """``compute()`` once per run; later resumes get the stored value."""
+        values = self.state.setdefault('values', {})
+        if key not in values:
+            values[key] = compute()
+            self._save_state()
+        return values[key]
+
+    def callback(self, phase, callbacks=()):
+        """
+        PhaseCheckpoint for ``phase``; put it after ``callbacks`` (the other
+        callbacks of the same fit) so their state is restored after they reset.
+        """
+        return PhaseCheckpoint(self._phase_dir(phase), callbacks)
+
+    def finish_phase(self, phase, model):
+        """Store the final weights of ``phase`` and drop its epoch checkpoints."""
+        _save_weights(model, os.path.join(self.directory, f'{phase}.weights.h5'))
+        self.state['completed_phases'].append(phase)
+        self._save_state()
+        shutil.rmtree(self._phase_dir(phase), ignore_errors=True)
+
+    def restore_phase(self, phase, model):
+        """Load the final weights of a finished ``phase`` into ``model``."""
+        with warnings.catch_warnings():
+            # Keras 3 also stores the optimizer, which the next phase replaces
+            warnings.simplefilter('ignore')
+            model.load_weights(os.path.join(self.directory, f'{phase}.weights.h5'))
+        print(f"Skipping {phase}: restored its weights from {self.directory}")
+
+
+class PhaseCheckpoint(tf.keras.callbacks.Callback):
+    """
+    Save model, optimizer and callback state after every epoch and restore it
+    at the start of training (see module docstring).
+    """
+
+    def __init__(self, directory, callbacks=()):
+        super().__init__()
+        self.directory = directory
+        self.callbacks = [cb for cb in callbacks if type(cb).__name__ in _CALLBACK_STATE]
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def on_train_begin(self, logs=None):
+        if not os.path.exists(self._path('epoch.json')):
+            return
+        with open(self._path('epoch.json')) as f:
+            state = json.load(f)
+
+        optimizer = self.model.optimizer
+        saved = np.load(self._path('optimizer.npz'))
+        if len(optimizer.variables) < len(saved.files):
+            # Slots are created lazily on the first step
+            optimizer.build(self.model.trainable_variables)
+        self.model.load_weights(self._path('model.weights.h5'))
+        if len(saved.files) == len(optimizer.variables):
+            for i, variable in enumerate(optimizer.variables):
+                variable.assign(saved[f'arr_{i}'])
+        else:
+            print(f"Optimizer changed, only restoring weights from {self.directory}")
+        optimizer.learning_rate.assign(state['learning_rate'])
+
+        best_weights = np.load(self._path('callbacks.npz'))
+        for i, (cb, attrs) in enumerate(zip(self.callbacks, state['callbacks'])):
+            for name, value in attrs.items():
+                setattr(cb, name, _from_json(value))
+            if f'{i}_0' in best_weights.files:
+                cb.best_weights = [best_weights[f'{i}_{j}']
+                                   for j in range(len(self.model.get_weights()))]
+
+        print(f"Resumed from {self.directory} after epoch {state['epoch']} "
+              f"(learning rate {state['learning_rate']:.2e})")
+
+    def on_epoch_end(self, epoch, logs=None):
+        os.makedirs(self.directory, exist_ok=True)
+        _save_weights(self.model, self._path('model.weights.h5'))
+
+        optimizer = self.model.optimizer
+        with open(self._path('optimizer.tmp.npz'), 'wb') as f:
+            np.savez(f, *[np.asarray(v) for v in optimizer.variables])
+        os.replace(self._path('optimizer.tmp.npz'), self._path('optimizer.npz'))
+
+        best_weights = {}
+        for i, cb in enumerate(self.callbacks):
+            for j, w in enumerate(getattr(cb, 'best_weights', None) or []):
+                best_weights[f'{i}_{j}'] = w
+        with open(self._path('callbacks.tmp.npz'), 'wb') as f:
+            np.savez(f, **best_weights)
+        os.replace(self._path('callbacks.tmp.npz'), self._path('callbacks.npz'))
+
+        # epoch.json last: it marks the checkpoint as complete
+        _write_json(self._path('epoch.json'), {
+            'epoch': epoch + 1,
+            'learning_rate': float(np.asarray(optimizer.learning_rate)),
+            'callbacks': [
+                {name: _to_json(getattr(cb, name)) for name in _CALLBACK_STATE[type(cb).__name__]
+                 if hasattr(cb, name)}
+                for cb in self.callbacks
+            ],
+        })
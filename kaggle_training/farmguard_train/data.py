@@ -0,0 +1,272 @@
+"""
+tf.data input pipeline for the PlantVillage folder layout.
+
+Drop-in replacement for ``ImageDataGenerator.flow_from_directory``: same
+class ordering, same per-class validation split and the same augmentation
+settings, but JPEG decoding runs in parallel and augmentation runs on the
+graph for a whole batch at once.
+"""
+
+import math
+import os
+from dataclasses import dataclass, field
+
+import numpy as np
+import tensorflow as tf
+
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Formats tf.io.decode_image can read
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif')
+
+PREPROCESSING_MODES = ('rescale', 'mobilenet_v2')
+
+
+@dataclass
+class DirectoryDataset:
+    """A batched tf.data pipeline plus the metadata flow_from_directory exposes."""
+    dataset: tf.data.Dataset
+    class_indices: dict
+    filenames: list
+    classes: np.ndarray
+    batch_size: int
+    preprocessing: str = 'rescale'
+    samples: int = field(init=False)
+
+    def __post_init__(self):
+        self.samples = len(self.filenames)
+
+    @property
+    def steps(self):
+        return math.ceil(self.samples / self.batch_size)
+
+
+def find_classes(directory):
+    """Sorted class sub-folders, exactly as flow_from_directory orders them."""
+    return sorted(
+        d for d in os.listdir(directory)
+        if os.path.isdir(os.path.join(directory, d))
+    )
+
+
+def find_dataset(candidates, search_root='/kaggle/input'):
+    """
+    First existing folder in ``candidates``; failing that, search
+    ``search_root`` for a PlantVillage-looking folder (one holding an
+    ``Apple*`` class, or a plant/tomato/potato folder with many classes).
+    """
+    for path in candidates:
+        if path and os.path.isdir(path):
+            return path
+    if not os.path.isdir(search_root):
+        return None
+    for root, dirs, _ in os.walk(search_root):
+        if any(d.startswith('Apple') for d in dirs):
+            return root
+        for d in dirs:
+            potential = os.path.join(root, d)
+            if any(word in d.lower() for word in ('plant', 'tomato', 'potato')) \
+                    and len(os.listdir(potential)) > 5:
+                return potential
+    return None
+
+
+def dataset_classes(path):
+    """Class names of a raw folder tree or a packed shard folder."""
+    from .shards import is_shard_dir, load_manifest
+    if is_shard_dir(path):
+        return load_manifest(path)['class_names']
+    return find_classes(path)
+
+
+def list_image_files(directory, subset=None, validation_split=0.0, follow_links=False, index=None,
+                     split=None, classes=None):
+    """
+    List (filenames, labels, class_indices) for a class-per-folder dataset.
+
+    Mirrors Keras' DirectoryIterator: files are walked in sorted order per
+    class and the first ``validation_split`` fraction of each class is the
+    'validation' subset, the rest is 'training'. With a DatasetIndex (see
+    index.py) the files come from the index, minus its broken images,
+    instead of from walking the folders. With a SplitManifest (see
+    split.py) the subsets come from the manifest and ``validation_split``
+    is ignored. ``classes`` (flow_from_directory's argument) lists the
+    class folders in label order, e.g. a model's class_names.json.
+    """
+    if subset not in (None, 'training', 'validation'):
+        raise ValueError(f"Invalid subset: {subset!r}")
+    if subset == 'validation':
+        bounds = (0.0, validation_split)
+    elif subset == 'training':
+        bounds = (validation_split, 1.0)
+    else:
+        bounds = None
+
+    if classes is not None:
+        class_names = list(classes)
+    else:
+        class_names = index.class_names if index is not None else find_classes(directory)
+    class_indices = {name: i for i, name in enumerate(class_names)}
+
+    filenames, labels = [], []
+    for name in class_names:
+        if split is not None and subset is not None:
+            files = split.class_files(name, subset)
+            filenames.extend(files)
+            labels.extend([class_indices[name]] * len(files))
+            continue
+        if index is not None:
+            files = index.class_files(name)
+        else:
+            class_dir = os.path.join(directory, name)
+            files = []
+            walk = sorted(os.walk(class_dir, followlinks=follow_links), key=lambda w: w[0])
+            for root, _, fnames in walk:
+                for fname in sorted(fnames):
+                    if fname.lower().endswith(IMAGE_EXTENSIONS):
+                        files.append(os.path.join(root, fname))
+        if bounds:
+            start, stop = int(bounds[0] * len(files)), int(bounds[1] * len(files))
+            files = files[start:stop]
+        filenames.extend(files)
+        labels.extend([class_indices[name]] * len(files))
+
+    return filenames, np.asarray(labels, dtype=np.int32), class_indices
+
+
+def preprocess(images, mode):
+    """Normalize float images in [0, 255] the same way the generators do."""
+    if mode == 'rescale':
+        return images / 255.0
+    if mode == 'mobilenet_v2':
+        return images / 127.5 - 1.0
+    raise ValueError(f"Unknown preprocessing {mode!r}, expected one of {PREPROCESSING_MODES}")
+
+
+def decode_and_resize(path, img_size):
+    """Read one image file into a float32 [img_size, img_size, 3] tensor in [0, 255]."""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, (img_size, img_size), method='bilinear')
+    return tf.ensure_shape(image, (img_size, img_size, 3))
+
+
+def augment_batch(images, rotation_range=0, width_shift_range=0.0, height_shift_range=0.0,
+                  shear_range=0.0, zoom_range=0.0, horizontal_flip=False,
+                  vertical_flip=False, fill_mode='nearest'):
+    """
+    Random affine augmentation for a whole [N, H, W, C] batch in one op.
+
+    Takes the same arguments as ImageDataGenerator (rotation and shear in
+    degrees, shifts as a fraction of the image size, zoom as +/- range) so a
+    single settings dict can drive either pipeline.
+    """
+    shape = tf.shape(images)
+    n = shape[0]
+    height = tf.cast(shape[1], tf.float32)
+    width = tf.cast(shape[2], tf.float32)
+
+    if any((rotation_range, width_shift_range, height_shift_range, shear_range, zoom_range)):
+        def uniform(limit):
+            return tf.random.uniform([n], -limit, limit)
+
+        theta = uniform(float(rotation_range)) * (math.pi / 180.0)
+        shear = uniform(float(shear_range)) * (math.pi / 180.0)
+        tx = uniform(float(width_shift_range)) * width
+        ty = uniform(float(height_shift_range)) * height
+        zx = 1.0 + uniform(float(zoom_range))
+        zy = 1.0 + uniform(float(zoom_range))
+
+        # Output -> input mapping around the image centre: rotation @ shear @ zoom
+        a0 = tf.cos(theta) * zx
+        a1 = -tf.sin(theta + shear) * zy
+        b0 = tf.sin(theta) * zx
+        b1 = tf.cos(theta + shear) * zy
+        cx = (width - 1.0) / 2.0
+        cy = (height - 1.0) / 2.0
+        a2 = cx - a0 * cx - a1 * cy + tx
+        b2 = cy - b0 * cx - b1 * cy + ty
+        zeros = tf.zeros_like(a0)
+        transforms = tf.stack([a0, a1, a2, b0, b1, b2, zeros, zeros], axis=1)
+
+        images = tf.raw_ops.ImageProjectiveTransformV3(
+            images=images,
+            transforms=transforms,
+            output_shape=shape[1:3],
+            fill_value=0.0,
+            interpolation='BILINEAR',
+            fill_mode=fill_mode.upper(),
+        )
+
+    def random_flip(batch, axis):
+        flip = tf.random.uniform([n, 1, 1, 1]) < 0.5
+        return tf.where(flip, tf.reverse(batch, axis=[axis]), batch)
+
+    if horizontal_flip:
+        images = random_flip(images, 2)
+    if vertical_flip:
+        images = random_flip(images, 1)
+    return images
+
+
+def directory_dataset(directory, subset=None, img_size=224, batch_size=32,
+                      preprocessing='rescale', augmentation=None,
+                      validation_split=0.0, shuffle=True, seed=None, index=None, split=None, classes=None):
+    """
+    Build a parallel, prefetching tf.data pipeline over a class-per-folder tree.
+
+    ``augmentation`` is a dict of ImageDataGenerator-style settings (or None).
+    Labels are one-hot, matching ``class_mode='categorical'``. If
+    ``directory`` is a packed shard folder (see shards.py) the pre-decoded
+    shards are streamed instead. ``index`` is an optional DatasetIndex to
+    list the files from, ``split`` an optional SplitManifest to take the
+    subsets from, ``classes`` the class folders in label order.
+    """
+    from .shards import is_shard_dir, shard_dataset
+    if is_shard_dir(directory):
+        if classes is not None and list(classes) != dataset_classes(directory):
+            raise ValueError(f"Shard folder {directory} stores the classes {dataset_classes(directory)}, "
+                             f"cannot relabel them as {list(classes)}")
+        return shard_dataset(
+            directory, subset=subset, img_size=img_size, batch_size=batch_size,
+            preprocessing=preprocessing, augmentation=augmentation,
+            validation_split=validation_split, shuffle=shuffle, seed=seed, split=split,
+        )
+
+    filenames, labels, class_indices = list_image_files(
+        directory, subset, validation_split, index=index, split=split, classes=classes)
+    if not filenames:
+        raise ValueError(f"No images found in {directory} (subset={subset})")
+    return file_dataset(filenames, labels, class_indices, img_size, batch_size, preprocessing,
+                        augmentation, shuffle, seed)
+
+
+def file_dataset(filenames, labels, class_indices, img_size=224, batch_size=32, preprocessing='rescale',
+                 augmentation=None, shuffle=True, seed=None):
+    """directory_dataset's pipeline over an explicit list of files and integer labels."""
+    if preprocessing not in PREPROCESSING_MODES:
+        raise ValueError(f"Unknown preprocessing {preprocessing!r}, expected one of {PREPROCESSING_MODES}")
+    labels = np.asarray(labels, dtype=np.int32)
+    num_classes = len(class_indices)
+
+    ds = tf.data.Dataset.from_tensor_slices((list(filenames), labels))
+    if shuffle:
+        ds = ds.shuffle(len(filenames), seed=seed, reshuffle_each_iteration=True)
+    ds = ds.map(
+        lambda path, label: (decode_and_resize(path, img_size), tf.one_hot(label, num_classes)),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=not shuffle,
+    )
+    ds = ds.batch(batch_size)
+    if augmentation:
+        ds = ds.map(lambda x, y: (augment_batch(x, **augmentation), y), num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: (preprocess(x, preprocessing), y), num_parallel_calls=AUTOTUNE)
+    ds = ds.prefetch(AUTOTUNE)
+
+    return DirectoryDataset(
+        dataset=ds,
+        class_indices=class_indices,
+        filenames=list(filenames),
+        classes=labels,
+        batch_size=batch_size,
+        preprocessing=preprocessing,
+    )
@@ -0,0 +1,148 @@
+"""
+Knowledge distillation of the fine-tuned MobileNetV2 into a small student.
+
+The student (MobileNetV2 alpha 0.35 at 96-160 px by default) is trained on
+the teacher's temperature-softened predictions plus the true labels. Teacher
+and student run inside one Keras model, so plain ``model.fit`` on the
+teacher-resolution batches does the whole job on the accelerator:
+
+    image (teacher size) -> teacher (frozen)           -> teacher probs --+
+                        \\-> resize -> student (trained) -> student probs --+-> concat
+
+The student is a normal standalone model afterwards and uses the same
+pixel normalization as the teacher, only a smaller input size.
+"""
+
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV2
+
+from .export import top1_accuracy
+
+_EPSILON = 1e-7
+
+
+def build_student(num_classes, img_size=128, alpha=0.35, weights='imagenet'):
+    """MobileNetV2 (width ``alpha``) + small softmax head at ``img_size`` px."""
+    base = MobileNetV2(
+        weights=weights,
+        include_top=False,
+        alpha=alpha,
+        input_shape=(img_size, img_size, 3)
+    )
+    x = tf.keras.layers.GlobalAveragePooling2D()(base.output)
+    x = tf.keras.layers.Dropout(0.2)(x)
+    outputs = tf.keras.layers.Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return tf.keras.Model(base.input, outputs, name=f'student_mobilenetv2_{alpha}_{img_size}')
+
+
+def distillation_model(teacher, student):
+    """
+    Frozen teacher and trainable student side by side, outputs concatenated.
+    The teacher is a frozen copy, so ``teacher`` itself keeps its trainable
+    flags and weights.
+    """
+    frozen = tf.keras.models.clone_model(teacher)
+    frozen.set_weights(teacher.get_weights())
+    frozen.trainable = False
+    teacher = frozen
+    inputs = tf.keras.Input(shape=teacher.input_shape[1:])
+    teacher_probs = teacher(inputs, training=False)
+    resized = tf.keras.layers.Resizing(*student.input_shape[1:3])(inputs)
+    student_probs = student(resized)
+    outputs = tf.keras.layers.Concatenate(dtype='float32')([student_probs, teacher_probs])
+    return tf.keras.Model(inputs, outputs, name='distillation')
+
+
+def _soften(probs, temperature):
+    # Same as softmax(logits / T): log-probs differ from logits by a constant
+    return tf.nn.log_softmax(tf.math.log(probs + _EPSILON) / temperature)
+
+
+def distillation_loss(num_classes, temperature=4.0, hard_weight=0.1):
+    """
+    hard_weight * CE(labels, student) + (1 - hard_weight) * T^2 * KL(teacher_T || student_T).
+
+    Expects y_pred from distillation_model (student probs, then teacher probs).
+    """
+    def loss(y_true, y_pred):
+        student, teacher = y_pred[:, :num_classes], y_pred[:, num_classes:]
+        hard = tf.keras.losses.categorical_crossentropy(y_true, student)
+        teacher_log = _soften(teacher, temperature)
+        soft = tf.reduce_sum(tf.exp(teacher_log) * (teacher_log - _soften(student, temperature)), axis=-1)
+        return hard_weight * hard + (1.0 - hard_weight) * temperature ** 2 * soft
+    return loss
+
+
+def student_accuracy(num_classes):
+    def accuracy(y_true, y_pred):
+        return tf.keras.metrics.categorical_accuracy(y_true, y_pred[:, :num_classes])
+    return accuracy
+
+
+def count_flops(model):
+    """
+    Approximate FLOPs (2 x multiply-adds) of one image through the conv and
+    dense layers, a hardware-independent latency proxy.
+    """
+    macs = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            macs += count_flops(layer) // 2
+            continue
+        if isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+            _, h, w, c = layer.output.shape
+            macs += h * w * c * np.prod(layer.kernel_size)
+        elif isinstance(layer, tf.keras.layers.Conv2D):
+            _, h, w, c_out = layer.output.shape
+            c_in = layer.input.shape[-1]
+            macs += h * w * c_out * c_in * np.prod(layer.kernel_size)
+        elif isinstance(layer, tf.keras.layers.Dense):
+            macs += layer.input.shape[-1] * layer.units
+    return int(2 * macs)
+
+
+def at_input_size(model, img_size):
+    """Wrap ``model`` so it takes img_size x img_size batches (resized inside)."""
+    return tf.keras.Sequential([
+        tf.keras.Input(shape=(img_size, img_size, 3)),
+        tf.keras.layers.Resizing(*model.input_shape[1:3]),
+        model,
+    ])
+
+
+def distillation_report(teacher, student, val_data, report_path=None):
+    """Params, FLOPs and validation accuracy of teacher vs. student."""
+    teacher_size = teacher.input_shape[1]
+    rows = {}
+    for name, model, evaluated in [
+        ('teacher', teacher, teacher),
+        ('student', student, at_input_size(student, teacher_size)),
+    ]:
+        rows[name] = {
+            'input_size': model.input_shape[1],
+            'params': int(model.count_params()),
+            'flops': count_flops(model),
+            'val_accuracy': top1_accuracy(evaluated, val_data),
+        }
+    report = {
+        **rows,
+        'flops_ratio': rows['teacher']['flops'] / max(rows['student']['flops'], 1),
+        'accuracy_delta': rows['student']['val_accuracy'] - rows['teacher']['val_accuracy'],
+    }
+
+    print(f"\n{'model':<10}{'input':>7}{'params':>12}{'MFLOPs':>10}{'val_acc':>10}")
+    for name, row in rows.items():
+        print(f"{name:<10}{row['input_size']:>7}{row['params']:>12,}"
+              f"{row['flops'] / 1e6:>10.1f}{row['val_accuracy'] * 100:>9.2f}%")
+    print(f"Student is {report['flops_ratio']:.1f}x cheaper, "
+          f"accuracy delta {report['accuracy_delta'] * 100:+.2f} points")
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
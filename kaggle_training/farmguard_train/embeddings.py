@@ -0,0 +1,314 @@
+"""
+Leaf embeddings and an approximate nearest-neighbour index over them.
+
+The pooled backbone output of a trained model (GlobalAveragePooling2D,
+1280 values for MobileNetV2) is L2-normalized and stored for every
+training image as a float16 matrix. Search uses an IVF-PQ index built
+with NumPy alone:
+
+* IVF: k-means splits the embeddings into ``nlist`` cells; a query only
+  visits the ``nprobe`` cells whose centroids are closest.
+* PQ: each embedding's residual to its cell centroid is cut into ``m``
+  sub-vectors, each stored as one byte (the nearest of 256 sub-centroids),
+  so distances to a whole cell are table lookups.
+* The ``rerank`` best PQ candidates are re-scored exactly against the
+  float16 embeddings, so the returned similarities are true cosines.
+
+The validation images set an out-of-distribution threshold: a scan whose
+nearest training image is less similar than for 95% of validation images
+is flagged.
+
+    python -m farmguard_train.embeddings build farmguard_output/model_output PlantVillage/ \\
+        --split-manifest farmguard_output/split_manifest.json --output-dir farmguard_embeddings
+    python -m farmguard_train.embeddings query farmguard_embeddings photo.jpg --k 5
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .data import decode_and_resize, directory_dataset, preprocess
+from .export import batches
+from .features import backbone_model
+from .predict import MODEL_NAME
+from .split import SplitManifest
+
+INDEX_FORMAT = 'farmguard-embeddings-v1'
+OOD_PERCENTILE = 5
+
+
+def embed(backbone, data):
+    """L2-normalized float32 embeddings of one pass of ``data`` ((images, labels) batches)."""
+    chunks = []
+    for images, _ in batches(data):
+        features = tf.cast(backbone(images, training=False), tf.float32)
+        chunks.append(tf.math.l2_normalize(features, axis=-1).numpy())
+    return np.concatenate(chunks)
+
+
+def _nearest(x, centroids, block=8192):
+    """Index of the nearest centroid (squared L2) for every row of ``x``."""
+    norms = (centroids ** 2).sum(axis=1)
+    nearest = np.empty(len(x), dtype=np.int64)
+    for start in range(0, len(x), block):
+        chunk = np.asarray(x[start:start + block], dtype=np.float32)
+        nearest[start:start + block] = (norms[None] - 2 * chunk @ centroids.T).argmin(axis=1)
+    return nearest
+
+
+def kmeans(x, k, iterations=20, seed=0):
+    """(centroids, assignment) of plain Lloyd k-means; empty clusters are re-seeded."""
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = _nearest(x, centroids)
+        counts = np.bincount(assignment, minlength=k)
+        order = np.argsort(assignment, kind='stable')
+        filled = np.flatnonzero(counts)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])[filled]
+        centroids[filled] = np.add.reduceat(x[order], starts, axis=0) / counts[filled, None]
+        empty = counts == 0
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids, _nearest(x, centroids)
+
+
+class IVFPQIndex:
+    """Inverted-file index with product-quantized residuals (see module docstring)."""
+
+    def __init__(self, centroids, codebooks, codes, ids, offsets):
+        self.centroids = centroids  # (nlist, dim) float32
+        self.codebooks = codebooks  # (m, ksub, dim / m) float32
+        self.codes = codes  # (N, m) uint8, grouped by cell
+        self.ids = ids  # (N,) row of each code in the embedding matrix
+        self.offsets = offsets  # (nlist + 1,) start of each cell in codes / ids
+
+    @classmethod
+    def build(cls, embeddings, nlist=None, m=32, iterations=20, train_size=20000, seed=0):
+        """Train the coarse and product quantizers on (a sample of) ``embeddings`` and encode them all."""
+        x = np.asarray(embeddings, dtype=np.float32)
+        n, dim = x.shape
+        if dim % m:
+            raise ValueError(f"Embedding size {dim} is not divisible into {m} sub-vectors")
+        nlist = nlist or max(1, int(4 * np.sqrt(n)))
+        rng = np.random.default_rng(seed)
+        sample = x[rng.choice(n, min(n, train_size), replace=False)]
+
+        centroids, _ = kmeans(sample, nlist, iterations, seed)
+        assignment = _nearest(x, centroids)
+        residuals = x - centroids[assignment]
+        sub = dim // m
+        codebooks = np.stack([
+            kmeans((sample - centroids[_nearest(sample, centroids)])[:, j * sub:(j + 1) * sub],
+                   256, iterations, seed + j)[0]
+            for j in range(m)
+        ])
+        codes = np.stack([_nearest(residuals[:, j * sub:(j + 1) * sub], codebooks[j]) for j in range(m)],
+                         axis=1).astype(np.uint8)
+
+        order = np.argsort(assignment, kind='stable')
+        counts = np.bincount(assignment, minlength=len(centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        return cls(centroids, codebooks, codes[order], order.astype(np.int64), offsets)
+
+    def candidates(self, query, nprobe=8, limit=64):
+        """Rows of the ``limit`` best PQ matches of one normalized ``query`` (float32 (dim,))."""
+        m, _, sub = self.codebooks.shape
+        # Nearest non-empty cells only, so nprobe is not spent on empty ones
+        cells = np.flatnonzero(np.diff(self.offsets))
+        cells = cells[np.argsort(((self.centroids[cells] - query) ** 2).sum(axis=1))[:nprobe]]
+        ids, distances = [], []
+        for cell in cells:
+            start, stop = self.offsets[cell], self.offsets[cell + 1]
+            residual = (query - self.centroids[cell]).reshape(m, 1, sub)
+            table = ((self.codebooks - residual) ** 2).sum(axis=2)  # (m, ksub)
+            distances.append(table[np.arange(m), self.codes[start:stop]].sum(axis=1))
+            ids.append(self.ids[start:stop])
+        if not ids:
+            return np.zeros(0, dtype=np.int64)
+        ids, distances = np.concatenate(ids), np.concatenate(distances)
+        best = np.argpartition(distances, min(limit, len(ids)) - 1)[:limit]
+        return ids[best]
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, codebooks=self.codebooks, codes=self.codes,
+                 ids=self.ids, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        return cls(data['centroids'], data['codebooks'], data['codes'], data['ids'], data['offsets'])
+
+
+class EmbeddingIndex:
+    """float16 reference embeddings with their labels / paths, an IVFPQIndex and the OOD threshold."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, 'index.json')) as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT:
+            raise ValueError(f"{directory} is not a {INDEX_FORMAT} index")
+        self.meta = meta
+        self.class_names = meta['class_names']
+        self.paths = meta['paths']
+        self.embeddings = np.load(os.path.join(directory, 'embeddings.npy'), mmap_mode='r')
+        self.labels = np.load(os.path.join(directory, 'labels.npy'))
+        self.index = IVFPQIndex.load(os.path.join(directory, 'ivfpq.npz'))
+
+    def search(self, queries, k=5, nprobe=None, rerank=None):
+        """
+        (rows, similarities), each (len(queries), k): the ``k`` most similar
+        reference images of every query embedding, best first (-1 / nan pad).
+        """
+        nprobe = nprobe or self.meta['nprobe']
+        rerank = max(k, rerank or self.meta['rerank'])
+        queries = np.asarray(queries, dtype=np.float32)
+        queries = queries / np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+        rows = np.full((len(queries), k), -1, dtype=np.int64)
+        similarities = np.full((len(queries), k), np.nan, dtype=np.float32)
+        for i, query in enumerate(queries):
+            candidates = np.sort(self.index.candidates(query, nprobe, rerank))
+            scores = np.asarray(self.embeddings[candidates], dtype=np.float32) @ query
+            best = np.argsort(-scores)[:k]
+            rows[i, :len(best)] = candidates[best]
+            similarities[i, :len(best)] = scores[best]
+        return rows, similarities
+
+    def query(self, queries, k=5, nprobe=None, rerank=None):
+        """Per query: neighbours (path, class, similarity) and the out-of-distribution flag."""
+        rows, similarities = self.search(queries, k, nprobe, rerank)
+        results = []
+        for row, sims in zip(rows, similarities):
+            neighbours = [{'path': self.paths[r], 'class': self.class_names[self.labels[r]],
+                           'similarity': round(float(s), 4)} for r, s in zip(row, sims) if r >= 0]
+            top = float(sims[0]) if neighbours else -1.0
+            results.append({
+                'neighbours': neighbours,
+                'out_of_distribution': top < self.meta['ood_threshold'],
+            })
+        return results
+
+
+def build_embedding_index(model, data, val_data, class_names, output_dir, nlist=None, m=32,
+                          nprobe=8, rerank=64, model_dir=None):
+    """
+    Embed ``data`` (unshuffled, unaugmented DirectoryDataset of the
+    reference images) with ``model``'s backbone, build the index in
+    ``output_dir`` and calibrate the OOD threshold on ``val_data`` (same
+    kind, or a Keras generator). ``model_dir`` is recorded for queries.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    backbone = backbone_model(model)
+    start = time.perf_counter()
+    embeddings = embed(backbone, data.dataset)
+    print(f"Embedded {len(embeddings)} images in {time.perf_counter() - start:.1f}s")
+    np.save(os.path.join(output_dir, 'embeddings.npy'), embeddings.astype(np.float16))
+    np.save(os.path.join(output_dir, 'labels.npy'), np.asarray(data.classes, dtype=np.int32))
+
+    start = time.perf_counter()
+    index = IVFPQIndex.build(embeddings, nlist=nlist, m=m)
+    index.save(os.path.join(output_dir, 'ivfpq.npz'))
+    print(f"Built IVF-PQ index ({len(index.centroids)} cells, {m} bytes per image) "
+          f"in {time.perf_counter() - start:.1f}s")
+
+    meta = {
+        'format': INDEX_FORMAT,
+        'class_names': list(class_names),
+        'paths': list(data.filenames),
+        'dim': int(embeddings.shape[1]),
+        'nlist': int(len(index.centroids)),
+        'm': m,
+        'nprobe': nprobe,
+        'rerank': rerank,
+        'ood_threshold': -1.0,
+        'model': os.path.abspath(model_dir) if model_dir else None,
+    }
+    with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+        json.dump(meta, f)
+
+    if val_data is not None:
+        lookup = EmbeddingIndex(output_dir)
+        val_embeddings = embed(backbone, getattr(val_data, 'dataset', val_data))
+        start = time.perf_counter()
+        rows, similarities = lookup.search(val_embeddings, k=1)
+        seconds = time.perf_counter() - start
+        meta['ood_threshold'] = float(np.percentile(similarities[:, 0], OOD_PERCENTILE))
+        meta['validation'] = {
+            'images': int(len(rows)),
+            'nearest_label_accuracy': float(np.mean(lookup.labels[rows[:, 0]] == val_data.classes)),
+            'ms_per_query': round(seconds * 1000 / max(1, len(rows)), 3),
+        }
+        with open(os.path.join(output_dir, 'index.json'), 'w') as f:
+            json.dump(meta, f)
+        print(f"Nearest-neighbour label accuracy on validation "
+              f"{meta['validation']['nearest_label_accuracy'] * 100:.2f}%, "
+              f"{meta['validation']['ms_per_query']:.2f} ms/query, "
+              f"OOD threshold similarity {meta['ood_threshold']:.4f}")
+    return meta
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="embed the training images and build the index")
+    build.add_argument('model', help="model_output folder of a training run")
+    build.add_argument('dataset', help="class-per-folder image tree or shard folder")
+    build.add_argument('--split-manifest', help="index the training subset of this split (split.py)")
+    build.add_argument('--validation-split', type=float, default=0.2,
+                       help="filename-order split when no --split-manifest is given")
+    build.add_argument('--output-dir', default='farmguard_embeddings')
+    build.add_argument('--nlist', type=int, help="IVF cells (default 4 * sqrt(images))")
+    build.add_argument('--m', type=int, default=32, help="PQ bytes per image")
+    build.add_argument('--batch-size', type=int, default=64)
+    query = commands.add_parser('query', help="most similar indexed images of some photos")
+    query.add_argument('index', help="output folder of 'build'")
+    query.add_argument('images', nargs='+')
+    query.add_argument('--model', help="model_output folder (default: the one the index was built with)")
+    query.add_argument('--k', type=int, default=5)
+    query.add_argument('--nprobe', type=int)
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        model = tf.keras.models.load_model(os.path.join(args.model, MODEL_NAME), compile=False)
+        with open(os.path.join(args.model, 'class_names.json')) as f:
+            class_names = json.load(f)
+        with open(os.path.join(args.model, 'preprocessing.json')) as f:
+            preprocessing = json.load(f)
+        split = SplitManifest.load(args.split_manifest) if args.split_manifest else None
+        data, val_data = [
+            directory_dataset(args.dataset, subset=subset, img_size=preprocessing['input_size'],
+                              batch_size=args.batch_size, preprocessing=preprocessing['preprocessing'],
+                              validation_split=args.validation_split, shuffle=False, split=split,
+                              classes=class_names)
+            for subset in ('training', 'validation')
+        ]
+        build_embedding_index(model, data, val_data, class_names, args.output_dir,
+                              nlist=args.nlist, m=args.m, model_dir=args.model)
+        return
+
+    lookup = EmbeddingIndex(args.index)
+    model_dir = args.model or lookup.meta.get('model')
+    if not model_dir:
+        raise ValueError("Pass --model: the index does not record which model built it")
+    model = tf.keras.models.load_model(os.path.join(model_dir, MODEL_NAME), compile=False)
+    with open(os.path.join(model_dir, 'preprocessing.json')) as f:
+        preprocessing = json.load(f)
+    images = tf.stack([decode_and_resize(path, preprocessing['input_size']) for path in args.images])
+    embeddings = embed(backbone_model(model), [(preprocess(images, preprocessing['preprocessing']), None)])
+    start = time.perf_counter()
+    results = lookup.query(embeddings, args.k, args.nprobe)
+    seconds = time.perf_counter() - start
+    for path, result in zip(args.images, results):
+        print(json.dumps({'image': path, **result}))
+    print(f"{len(results)} queries in {seconds * 1000:.1f} ms", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
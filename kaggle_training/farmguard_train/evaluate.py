@@ -0,0 +1,229 @@
+"""
+Per-class evaluation: confusion matrix, precision / recall and top-k.
+
+Predictions are folded into a num_classes x num_classes confusion matrix
+and per-class top-k hit counts batch by batch and then dropped, so memory
+is O(num_classes^2) whatever the size of the evaluation set. The report is
+JSON keyed by class name (per class, per crop and the full matrix), so two
+model versions can be compared with a plain diff or ``--compare``.
+
+    python -m farmguard_train.evaluate farmguard_output/model_output PlantVillage/ \\
+        --split-manifest farmguard_output/split_manifest.json --output evaluation.json
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from .export import batches
+
+# Keras' clipping in categorical_crossentropy
+EPSILON = 1e-7
+
+
+def crop_name(class_name):
+    """Crop of a PlantVillage class: 'Tomato_Late_blight' -> 'Tomato', 'Pepper__bell___...' -> 'Pepper'."""
+    return class_name.split('_')[0]
+
+
+class ConfusionAccumulator:
+    """Running confusion matrix (rows: true class, columns: predicted), top-k hits and loss."""
+
+    def __init__(self, num_classes, top_k=3):
+        self.num_classes = num_classes
+        self.top_k = min(top_k, num_classes)
+        self.matrix = np.zeros((num_classes, num_classes), dtype=np.int64)
+        self.top_k_hits = np.zeros(num_classes, dtype=np.int64)
+        self.loss_sum = 0.0
+
+    def update(self, labels, probabilities):
+        """Add a batch: integer ``labels`` (N,) and ``probabilities`` (N, num_classes)."""
+        labels = np.asarray(labels, dtype=np.int64)
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        predicted = probabilities.argmax(axis=1)
+        self.matrix += np.bincount(labels * self.num_classes + predicted,
+                                   minlength=self.num_classes ** 2).reshape(self.matrix.shape)
+        top = np.argpartition(-probabilities, self.top_k - 1, axis=1)[:, :self.top_k]
+        hits = (top == labels[:, None]).any(axis=1)
+        self.top_k_hits += np.bincount(labels[hits], minlength=self.num_classes)
+        true_probability = probabilities[np.arange(len(labels)), labels]
+        self.loss_sum += float(-np.log(np.clip(true_probability, EPSILON, 1.0)).sum())
+
+    @property
+    def samples(self):
+        return int(self.matrix.sum())
+
+    def report(self, class_names):
+        return class_report(self.matrix, self.top_k_hits, class_names, self.top_k,
+                            loss=self.loss_sum / self.samples if self.samples else 0.0)
+
+
+def _ratio(numerator, denominator):
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=denominator > 0)
+
+
+def _round(value):
+    return round(float(value), 4)
+
+
+def class_report(matrix, top_k_hits, class_names, top_k=3, loss=None, confused_with=3):
+    """
+    JSON-ready report of a confusion matrix: overall accuracy / top-k /
+    macro and weighted scores, then per class (support, precision, recall,
+    f1, top-1, top-k and the classes it is most often mistaken for), per
+    crop (accuracy, and accuracy counting any class of the right crop as
+    correct) and the matrix itself as {true: {predicted: count}}.
+    """
+    support = matrix.sum(axis=1)
+    correct = np.diag(matrix)
+    precision = _ratio(correct, matrix.sum(axis=0))
+    recall = _ratio(correct, support)
+    f1 = _ratio(2 * precision * recall, precision + recall)
+    top_k_recall = _ratio(top_k_hits, support)
+    total = int(support.sum())
+    present = support > 0
+
+    per_class = {}
+    for i, name in enumerate(class_names):
+        mistakes = [(int(matrix[i, j]), class_names[j]) for j in np.argsort(-matrix[i], kind='stable')
+                    if j != i and matrix[i, j] > 0][:confused_with]
+        per_class[name] = {
+            'support': int(support[i]),
+            'precision': _round(precision[i]),
+            'recall': _round(recall[i]),
+            'f1': _round(f1[i]),
+            'top1': _round(recall[i]),
+            f'top{top_k}': _round(top_k_recall[i]),
+            'confused_with': {other: count for count, other in mistakes},
+        }
+
+    crops = {}
+    for i, name in enumerate(class_names):
+        crops.setdefault(crop_name(name), []).append(i)
+    per_crop = {}
+    for crop, members in crops.items():
+        crop_support = int(support[members].sum())
+        per_crop[crop] = {
+            'support': crop_support,
+            'accuracy': _round(correct[members].sum() / crop_support) if crop_support else 0.0,
+            'crop_accuracy': _round(matrix[np.ix_(members, members)].sum() / crop_support)
+            if crop_support else 0.0,
+        }
+
+    overall = {
+        'samples': total,
+        'accuracy': _round(correct.sum() / total) if total else 0.0,
+        f'top{top_k}_accuracy': _round(top_k_hits.sum() / total) if total else 0.0,
+        'macro_precision': _round(precision[present].mean()) if present.any() else 0.0,
+        'macro_recall': _round(recall[present].mean()) if present.any() else 0.0,
+        'macro_f1': _round(f1[present].mean()) if present.any() else 0.0,
+        'weighted_f1': _round((f1 * support).sum() / total) if total else 0.0,
+    }
+    if loss is not None:
+        overall['loss'] = _round(loss)
+
+    return {
+        'class_names': list(class_names),
+        'overall': overall,
+        'per_class': per_class,
+        'per_crop': per_crop,
+        'confusion_matrix': {
+            name: {other: int(matrix[i, j]) for j, other in enumerate(class_names)}
+            for i, name in enumerate(class_names)
+        },
+    }
+
+
+def evaluate(model, data, class_names, top_k=3, report_path=None):
+    """
+    Stream ``data`` (one-hot labels) through ``model`` once and return the
+    class_report, also written to ``report_path`` when given.
+    """
+    accumulator = ConfusionAccumulator(len(class_names), top_k)
+    for x, y in batches(data):
+        probabilities = tf.cast(model(x, training=False), tf.float32)
+        accumulator.update(np.argmax(y, axis=-1), probabilities)
+    report = accumulator.report(class_names)
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def print_report(report, limit=10):
+    """Overall scores, then the ``limit`` classes with the lowest recall."""
+    overall = report['overall']
+    top_k = next(key for key in overall if key.startswith('top'))
+    print(f"Accuracy {overall['accuracy'] * 100:.2f}%, {top_k.replace('_', ' ')} "
+          f"{overall[top_k] * 100:.2f}%, macro F1 {overall['macro_f1']:.4f} "
+          f"({overall['samples']} images)")
+    worst = sorted(report['per_class'].items(), key=lambda item: (item[1]['recall'], item[0]))
+    print(f"{'class':<40} {'support':>8} {'precision':>10} {'recall':>8}  most confused with")
+    for name, stats in worst[:limit]:
+        confused = ', '.join(f"{other} ({count})" for other, count in stats['confused_with'].items())
+        print(f"{name:<40} {stats['support']:>8} {stats['precision']:>10.4f} "
+              f"{stats['recall']:>8.4f}  {confused or '-'}")
+
+
+def compare_reports(old, new):
+    """Per-class recall / precision changes from ``old`` to ``new``, largest recall change first."""
+    rows = []
+    for name, stats in new['per_class'].items():
+        before = old['per_class'].get(name)
+        if before is None:
+            rows.append((name, None, stats['recall'], None, stats['precision']))
+        else:
+            rows.append((name, before['recall'], stats['recall'], before['precision'], stats['precision']))
+    rows.sort(key=lambda r: -abs(r[2] - r[1]) if r[1] is not None else float('-inf'))
+    return rows
+
+
+def main(argv=None):
+    from .data import directory_dataset
+    from .predict import Predictor
+    from .split import SplitManifest
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder, .keras file or SavedModel")
+    parser.add_argument('dataset', help="class-per-folder image tree or shard folder")
+    parser.add_argument('--split-manifest', help="evaluate the validation subset of this split (split.py)")
+    parser.add_argument('--validation-split', type=float, default=0.0,
+                        help="evaluate the first fraction of each class (filename order)")
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--output', default='evaluation.json')
+    parser.add_argument('--compare', help="earlier report to print per-class changes against")
+    args = parser.parse_args(argv)
+
+    predictor = Predictor(args.model)
+    split = SplitManifest.load(args.split_manifest) if args.split_manifest else None
+    subset = 'validation' if split is not None or args.validation_split else None
+    data = directory_dataset(
+        args.dataset, subset=subset, img_size=predictor.img_size, batch_size=args.batch_size,
+        preprocessing=predictor.preprocessing, validation_split=args.validation_split,
+        shuffle=False, split=split, classes=predictor.class_names,
+    )
+
+    report = evaluate(predictor, data.dataset, predictor.class_names, args.top_k, args.output)
+    print_report(report)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"\nChanges against {args.compare}:")
+        print(f"{'class':<40} {'recall':>17} {'precision':>17}")
+        for name, old_recall, recall, old_precision, precision in compare_reports(old, report):
+            if old_recall is None:
+                print(f"{name:<40} {'new':>8} {recall:>8.4f} {'new':>8} {precision:>8.4f}")
+            else:
+                print(f"{name:<40} {old_recall:>8.4f} {recall:>8.4f} {old_precision:>8.4f} {precision:>8.4f}")
+
+
+if __name__ == '__main__':
+    main()
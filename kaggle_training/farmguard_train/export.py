@@ -0,0 +1,345 @@
+"""
+TensorFlow.js export with weight-quantized variants.
+
+Next to the float32 model we write float16 and uint8 weight-quantized
+copies (``<tfjs_dir>_float16``, ``<tfjs_dir>_uint8``). The accuracy of each
+variant is measured in Python by applying the same quantize/dequantize
+round trip the tfjs converter uses to a copy of the Keras model, so the
+report can pick the smallest variant within an accuracy tolerance.
+
+Graph models go through a SavedModel and tensorflowjs_converter, which
+freezes the variables, folds constants and BatchNorm into the preceding
+convolutions and fuses the activations; layers models keep one op per Keras
+layer and a much larger topology JSON. ``export_format_report`` writes both
+formats of a model and compares their size, ops and (with Node.js and
+@tensorflow/tfjs) load time and first-inference latency.
+"""
+
+import collections
+import functools
+import gzip
+import http.server
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import threading
+
+import numpy as np
+import tensorflow as tf
+
+QUANTIZATIONS = ('float32', 'float16', 'uint8')
+EXPORT_FORMATS = ('graph', 'layers')
+
+# Fewer, larger shards than the converter's 4MB default would serialise the
+# download; browsers fetch up to 6 at a time over HTTP/1.1
+WEIGHT_SHARD_SIZE_BYTES = 1024 * 1024
+
+# Key of our metadata in model.json's userDefinedMetadata
+METADATA_KEY = 'farmguard'
+
+# Loads a tfjs model in Node.js and times it, see tfjs_load_benchmark
+BENCHMARK_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tfjs_benchmark.js')
+
+
+def variant_dir(tfjs_dir, quantization):
+    """Output folder of a variant; float32 keeps the original folder."""
+    if quantization == 'float32':
+        return tfjs_dir
+    return f'{tfjs_dir}_{quantization}'
+
+
+def _import_tfjs():
+    try:
+        import tensorflowjs as tfjs
+    except ImportError:
+        print("tensorflowjs not installed, installing...")
+        subprocess.run(['pip', 'install', 'tensorflowjs', '-q'], check=True)
+        import tensorflowjs as tfjs
+    return tfjs
+
+
+def save_layers_model(model, output_dir, quantization='float32', weight_shard_size_bytes=None, metadata=None):
+    """Write a tfjs layers model (what tf.loadLayersModel expects)."""
+    tfjs = _import_tfjs()
+    dtype_map = None if quantization == 'float32' else {quantization: '*'}
+    options = {}
+    if weight_shard_size_bytes:
+        options['weight_shard_size_bytes'] = weight_shard_size_bytes
+    if metadata:
+        options['metadata'] = {METADATA_KEY: metadata}
+    tfjs.converters.save_keras_model(model, output_dir, quantization_dtype_map=dtype_map, **options)
+
+
+def save_saved_model(model, saved_model_dir):
+    """Write a SavedModel for tensorflowjs_converter (Keras 3: model.export)."""
+    if hasattr(model, 'export'):
+        model.export(saved_model_dir)
+    else:
+        model.save(saved_model_dir, save_format='tf')
+
+
+def convert_saved_model(saved_model_dir, output_dir, quantization='float32', weight_shard_size_bytes=None,
+                        metadata_path=None):
+    """
+    Run tensorflowjs_converter on a SavedModel, producing a tfjs graph model
+    (constants and BatchNorm folded, debug ops stripped). ``metadata_path``
+    is a JSON file embedded in model.json's userDefinedMetadata. Raises
+    RuntimeError with the converter's stderr when it fails.
+    """
+    command = [
+        'tensorflowjs_converter',
+        '--input_format=tf_saved_model',
+        '--output_format=tfjs_graph_model',
+        '--signature_name=serving_default',
+        '--saved_model_tags=serve',
+        '--strip_debug_ops=True',
+    ]
+    if quantization != 'float32':
+        command.append(f'--quantize_{quantization}')
+    if weight_shard_size_bytes:
+        command.append(f'--weight_shard_size_bytes={weight_shard_size_bytes}')
+    if metadata_path:
+        command.append(f'--metadata={METADATA_KEY}:{metadata_path}')
+    result = subprocess.run(command + [saved_model_dir, output_dir], capture_output=True, text=True)
+    print(result.stdout)
+    if result.returncode != 0:
+        # Fail here, not later on a missing model.json, so the converter's own error is what shows
+        raise RuntimeError(f"tensorflowjs_converter failed with exit code {result.returncode} "
+                           f"converting {saved_model_dir} to {output_dir}:\n{result.stderr}")
+    return result
+
+
+def quantize_dequantize(weights, quantization):
+    """Round-trip one weight array through tfjs weight quantization."""
+    if quantization == 'float32' or not np.issubdtype(weights.dtype, np.floating):
+        return weights
+    if quantization == 'float16':
+        return weights.astype(np.float16).astype(weights.dtype)
+    if quantization != 'uint8':
+        raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+
+    min_val = float(weights.min())
+    max_val = float(weights.max())
+    if min_val == max_val:
+        return np.full_like(weights, min_val)
+    # Affine uint8 with the zero point nudged onto the grid, as in tfjs
+    scale = (max_val - min_val) / 255
+    nudged_min = -round(-min_val / scale) * scale
+    nudged_max = 255 * scale + nudged_min
+    q = np.round((weights.clip(nudged_min, nudged_max) - nudged_min) / scale)
+    return (q * scale + nudged_min).astype(weights.dtype)
+
+
+def quantized_copy(model, quantization):
+    """Clone ``model`` with its weights passed through quantize_dequantize."""
+    clone = tf.keras.models.clone_model(model)
+    clone.set_weights([quantize_dequantize(w, quantization) for w in model.get_weights()])
+    return clone
+
+
+def batches(data):
+    """Iterate (x, y) batches of a tf.data dataset or a Keras generator once."""
+    if hasattr(data, '__getitem__') and hasattr(data, '__len__'):
+        for i in range(len(data)):
+            yield data[i]
+    else:
+        yield from data
+
+
+def top1_accuracy(model, data):
+    """Top-1 accuracy over one pass of ``data`` (one-hot labels)."""
+    correct = total = 0
+    for x, y in batches(data):
+        predictions = model(x, training=False)
+        correct += int(np.sum(np.argmax(predictions, axis=-1) == np.argmax(y, axis=-1)))
+        total += len(y)
+    return correct / total if total else 0.0
+
+
+def artifact_size(directory):
+    """(raw bytes, gzipped bytes) of the model.json + weight shards in ``directory``."""
+    raw = compressed = 0
+    for name in sorted(os.listdir(directory)):
+        if not (name == 'model.json' or name.endswith('.bin')):
+            continue
+        with open(os.path.join(directory, name), 'rb') as f:
+            data = f.read()
+        raw += len(data)
+        compressed += len(gzip.compress(data))
+    return raw, compressed
+
+
+def quantization_report(model, val_data, tfjs_dir, quantizations=QUANTIZATIONS,
+                        tolerance=0.01, report_path=None):
+    """
+    Compare the exported variants on size and validation accuracy.
+
+    ``tolerance`` is the largest accuracy drop (absolute, 0.01 = 1 point)
+    allowed against float32; the smallest variant within it is recommended.
+    """
+    baseline = top1_accuracy(model, val_data)
+    variants = []
+    for quantization in quantizations:
+        accuracy = baseline if quantization == 'float32' else top1_accuracy(
+            quantized_copy(model, quantization), val_data)
+        size, gzip_size = artifact_size(variant_dir(tfjs_dir, quantization))
+        variants.append({
+            'quantization': quantization,
+            'path': variant_dir(tfjs_dir, quantization),
+            'size_bytes': size,
+            'gzip_bytes': gzip_size,
+            'val_accuracy': accuracy,
+            'accuracy_delta': accuracy - baseline,
+            'within_tolerance': baseline - accuracy <= tolerance,
+        })
+
+    eligible = [v for v in variants if v['within_tolerance']]
+    recommended = min(eligible, key=lambda v: v['size_bytes'])['quantization'] if eligible else 'float32'
+    report = {
+        'tolerance': tolerance,
+        'float32_val_accuracy': baseline,
+        'recommended': recommended,
+        'variants': variants,
+    }
+
+    print(f"\n{'variant':<10}{'size':>12}{'gzip':>12}{'val_acc':>10}{'delta':>9}")
+    for v in variants:
+        print(f"{v['quantization']:<10}{v['size_bytes'] / 1024:>10.1f}KB{v['gzip_bytes'] / 1024:>10.1f}KB"
+              f"{v['val_accuracy'] * 100:>9.2f}%{v['accuracy_delta'] * 100:>+8.2f}"
+              f"{'' if v['within_tolerance'] else '  (over tolerance)'}")
+    print(f"Recommended (smallest within {tolerance * 100:.1f} points): {recommended}")
+
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def copy_to_variants(path, tfjs_dir, quantizations=QUANTIZATIONS):
+    """Copy a sidecar file (class_names.json, ...) into every variant folder."""
+    for quantization in quantizations:
+        target = variant_dir(tfjs_dir, quantization)
+        if os.path.abspath(os.path.dirname(path)) != os.path.abspath(target):
+            shutil.copy(path, target)
+
+
+def graph_stats(tfjs_dir):
+    """Format, topology / weight bytes, shards and op (or layer) counts of the model.json in ``tfjs_dir``."""
+    with open(os.path.join(tfjs_dir, 'model.json'), 'rb') as f:
+        raw = f.read()
+    manifest = json.loads(raw)
+    topology = manifest.get('modelTopology', {})
+    topology_bytes = len(json.dumps(topology, separators=(',', ':')).encode('utf-8'))
+    shards = [path for group in manifest.get('weightsManifest', []) for path in group['paths']]
+    stats = {
+        'format': manifest.get('format'),
+        'model_json_bytes': len(raw),
+        'topology_bytes': topology_bytes,
+        'weight_bytes': sum(os.path.getsize(os.path.join(tfjs_dir, path)) for path in shards),
+        'weight_shards': len(shards),
+    }
+    if 'node' in topology:
+        ops = collections.Counter(node['op'] for node in topology['node'])
+        stats['nodes'] = sum(ops.values())
+        stats['batch_norm_ops'] = sum(n for op, n in ops.items() if 'BatchNorm' in op)
+        stats['fused_ops'] = sum(n for op, n in ops.items() if op.startswith(('_Fused', 'Fused')))
+        stats['ops'] = dict(ops.most_common())
+    else:
+        layers = topology.get('model_config', topology).get('config', {}).get('layers', [])
+        ops = collections.Counter(layer['class_name'] for layer in layers)
+        stats['nodes'] = sum(ops.values())
+        stats['batch_norm_ops'] = ops.get('BatchNormalization', 0)
+        stats['ops'] = dict(ops.most_common())
+    return stats
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def tfjs_load_benchmark(tfjs_dir, model_format, img_size, runs=3, node='node'):
+    """
+    Median load time, first- and second-inference latency (ms) of the tfjs
+    model in ``tfjs_dir``, served over local HTTP and loaded by Node.js
+    with @tensorflow/tfjs (CPU backend) the way the scanners load
+    /model/model.json, in a fresh process per run. None, with the reason
+    printed, when Node.js or @tensorflow/tfjs is not available.
+    """
+    if shutil.which(node) is None:
+        print(f"Skipping the tfjs load benchmark: {node} not found")
+        return None
+    handler = functools.partial(_QuietHandler, directory=tfjs_dir)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/model.json'
+    # The app's node_modules (two levels up from kaggle_training) when there is one
+    env = dict(os.environ)
+    app_modules = os.path.join(os.path.dirname(BENCHMARK_SCRIPT), '..', '..', 'node_modules')
+    if os.path.isdir(app_modules):
+        env['NODE_PATH'] = os.pathsep.join(filter(None, [env.get('NODE_PATH'), os.path.abspath(app_modules)]))
+    timings = []
+    try:
+        for _ in range(runs):
+            result = subprocess.run([node, BENCHMARK_SCRIPT, model_format, url, str(img_size)],
+                                    capture_output=True, text=True, env=env)
+            if result.returncode != 0:
+                lines = result.stderr.strip().splitlines() or ['no output']
+                reason = next((line for line in lines if 'Error' in line), lines[-1])
+                print(f"Skipping the tfjs load benchmark: {reason.strip()}")
+                return None
+            timings.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    finally:
+        server.shutdown()
+        server.server_close()
+    return {key: round(statistics.median(t[key] for t in timings), 1) for key in timings[0]}
+
+
+def export_format_report(model, saved_model_dir, output_dir, img_size, weight_shard_size_bytes=None,
+                         metadata=None, report_path=None):
+    """
+    Write the float32 ``model`` as a layers model and as a graph model
+    (from ``saved_model_dir``) under ``output_dir`` and compare them:
+    model.json / topology / weight bytes, shards, ops and BatchNorm ops
+    left, and the Node.js load and first-inference timings.
+    """
+    metadata_path = None
+    if metadata:
+        os.makedirs(output_dir, exist_ok=True)
+        metadata_path = os.path.join(output_dir, 'metadata.json')
+        with open(metadata_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+    if not os.path.isdir(saved_model_dir):
+        save_saved_model(model, saved_model_dir)
+
+    formats = {}
+    for model_format in EXPORT_FORMATS:
+        directory = os.path.join(output_dir, model_format)
+        if model_format == 'graph':
+            convert_saved_model(saved_model_dir, directory, weight_shard_size_bytes=weight_shard_size_bytes,
+                                metadata_path=metadata_path)
+        else:
+            save_layers_model(model, directory, weight_shard_size_bytes=weight_shard_size_bytes,
+                              metadata=metadata)
+        stats = graph_stats(directory)
+        stats['gzip_bytes'] = artifact_size(directory)[1]
+        stats['node_tfjs'] = tfjs_load_benchmark(directory, model_format, img_size)
+        formats[model_format] = stats
+
+    print(f"\n{'format':<8}{'model.json':>12}{'weights':>11}{'shards':>8}{'ops':>6}{'BN ops':>8}"
+          f"{'load':>10}{'1st infer':>11}")
+    for model_format, stats in formats.items():
+        timing = stats['node_tfjs'] or {}
+        load = f"{timing['load_ms']:.0f}ms" if timing else '-'
+        first = f"{timing['first_inference_ms']:.0f}ms" if timing else '-'
+        print(f"{model_format:<8}{stats['model_json_bytes'] / 1024:>10.1f}KB"
+              f"{stats['weight_bytes'] / 2**20:>9.2f}MB{stats['weight_shards']:>8}{stats['nodes']:>6}"
+              f"{stats['batch_norm_ops']:>8}{load:>10}{first:>11}")
+
+    report = {'weight_shard_size_bytes': weight_shard_size_bytes, 'formats': formats}
+    if report_path:
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
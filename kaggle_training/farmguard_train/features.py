@@ -0,0 +1,163 @@
+"""
+Bottleneck feature cache for head-only (phase 1) training.
+
+While the MobileNetV2 backbone is frozen its pooled output for an image never
+changes, so we run the backbone once per image, keep the
+GlobalAveragePooling2D vectors in a memory-mapped float16 .npy file and
+train the Dense/Dropout head on those arrays instead of on images.
+"""
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import tensorflow as tf
+
+
+@dataclass
+class FeatureCache:
+    """Pooled backbone features (memory-mapped) and their integer labels."""
+    features: np.ndarray
+    labels: np.ndarray
+
+    @property
+    def samples(self):
+        return len(self.labels)
+
+
+def feature_extractor(base_model):
+    """Frozen backbone + global average pooling, i.e. the input to the head."""
+    return tf.keras.Sequential([
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+    ])
+
+
+def _pool_index(model):
+    pool_index = None
+    for i, layer in enumerate(model.layers):
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            pool_index = i
+    if pool_index is None:
+        raise ValueError("Model has no GlobalAveragePooling2D layer to split at")
+    return pool_index
+
+
+def backbone_model(model):
+    """Image -> pooled features part of a trained ``model`` (layers shared)."""
+    return tf.keras.Model(model.inputs, model.layers[_pool_index(model)].output, name='backbone')
+
+
+def head_model(model):
+    """
+    Standalone model of the layers after GlobalAveragePooling2D in ``model``.
+
+    The layers are shared, not copied, so fitting the returned model trains
+    the head of ``model`` in place. Works for the functional and Sequential
+    models built by the training scripts (a plain chain of layers after the
+    pooling layer).
+    """
+    pool_index = _pool_index(model)
+    pooled = model.layers[pool_index].output
+    inputs = tf.keras.Input(shape=pooled.shape[1:], name='pooled_features')
+    x = inputs
+    for layer in model.layers[pool_index + 1:]:
+        x = layer(x)
+    return tf.keras.Model(inputs, x, name='classification_head')
+
+
+def _fingerprint(data, extractor):
+    files = hashlib.sha1()
+    for name in data.filenames:
+        files.update(name.encode('utf-8'))
+    weights = hashlib.sha1()
+    for w in extractor.get_weights():
+        weights.update(np.ascontiguousarray(w).tobytes())
+    return {
+        'files': files.hexdigest(),
+        'weights': weights.hexdigest(),
+        'preprocessing': data.preprocessing,
+        'samples': data.samples,
+        'input_shape': list(extractor.input_shape[1:]),
+        'feature_dim': int(extractor.output_shape[-1]),
+    }
+
+
+@contextlib.contextmanager
+def _cache_lock(cache_dir, name):
+    # Parallel sweep trials share one cache: one process extracts, the
+    # others wait and then reuse its output
+    with open(os.path.join(cache_dir, f'{name}.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _cache_stem(name, fingerprint):
+    key = hashlib.sha1(json.dumps(fingerprint, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    return f'{name}_{key}'
+
+
+def extract_features(extractor, data, cache_dir, name):
+    """
+    Run ``extractor`` once over ``data`` and store the outputs on disk.
+
+    ``data`` is an unshuffled, unaugmented DirectoryDataset. The files are
+    named by a hash of the file list, preprocessing, backbone weights and
+    input/feature shapes, so a matching cache is reused and a different one
+    (another sweep trial's img_size or preprocessing) gets files of its own.
+    They are written under a temporary name and moved into place, never
+    rewritten, so it is safe for other processes to have them mapped.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    fingerprint = _fingerprint(data, extractor)
+    stem = _cache_stem(name, fingerprint)
+    features_path = os.path.join(cache_dir, f'{stem}_features.npy')
+    labels_path = os.path.join(cache_dir, f'{stem}_labels.npy')
+    meta_path = os.path.join(cache_dir, f'{stem}_meta.json')
+
+    with _cache_lock(cache_dir, stem):
+        # The meta file is moved into place last, so it marks a complete cache
+        if os.path.exists(meta_path) and os.path.exists(features_path) and os.path.exists(labels_path):
+            with open(meta_path) as f:
+                if json.load(f) == fingerprint:
+                    print(f"Reusing cached {name} features from {features_path}")
+                    return FeatureCache(
+                        features=np.load(features_path, mmap_mode='r'),
+                        labels=np.load(labels_path),
+                    )
+
+        print(f"Extracting {name} features for {data.samples} images...")
+        temp = os.path.join(cache_dir, f'{stem}.tmp{os.getpid()}')
+        features = np.lib.format.open_memmap(
+            f'{temp}_features.npy', mode='w+', dtype=np.float16,
+            shape=(data.samples, fingerprint['feature_dim'])
+        )
+        offset = 0
+        for images, _ in data.dataset:
+            batch = extractor(images, training=False).numpy()
+            features[offset:offset + len(batch)] = batch
+            offset += len(batch)
+        features.flush()
+        del features
+        if offset != data.samples:
+            os.remove(f'{temp}_features.npy')
+            raise RuntimeError(f"Expected {data.samples} {name} images, extracted {offset}")
+
+        np.save(f'{temp}_labels.npy', data.classes)
+        with open(f'{temp}_meta.json', 'w') as f:
+            json.dump(fingerprint, f, indent=2)
+        os.replace(f'{temp}_features.npy', features_path)
+        os.replace(f'{temp}_labels.npy', labels_path)
+        os.replace(f'{temp}_meta.json', meta_path)
+
+    return FeatureCache(
+        features=np.load(features_path, mmap_mode='r'),
+        labels=np.load(labels_path),
+    )
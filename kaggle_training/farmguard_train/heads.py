@@ -0,0 +1,223 @@
+"""
+Class-subset heads on a shared, already fine-tuned backbone.
+
+A regional crop list does not need its own fine-tune: the backbone of a
+trained model (e.g. the 38-class main model) stays as it is, its pooled
+features are extracted once into the feature cache, and a small head per
+region is trained on the rows of that region's classes. The head starts
+from the trained head (hidden layers plus the output units of the kept
+classes), so a few epochs on cached features take seconds.
+
+The export puts the backbone in one tfjs layers model and every head in a
+tiny model of its own, listed in ``heads.json``. The browser downloads the
+backbone shards once and swaps heads per region:
+
+    features = backbone.predict(image)   // [1, 1280]
+    probs = heads[region].predict(features)
+
+Regions are a JSON file mapping a name to class names or crop names
+('Tomato' = every Tomato_* class):
+
+    {"andes": ["Potato", "Tomato"], "peppers": ["Pepper__bell___Bacterial_spot", "Pepper__bell___healthy"]}
+
+    python -m farmguard_train.heads farmguard_output/model_output PlantVillage/ regions.json \\
+        --split-manifest farmguard_output/split_manifest.json --output-dir farmguard_heads
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .data import directory_dataset
+from .evaluate import crop_name
+from .export import artifact_size, save_layers_model
+from .features import backbone_model, extract_features, head_model
+from .predict import MODEL_NAME
+from .split import SplitManifest
+
+
+def resolve_classes(names, class_names):
+    """Indices (model order) of ``names``: class names, or crop names standing for all their classes."""
+    indices = []
+    for name in names:
+        if name in class_names:
+            matches = [class_names.index(name)]
+        else:
+            matches = [i for i, c in enumerate(class_names) if crop_name(c) == name]
+        if not matches:
+            raise ValueError(f"{name!r} is neither a class nor a crop of the model ({class_names})")
+        indices.extend(i for i in matches if i not in indices)
+    return sorted(indices)
+
+
+def subset_head(model, class_indices):
+    """
+    New head for ``class_indices`` (positions in ``model``'s output),
+    initialised from ``model``'s head: same hidden layers and weights, and
+    the output units of the kept classes.
+    """
+    full = head_model(model)
+    inputs = tf.keras.Input(shape=full.input_shape[1:], name='pooled_features')
+    x = inputs
+    hidden = full.layers[1:-1]
+    for layer in hidden:
+        x = layer.__class__.from_config(layer.get_config())(x)
+    outputs = tf.keras.layers.Dense(len(class_indices), activation='softmax', dtype='float32',
+                                    name='predictions')(x)
+    head = tf.keras.Model(inputs, outputs, name='subset_head')
+
+    for new, old in zip(head.layers[1:-1], hidden):
+        new.set_weights(old.get_weights())
+    kernel, bias = full.layers[-1].get_weights()
+    head.layers[-1].set_weights([kernel[:, class_indices], bias[class_indices]])
+    return head
+
+
+def _rows(cache, class_indices):
+    """(features, labels) of the cached rows of ``class_indices``, labels renumbered 0..n-1."""
+    remap = np.full(max(cache.labels.max(), max(class_indices)) + 1, -1)
+    remap[class_indices] = np.arange(len(class_indices))
+    mask = np.isin(cache.labels, class_indices)
+    return np.asarray(cache.features[mask], dtype=np.float32), remap[cache.labels[mask]]
+
+
+def _accuracy(head, features, labels):
+    if not len(labels):
+        return 0.0
+    predictions = head.predict(features, batch_size=1024, verbose=0)
+    return float(np.mean(predictions.argmax(axis=1) == labels))
+
+
+def train_head(model, cached, class_indices, epochs=20, learning_rate=1e-3, batch_size=64):
+    """
+    Fit a subset_head on the cached 'train' features, early-stopped on the
+    'val' ones. Returns (head, report).
+    """
+    head = subset_head(model, class_indices)
+    x_train, y_train = _rows(cached['train'], class_indices)
+    x_val, y_val = _rows(cached['val'], class_indices)
+    if not len(y_train):
+        raise ValueError("No training images for these classes")
+
+    initial = _accuracy(head, x_val, y_val)
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate),
+                 loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    start = time.perf_counter()
+    head.fit(
+        x_train, y_train,
+        batch_size=batch_size,
+        epochs=epochs,
+        validation_data=(x_val, y_val) if len(y_val) else None,
+        callbacks=[tf.keras.callbacks.EarlyStopping(
+            monitor='val_accuracy', patience=5, restore_best_weights=True)] if len(y_val) else [],
+        verbose=0,
+    )
+    return head, {
+        'train_images': int(len(y_train)),
+        'val_images': int(len(y_val)),
+        'val_accuracy_initial': initial,
+        'val_accuracy': _accuracy(head, x_val, y_val),
+        'train_seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+def export_heads(model_dir, dataset, regions, output_dir, split_manifest=None, validation_split=0.2,
+                 cache_dir=None, quantization='float32', epochs=20, batch_size=64):
+    """
+    Train one head per entry of ``regions`` ({name: class or crop names})
+    on the backbone of the model in ``model_dir`` and write the shared
+    backbone, the heads and ``heads.json`` to ``output_dir``.
+    """
+    model = tf.keras.models.load_model(os.path.join(model_dir, MODEL_NAME), compile=False)
+    with open(os.path.join(model_dir, 'class_names.json')) as f:
+        class_names = json.load(f)
+    with open(os.path.join(model_dir, 'preprocessing.json')) as f:
+        preprocessing = json.load(f)
+    backbone = backbone_model(model)
+    split = SplitManifest.load(split_manifest) if split_manifest else None
+
+    # One extraction over every class serves all regions
+    cache_dir = cache_dir or os.path.join(output_dir, 'feature_cache')
+    cached = {}
+    for subset, name in [('training', 'train'), ('validation', 'val')]:
+        data = directory_dataset(
+            dataset, subset=subset, img_size=preprocessing['input_size'], batch_size=batch_size,
+            preprocessing=preprocessing['preprocessing'], validation_split=validation_split,
+            shuffle=False, split=split, classes=class_names,
+        )
+        cached[name] = extract_features(backbone, data, cache_dir, name)
+
+    print(f"Exporting the shared backbone ({quantization})...")
+    backbone_dir = os.path.join(output_dir, 'backbone')
+    save_layers_model(backbone, backbone_dir, quantization)
+    shutil.copy(os.path.join(model_dir, 'preprocessing.json'), backbone_dir)
+    backbone_size, backbone_gzip = artifact_size(backbone_dir)
+
+    manifest = {
+        'backbone': {
+            'path': 'backbone/model.json',
+            'input_size': preprocessing['input_size'],
+            'preprocessing': preprocessing['preprocessing'],
+            'feature_dim': int(backbone.output_shape[-1]),
+            'quantization': quantization,
+            'size_bytes': backbone_size,
+            'gzip_bytes': backbone_gzip,
+        },
+        'heads': {},
+    }
+    for region, names in regions.items():
+        class_indices = resolve_classes(names, class_names)
+        head, report = train_head(model, cached, class_indices, epochs=epochs)
+        head_dir = os.path.join(output_dir, 'heads', region)
+        save_layers_model(head, head_dir, quantization)
+        region_classes = [class_names[i] for i in class_indices]
+        with open(os.path.join(head_dir, 'class_names.json'), 'w') as f:
+            json.dump(region_classes, f, indent=2)
+        size, gzip_size = artifact_size(head_dir)
+        manifest['heads'][region] = {
+            'path': f'heads/{region}/model.json',
+            'class_names': region_classes,
+            'size_bytes': size,
+            'gzip_bytes': gzip_size,
+            **report,
+        }
+        print(f"{region}: {len(class_indices)} classes, val accuracy "
+              f"{report['val_accuracy_initial'] * 100:.2f}% -> {report['val_accuracy'] * 100:.2f}% "
+              f"in {report['train_seconds']:.1f}s, head {gzip_size / 1024:.1f}KB gzipped")
+
+    with open(os.path.join(output_dir, 'heads.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Backbone {backbone_gzip / 2**20:.2f}MB gzipped, shared by {len(regions)} heads "
+          f"-> {os.path.join(output_dir, 'heads.json')}")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder of a training run")
+    parser.add_argument('dataset', help="image tree or shard folder the model was trained on")
+    parser.add_argument('regions', help="JSON file: {region: [class or crop names]}")
+    parser.add_argument('--output-dir', default='farmguard_heads')
+    parser.add_argument('--split-manifest', help="train / validate on this split (split.py)")
+    parser.add_argument('--validation-split', type=float, default=0.2,
+                        help="filename-order split when no --split-manifest is given")
+    parser.add_argument('--feature-cache-dir', help="default: <output-dir>/feature_cache")
+    parser.add_argument('--quantization', default='float32', choices=['float32', 'float16', 'uint8'])
+    parser.add_argument('--epochs', type=int, default=20)
+    parser.add_argument('--batch-size', type=int, default=64)
+    args = parser.parse_args(argv)
+
+    with open(args.regions) as f:
+        regions = json.load(f)
+    export_heads(args.model, args.dataset, regions, args.output_dir, args.split_manifest,
+                 args.validation_split, args.feature_cache_dir, args.quantization, args.epochs,
+                 args.batch_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,133 @@
+"""
+Decoded image cache for the validation set.
+
+Validation batches are the same every epoch once augmentation is off, yet
+the tf.data pipeline would read, decode and resize every JPEG again for each
+validation pass (and for every evaluation after training). Here the
+unaugmented, unshuffled validation pipeline runs once, its pixels go into a
+memory-mapped uint8 .npy file (the same precision as the packed shards)
+and every later pass streams batches straight from that array. After the
+first pass the OS page cache keeps it in memory.
+"""
+
+import glob
+import hashlib
+import json
+import math
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from .data import AUTOTUNE, DirectoryDataset, preprocess
+from .features import _cache_lock, _cache_stem
+
+
+def _pixels(images, mode):
+    """Undo ``preprocess``: float images back to uint8 [0, 255]."""
+    images = np.asarray(images, dtype=np.float32)
+    images = images * 255.0 if mode == 'rescale' else (images + 1.0) * 127.5
+    return np.clip(np.rint(images), 0, 255).astype(np.uint8)
+
+
+def _fingerprint(data, image_shape):
+    files = hashlib.sha1()
+    for name in data.filenames:
+        files.update(name.encode('utf-8'))
+    return {
+        'files': files.hexdigest(),
+        'samples': data.samples,
+        'image_shape': list(image_shape),
+    }
+
+
+def cached_dataset(data, cache_dir, name):
+    """
+    DirectoryDataset with the same images, labels and batching as ``data``
+    (an unshuffled, unaugmented DirectoryDataset), read from a decoded
+    cache in ``cache_dir``.
+
+    The cache is reused as long as the file list and image shape match, so
+    runs and sweep trials sharing ``cache_dir`` decode each image once. Its
+    files are named by a hash of those and written under a temporary name,
+    then moved into place, so a process reading an older cache is safe.
+    Preprocessing is applied when reading, so one cache serves every
+    preprocessing mode.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    image_shape = tuple(data.dataset.element_spec[0].shape[1:])
+    fingerprint = _fingerprint(data, image_shape)
+    # Named by the fingerprint: trials at other sizes (or file lists) get files of their own
+    stem = _cache_stem(f'{name}_images', fingerprint)
+    images_path = os.path.join(cache_dir, f'{stem}.npy')
+    labels_path = os.path.join(cache_dir, f'{stem}_labels.npy')
+    meta_path = os.path.join(cache_dir, f'{stem}_meta.json')
+
+    with _cache_lock(cache_dir, stem):
+        # The meta file is moved into place last, so it marks a complete cache
+        fresh = False
+        if os.path.exists(meta_path) and os.path.exists(images_path) and os.path.exists(labels_path):
+            with open(meta_path) as f:
+                fresh = json.load(f) == fingerprint
+
+        if fresh:
+            print(f"Reusing decoded {name} images from {images_path}")
+        else:
+            print(f"Caching {data.samples} decoded {name} images...")
+            temp = os.path.join(cache_dir, f'{stem}.tmp{os.getpid()}')
+            images = np.lib.format.open_memmap(
+                f'{temp}.npy', mode='w+', dtype=np.uint8, shape=(data.samples, *image_shape))
+            offset = 0
+            for batch, _ in data.dataset:
+                images[offset:offset + len(batch)] = _pixels(batch, data.preprocessing)
+                offset += len(batch)
+            images.flush()
+            del images
+            if offset != data.samples:
+                os.remove(f'{temp}.npy')
+                raise RuntimeError(f"Expected {data.samples} {name} images, cached {offset}")
+            np.save(f'{temp}_labels.npy', data.classes)
+            with open(f'{temp}_meta.json', 'w') as f:
+                json.dump(fingerprint, f, indent=2)
+            # Never rewritten in place: another process may have the old arrays mapped
+            os.replace(f'{temp}.npy', images_path)
+            os.replace(f'{temp}_labels.npy', labels_path)
+            os.replace(f'{temp}_meta.json', meta_path)
+
+    images = np.load(images_path, mmap_mode='r')
+    labels = np.load(labels_path)
+    num_classes = len(data.class_indices)
+    batch_size = data.batch_size
+
+    def batches():
+        for start in range(0, len(labels), batch_size):
+            yield images[start:start + batch_size], labels[start:start + batch_size]
+
+    ds = tf.data.Dataset.from_generator(batches, output_signature=(
+        tf.TensorSpec((None, *image_shape), tf.uint8),
+        tf.TensorSpec((None,), labels.dtype),
+    ))
+    ds = ds.map(
+        lambda x, y: (preprocess(tf.cast(x, tf.float32), data.preprocessing),
+                      tf.one_hot(y, num_classes)),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=True,
+    )
+    # A generator has no length of its own; without one Keras runs out of data every validation pass
+    ds = ds.apply(tf.data.experimental.assert_cardinality(math.ceil(len(labels) / batch_size)))
+    ds = ds.prefetch(AUTOTUNE)
+
+    return DirectoryDataset(
+        dataset=ds,
+        class_indices=data.class_indices,
+        filenames=data.filenames,
+        classes=labels,
+        batch_size=batch_size,
+        preprocessing=data.preprocessing,
+    )
+
+
+def remove_cached(cache_dir, name):
+    """Delete the decoded-image caches called ``name`` in ``cache_dir`` (every size)."""
+    for path in glob.glob(os.path.join(cache_dir, f'{name}_images_*')):
+        os.remove(path)
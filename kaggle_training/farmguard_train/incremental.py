@@ -0,0 +1,248 @@
+"""
+Incremental class addition on a trained model.
+
+A new disease class does not need the full two-phase run from ImageNet
+weights. The model of a training run keeps its backbone and head, and its
+output layer gets one unit per new class: the trained units keep their
+weights and positions, so the order of class_names.json is stable and the
+new classes are appended. The backbone stays frozen, so its pooled features
+are extracted once, for the new classes' images plus a replay buffer of
+``replay_per_class`` images of every old class, and the extended head is
+trained on those cached features with class-balanced weights. The replay
+keeps the old classes from being forgotten; the report shows old-class
+validation accuracy before and after.
+
+The dataset is the old image tree with the new class folders added:
+
+    python -m farmguard_train.incremental farmguard_output/model_output PlantVillage/ \\
+        --split-manifest farmguard_output/split_manifest.json --output-dir farmguard_incremental
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .data import file_dataset, find_classes, list_image_files
+from .evaluate import ConfusionAccumulator, print_report
+from .export import QUANTIZATIONS, save_layers_model
+from .features import backbone_model, extract_features, head_model
+from .predict import MODEL_NAME
+from .shards import is_shard_dir
+from .split import SplitManifest, extend_split
+
+
+def extended_head(model, num_new):
+    """
+    New head with ``num_new`` more output units, initialised from
+    ``model``'s head: same hidden layers and weights, the trained output
+    units first and in their old order.
+    """
+    full = head_model(model)
+    inputs = tf.keras.Input(shape=full.input_shape[1:], name='pooled_features')
+    x = inputs
+    hidden = full.layers[1:-1]
+    for layer in hidden:
+        x = layer.__class__.from_config(layer.get_config())(x)
+    output = full.layers[-1]
+    outputs = tf.keras.layers.Dense(output.units + num_new, activation='softmax', dtype='float32',
+                                    name=output.name)(x)
+    head = tf.keras.Model(inputs, outputs, name='extended_head')
+
+    for new, old in zip(head.layers[1:-1], hidden):
+        new.set_weights(old.get_weights())
+    kernel, bias = output.get_weights()
+    new_kernel, new_bias = head.layers[-1].get_weights()
+    new_kernel[:, :output.units] = kernel
+    # New units start at the average prior of the old ones, not far below it
+    new_bias[:output.units] = bias
+    new_bias[output.units:] = bias.mean()
+    head.layers[-1].set_weights([new_kernel, new_bias])
+    return head
+
+
+def attach_head(model, head):
+    """One flat model: ``model`` up to its pooling layer, then ``head``'s layers."""
+    x = backbone_model(model).output
+    for layer in head.layers[1:]:
+        x = layer(x)
+    return tf.keras.Model(model.inputs, x, name=model.name)
+
+
+def replay_indices(labels, num_old, per_class, seed=0):
+    """Every image of the new classes (labels >= num_old) plus up to ``per_class`` of each old class."""
+    rng = np.random.default_rng(seed)
+    keep = [np.flatnonzero(labels >= num_old)]
+    for label in range(num_old):
+        members = np.flatnonzero(labels == label)
+        keep.append(rng.choice(members, min(per_class, len(members)), replace=False))
+    return np.sort(np.concatenate(keep))
+
+
+def _accuracy(predictions, labels):
+    return float(np.mean(predictions.argmax(axis=1) == labels)) if len(labels) else 0.0
+
+
+def add_classes(model_dir, dataset, output_dir, new_classes=None, split_manifest=None, validation_split=0.2,
+                replay_per_class=50, epochs=30, learning_rate=1e-3, batch_size=64, seed=0, tfjs=None):
+    """
+    Extend the model in ``model_dir`` with ``new_classes`` (default: every
+    class folder of ``dataset`` it does not know) and write the result to
+    ``<output_dir>/model_output``. Returns the summary also written to
+    ``<output_dir>/incremental.json``.
+    """
+    start = time.perf_counter()
+    if is_shard_dir(dataset):
+        raise ValueError("Incremental training reads the image folders, not a shard folder")
+    model = tf.keras.models.load_model(os.path.join(model_dir, MODEL_NAME), compile=False)
+    with open(os.path.join(model_dir, 'class_names.json')) as f:
+        old_classes = json.load(f)
+    with open(os.path.join(model_dir, 'preprocessing.json')) as f:
+        preprocessing = json.load(f)
+
+    folders = find_classes(dataset)
+    if new_classes is None:
+        new_classes = [name for name in folders if name not in old_classes]
+    if not new_classes:
+        raise ValueError(f"No new classes: every class folder of {dataset} is already in the model")
+    for name in new_classes:
+        if name in old_classes:
+            raise ValueError(f"{name!r} is already a class of the model")
+        if name not in folders:
+            raise ValueError(f"No folder for the new class {name!r} in {dataset}")
+    missing = [name for name in old_classes if name not in folders]
+    if missing:
+        print(f"Warning: no images (so no replay) for old classes {missing}")
+    class_names = old_classes + list(new_classes)
+    num_old = len(old_classes)
+
+    split = None
+    if split_manifest:
+        split = SplitManifest.load(split_manifest)
+        if split.root != os.path.abspath(dataset):
+            raise ValueError(f"{split_manifest} was built for {split.root}, not {dataset}")
+        # New classes are split among themselves, old images keep their subset
+        split = extend_split(split)
+        split.save(os.path.join(output_dir, 'split_manifest.json'))
+
+    os.makedirs(output_dir, exist_ok=True)
+    backbone = backbone_model(model)
+    cached = {}
+    for subset, name in [('training', 'train'), ('validation', 'val')]:
+        filenames, labels, class_indices = list_image_files(
+            dataset, subset, validation_split, split=split, classes=class_names)
+        keep = replay_indices(labels, num_old, replay_per_class, seed) if subset == 'training' \
+            else np.arange(len(labels))
+        data = file_dataset(
+            [filenames[i] for i in keep], labels[keep], class_indices,
+            img_size=preprocessing['input_size'], batch_size=batch_size,
+            preprocessing=preprocessing['preprocessing'], shuffle=False,
+        )
+        cached[name] = extract_features(backbone, data, os.path.join(output_dir, 'feature_cache'), name)
+
+    x_train = np.asarray(cached['train'].features, dtype=np.float32)
+    y_train = cached['train'].labels
+    x_val = np.asarray(cached['val'].features, dtype=np.float32)
+    y_val = cached['val'].labels
+    if not (y_train >= num_old).any():
+        raise ValueError(f"No training images for the new classes {new_classes}")
+    old_val = y_val < num_old
+    before = _accuracy(head_model(model).predict(x_val[old_val], batch_size=1024, verbose=0), y_val[old_val])
+
+    # Balanced: a full new class against a small replay sample of each old one
+    counts = np.bincount(y_train, minlength=len(class_names))
+    present = np.flatnonzero(counts)
+    class_weight = {int(i): len(y_train) / (len(present) * counts[i]) for i in present}
+
+    head = extended_head(model, len(new_classes))
+    head.compile(optimizer=tf.keras.optimizers.Adam(learning_rate),
+                 loss='sparse_categorical_crossentropy', metrics=['accuracy'])
+    train_start = time.perf_counter()
+    head.fit(
+        x_train, y_train,
+        batch_size=batch_size,
+        epochs=epochs,
+        class_weight=class_weight,
+        validation_data=(x_val, y_val) if len(y_val) else None,
+        callbacks=[tf.keras.callbacks.EarlyStopping(
+            monitor='val_accuracy', patience=5, restore_best_weights=True)] if len(y_val) else [],
+        verbose=0,
+    )
+    train_seconds = time.perf_counter() - train_start
+
+    predictions = head.predict(x_val, batch_size=1024, verbose=0)
+    accumulator = ConfusionAccumulator(len(class_names))
+    if len(y_val):
+        accumulator.update(y_val, predictions)
+    report = accumulator.report(class_names)
+
+    model_output = os.path.join(output_dir, 'model_output')
+    os.makedirs(model_output, exist_ok=True)
+    extended = attach_head(model, head)
+    extended.save(os.path.join(model_output, MODEL_NAME))
+    with open(os.path.join(model_output, 'class_names.json'), 'w') as f:
+        json.dump(class_names, f, indent=2)
+    shutil.copy(os.path.join(model_dir, 'preprocessing.json'), model_output)
+    with open(os.path.join(model_output, 'evaluation.json'), 'w') as f:
+        json.dump(report, f, indent=2)
+    if tfjs:
+        tfjs_dir = os.path.join(output_dir, 'tfjs_model')
+        save_layers_model(extended, tfjs_dir, tfjs)
+        for sidecar in ['class_names.json', 'preprocessing.json']:
+            shutil.copy(os.path.join(model_output, sidecar), tfjs_dir)
+
+    summary = {
+        'base_model': os.path.abspath(model_dir),
+        'new_classes': list(new_classes),
+        'num_classes': len(class_names),
+        'replay_per_class': replay_per_class,
+        'train_images': int(len(y_train)),
+        'new_class_train_images': int((y_train >= num_old).sum()),
+        'val_images': int(len(y_val)),
+        'old_class_val_accuracy_before': round(before, 4),
+        'old_class_val_accuracy_after': round(_accuracy(predictions[old_val], y_val[old_val]), 4),
+        'new_class_val_accuracy': round(_accuracy(predictions[~old_val], y_val[~old_val]), 4),
+        'val_accuracy': report['overall']['accuracy'],
+        'train_seconds': round(train_seconds, 2),
+        'total_seconds': round(time.perf_counter() - start, 2),
+    }
+    with open(os.path.join(output_dir, 'incremental.json'), 'w') as f:
+        json.dump(summary, f, indent=2)
+
+    print_report(report)
+    print(f"Added {new_classes}: old-class val accuracy "
+          f"{summary['old_class_val_accuracy_before'] * 100:.2f}% "
+          f"-> {summary['old_class_val_accuracy_after'] * 100:.2f}%, new classes "
+          f"{summary['new_class_val_accuracy'] * 100:.2f}%, head trained in {train_seconds:.1f}s "
+          f"({summary['total_seconds']:.1f}s total) -> {model_output}")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder of a training run")
+    parser.add_argument('dataset', help="the image tree the model was trained on, with the new class folders")
+    parser.add_argument('--classes', nargs='+', help="classes to add (default: every unknown class folder)")
+    parser.add_argument('--output-dir', default='farmguard_incremental')
+    parser.add_argument('--split-manifest', help="split of the base model's run (split.py); extended here")
+    parser.add_argument('--validation-split', type=float, default=0.2,
+                        help="filename-order split when no --split-manifest is given")
+    parser.add_argument('--replay-per-class', type=int, default=50, help="old-class images to train on")
+    parser.add_argument('--epochs', type=int, default=30)
+    parser.add_argument('--learning-rate', type=float, default=1e-3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tfjs', choices=QUANTIZATIONS, help="also write a tfjs layers model, so quantized")
+    args = parser.parse_args(argv)
+
+    add_classes(args.model, args.dataset, args.output_dir, args.classes, args.split_manifest,
+                args.validation_split, args.replay_per_class, args.epochs, args.learning_rate,
+                args.batch_size, args.seed, args.tfjs)
+
+
+if __name__ == '__main__':
+    main()
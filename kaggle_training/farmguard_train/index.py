@@ -0,0 +1,203 @@
+"""
+Cached, verified index of a class-per-folder image dataset.
+
+One pass with a thread pool lists every class folder and fully decodes
+every image with the same ``tf.io.decode_image`` call the loaders use
+(TensorFlow releases the GIL, so the decodes run in parallel). Each image's
+label, width / height / channels, byte size, mtime and SHA-1 content hash
+go into a JSON index; files that do not decode are listed under
+``broken`` with the error instead of failing an epoch later.
+
+The loaders (``list_image_files(..., index=...)``, and through it
+``directory_dataset`` and ``pack_shards``) read file lists from the index
+instead of walking the folders again, and skip the broken files. The index
+is reused as is by later runs; ``refresh=True`` re-lists the folders and
+only re-verifies files whose size or mtime changed.
+
+    python -m farmguard_train.index PlantVillage/ --output dataset_index.json
+"""
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import tensorflow as tf
+
+from .data import IMAGE_EXTENSIONS, find_classes
+
+INDEX_FORMAT = 'farmguard-index-v1'
+
+
+@dataclass
+class DatasetIndex:
+    """Verified images (flow_from_directory order) and broken files of one dataset."""
+    root: str
+    class_names: list
+    entries: list  # dicts: path (relative to root), label, width, height, channels, sha1, size, mtime_ns
+    broken: list = field(default_factory=list)  # dicts: path, label, error, size, mtime_ns
+
+    def class_files(self, class_name):
+        """Absolute paths of the good images of ``class_name``, in loader order."""
+        label = self.class_names.index(class_name)
+        return [os.path.join(self.root, e['path']) for e in self.entries if e['label'] == label]
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'format': INDEX_FORMAT, 'root': self.root, 'class_names': self.class_names,
+                       'entries': self.entries, 'broken': self.broken}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('format') != INDEX_FORMAT:
+            raise ValueError(f"{path} is not a {INDEX_FORMAT} index")
+        return cls(data['root'], data['class_names'], data['entries'], data['broken'])
+
+
+def _list_class(root, label, class_name, follow_links=False):
+    # Same order as Keras' DirectoryIterator: sorted walk, sorted file names
+    files = []
+    class_dir = os.path.join(root, class_name)
+    walk = sorted(os.walk(class_dir, followlinks=follow_links), key=lambda w: w[0])
+    for dirpath, _, fnames in walk:
+        for fname in sorted(fnames):
+            if fname.lower().endswith(IMAGE_EXTENSIONS):
+                path = os.path.join(dirpath, fname)
+                stat = os.stat(path)
+                files.append({'path': os.path.relpath(path, root), 'label': label,
+                              'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+    return files
+
+
+def _verify(root, item):
+    """Decode one file; returns the item completed with its shape and hash, or with its error."""
+    try:
+        with open(os.path.join(root, item['path']), 'rb') as f:
+            data = f.read()
+        # Exactly the loaders' decode, so whatever passes here loads in training
+        image = tf.io.decode_image(data, channels=3, expand_animations=False)
+        height, width, _ = image.shape
+        # Stored channels (grayscale / CMYK JPEGs), for the summary
+        channels = int(tf.io.extract_jpeg_shape(data)[-1]) if tf.io.is_jpeg(data) else None
+    except Exception as error:
+        message = getattr(error, 'message', None) or str(error)
+        # Drop TF's "{{function_node ...}}" prefix and "[Op:...]" suffix
+        message = re.sub(r'\{\{.*?\}\}|\[Op:\w+\]', '', message.strip().splitlines()[-1]).strip()
+        return {**item, 'error': f"{type(error).__name__}: {message}"}
+    return {**item, 'width': int(width), 'height': int(height), 'channels': channels,
+            'sha1': hashlib.sha1(data).hexdigest()}
+
+
+def build_index(directory, previous=None, workers=None, follow_links=False):
+    """
+    Scan and verify ``directory``. Entries of ``previous`` (an earlier
+    DatasetIndex of the same folder) are reused for unchanged files.
+    """
+    root = os.path.abspath(directory)
+    class_names = find_classes(root)
+    workers = workers or min(32, (os.cpu_count() or 1) * 4)
+    known = {}
+    if previous is not None and previous.root == root:
+        known = {e['path']: e for e in previous.entries + previous.broken}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(workers) as pool:
+        listed = pool.map(lambda c: _list_class(root, c[0], c[1], follow_links), enumerate(class_names))
+        items = [item for files in listed for item in files]
+
+        reuse, todo = [], []
+        for item in items:
+            old = known.get(item['path'])
+            if old and old['size'] == item['size'] and old['mtime_ns'] == item['mtime_ns'] \
+                    and old['label'] == item['label']:
+                reuse.append(old)
+            else:
+                todo.append(item)
+        verified = {v['path']: v for v in pool.map(lambda item: _verify(root, item), todo)}
+
+    entries, broken = [], []
+    for item in items:
+        result = verified.get(item['path']) or known[item['path']]
+        (broken if 'error' in result else entries).append(result)
+    seconds = time.perf_counter() - start
+    print(f"Indexed {len(items)} images of {len(class_names)} classes in {seconds:.1f}s "
+          f"({len(todo)} verified, {len(reuse)} unchanged, {len(broken)} broken)")
+    return DatasetIndex(root, class_names, entries, broken)
+
+
+@contextlib.contextmanager
+def _lock(path):
+    # Parallel sweep trials share one index: the first builds it
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_or_build_index(directory, index_path, refresh=False, workers=None):
+    """
+    The index of ``directory`` stored at ``index_path``, building (or, with
+    ``refresh``, updating) and saving it when needed.
+    """
+    with _lock(index_path):
+        previous = None
+        if os.path.exists(index_path):
+            try:
+                previous = DatasetIndex.load(index_path)
+            except (ValueError, KeyError) as error:
+                print(f"Ignoring unreadable index {index_path}: {error}")
+            if previous is not None and previous.root == os.path.abspath(directory) and not refresh:
+                print(f"Using dataset index {index_path}: {len(previous.entries)} images, "
+                      f"{len(previous.broken)} broken")
+                return previous
+
+        index = build_index(directory, previous, workers)
+        index.save(index_path)
+    for item in index.broken[:20]:
+        print(f"  skipping broken image {item['path']}: {item['error']}")
+    if len(index.broken) > 20:
+        print(f"  ... and {len(index.broken) - 20} more, see 'broken' in {index_path}")
+    return index
+
+
+def summary(index):
+    """Counts per class, image sizes / channels and duplicate content."""
+    by_hash = collections.Counter(e['sha1'] for e in index.entries)
+    return {
+        'images': len(index.entries),
+        'broken': len(index.broken),
+        'class_counts': dict(zip(index.class_names, (
+            sum(e['label'] == i for e in index.entries) for i in range(len(index.class_names))))),
+        'sizes': collections.Counter(f"{e['width']}x{e['height']}" for e in index.entries).most_common(5),
+        'channels': dict(collections.Counter(e['channels'] for e in index.entries)),
+        'duplicate_files': sum(n - 1 for n in by_hash.values() if n > 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dataset', help="class-per-folder image tree")
+    parser.add_argument('--output', default='dataset_index.json')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--refresh', action='store_true', help="re-list and verify changed files")
+    args = parser.parse_args(argv)
+    index = load_or_build_index(args.dataset, args.output, args.refresh, args.workers)
+    print(json.dumps(summary(index), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Mixed-precision / XLA performance modes for the trainers.
+
+    "float32"        - plain float32 (original behaviour, the default)
+    "mixed_float16"  - float16 compute with loss scaling (GPUs with tensor cores)
+    "mixed_bfloat16" - bfloat16 compute, no loss scaling needed (AVX-512 CPUs, TPUs)
+    "auto"           - mixed_float16 on a compute capability >= 7.0 GPU, else float32
+
+Variables stay float32 in every mode and the softmax output layer must be
+built with dtype='float32'. float32_model() turns a mixed-precision model
+into a plain float32 one for saving and the TensorFlow.js export.
+"""
+
+import tensorflow as tf
+
+PRECISIONS = ('float32', 'mixed_float16', 'mixed_bfloat16')
+
+
+def resolve_precision(precision):
+    if precision == 'auto':
+        for gpu in tf.config.list_physical_devices('GPU'):
+            capability = tf.config.experimental.get_device_details(gpu).get('compute_capability')
+            if capability and capability >= (7, 0):
+                return 'mixed_float16'
+        return 'float32'
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision {precision!r}, expected 'auto' or one of {PRECISIONS}")
+    return precision
+
+
+def set_precision(precision):
+    """Set the global Keras dtype policy; call before building any model."""
+    precision = resolve_precision(precision)
+    tf.keras.mixed_precision.set_global_policy(precision)
+    return precision
+
+
+def loss_scaled(optimizer, precision):
+    """Wrap ``optimizer`` in a LossScaleOptimizer when training in float16."""
+    if precision == 'mixed_float16':
+        return tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+    return optimizer
+
+
+def _replace_policies(config):
+    if isinstance(config, dict):
+        return {k: _replace_policies(v) for k, v in config.items()}
+    if isinstance(config, list):
+        return [_replace_policies(v) for v in config]
+    if config in ('mixed_float16', 'mixed_bfloat16'):
+        return 'float32'
+    return config
+
+
+def float32_model(model):
+    """
+    Rebuild ``model`` with every layer in float32 and copy its weights over.
+
+    Needed before export: a mixed-precision model would otherwise be saved
+    with float16/bfloat16 compute policies baked into its layer configs.
+    """
+    previous = tf.keras.mixed_precision.global_policy()
+    tf.keras.mixed_precision.set_global_policy('float32')
+    try:
+        clone = model.__class__.from_config(_replace_policies(model.get_config()))
+    finally:
+        tf.keras.mixed_precision.set_global_policy(previous)
+    clone.set_weights(model.get_weights())
+    return clone
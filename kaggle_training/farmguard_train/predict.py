@@ -0,0 +1,217 @@
+"""
+Offline batch inference over image folders.
+
+Loads a trained model (the ``model_output`` folder written by training, a
+``.keras`` file or a SavedModel) with its ``class_names.json`` and
+``preprocessing.json``, streams images through a parallel, prefetching
+tf.data decode pipeline and writes the top-k predictions per image to CSV
+or JSONL as each batch finishes. Paths are generated lazily and results
+are written batch by batch, so memory stays flat however many photos a
+folder holds.
+
+    python -m farmguard_train.predict farmguard_output/model_output \\
+        field_photos/ --output predictions.csv --top-k 3
+
+Images that cannot be decoded are skipped and counted in the summary.
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+import tensorflow as tf
+
+from .data import AUTOTUNE, IMAGE_EXTENSIONS, decode_and_resize, preprocess
+from .tta import tta_forward
+
+MODEL_NAME = 'plant_disease_model.keras'
+
+
+class Predictor:
+    """A loaded model plus the class names and preprocessing it was trained with."""
+
+    def __init__(self, model_path, class_names=None, img_size=None, preprocessing=None):
+        folder = model_path if os.path.isdir(model_path) else os.path.dirname(model_path)
+        if os.path.exists(os.path.join(model_path, MODEL_NAME)):
+            model_path = os.path.join(model_path, MODEL_NAME)
+
+        meta = {}
+        meta_path = os.path.join(folder, 'preprocessing.json')
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                meta = json.load(f)
+        self.img_size = img_size or meta.get('input_size', 224)
+        self.preprocessing = preprocessing or meta.get('preprocessing', 'rescale')
+
+        if class_names is None:
+            with open(os.path.join(folder, 'class_names.json')) as f:
+                class_names = json.load(f)
+        self.class_names = class_names
+
+        if model_path.endswith('.keras') or model_path.endswith('.h5'):
+            model = tf.keras.models.load_model(model_path, compile=False)
+            self._forward = lambda images: model(images, training=False)
+        else:
+            # SavedModel (model.export / tf.saved_model.save)
+            loaded = tf.saved_model.load(model_path)
+            serve = loaded.signatures['serving_default']
+            self._forward = lambda images: next(iter(serve(images).values()))
+            self._loaded = loaded  # keep the variables alive
+        print(f"Loaded {model_path}: {len(self.class_names)} classes, "
+              f"{self.img_size}x{self.img_size} input, '{self.preprocessing}' preprocessing", file=sys.stderr)
+
+    def __call__(self, images, training=False):
+        """Class probabilities of a batch of already preprocessed images."""
+        return self._forward(images)
+
+    def top_k_fn(self, k, tta=1):
+        """
+        tf.function: batch of [0, 255] images -> (top-k probabilities, top-k
+        indices), averaged over ``tta`` views per image (see tta.py).
+        """
+        k = min(k, len(self.class_names))
+
+        @tf.function(reduce_retracing=True)
+        def top_k(images):
+            probabilities = tta_forward(self._forward, preprocess(images, self.preprocessing), tta)
+            return tf.math.top_k(probabilities, k=k)
+        return top_k
+
+
+def iter_image_paths(sources):
+    """
+    Yield image paths from directories (walked recursively in sorted order),
+    single image files and ``.txt`` lists with one path per line (``-`` for stdin).
+    """
+    for source in sources:
+        if os.path.isdir(source):
+            for root, dirs, files in os.walk(source):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.lower().endswith(IMAGE_EXTENSIONS):
+                        yield os.path.join(root, name)
+        elif source == '-' or source.endswith('.txt'):
+            f = sys.stdin if source == '-' else open(source)
+            with f:
+                for line in f:
+                    if line.strip():
+                        yield line.strip()
+        else:
+            yield source
+
+
+def image_dataset(paths, img_size, batch_size=64, threads=None):
+    """Batched (path, image) pipeline over an iterable of paths, decoded in parallel."""
+    ds = tf.data.Dataset.from_generator(
+        lambda: paths, output_signature=tf.TensorSpec((), tf.string))
+    ds = ds.map(lambda path: (path, decode_and_resize(path, img_size)),
+                num_parallel_calls=AUTOTUNE, deterministic=True)
+    # Drops unreadable files together with their path
+    ds = ds.ignore_errors() if hasattr(ds, 'ignore_errors') else ds.apply(
+        tf.data.experimental.ignore_errors())
+    ds = ds.batch(batch_size).prefetch(AUTOTUNE)
+    if threads:
+        options = tf.data.Options()
+        options.threading.private_threadpool_size = threads
+        ds = ds.with_options(options)
+    return ds
+
+
+class _CountingIterator:
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            yield item
+
+
+def _open_writer(path, k):
+    f = sys.stdout if path == '-' else open(path, 'w', newline='')
+    if path.endswith('.csv'):
+        writer = csv.writer(f)
+        writer.writerow(['path'] + [col for i in range(1, k + 1)
+                                    for col in (f'class_{i}', f'probability_{i}')])
+
+        def write(path, predictions):
+            writer.writerow([path] + [v for name, p in predictions for v in (name, f'{p:.6f}')])
+    else:
+        def write(path, predictions):
+            f.write(json.dumps({
+                'path': path,
+                'predictions': [{'class': name, 'probability': round(p, 6)} for name, p in predictions],
+            }) + '\n')
+    return f, write
+
+
+def predict(predictor, sources, output, top_k=3, batch_size=64, threads=None, log_every=50, tta=1):
+    """
+    Write top-k predictions for every image in ``sources`` to ``output``
+    (``.csv``, ``.jsonl`` or ``-`` for JSONL on stdout), with ``tta`` views
+    per image. Returns a summary dict.
+    """
+    k = min(top_k, len(predictor.class_names))
+    paths = _CountingIterator(iter_image_paths(sources))
+    ds = image_dataset(paths, predictor.img_size, batch_size, threads)
+    top_k_fn = predictor.top_k_fn(k, tta)
+
+    f, write = _open_writer(output, k)
+    predicted = 0
+    start = time.perf_counter()
+    try:
+        for step, (batch_paths, images) in enumerate(ds, 1):
+            probabilities, indices = top_k_fn(images)
+            for path, probs, idx in zip(batch_paths.numpy(), probabilities.numpy(), indices.numpy()):
+                write(path.decode('utf-8'), [(predictor.class_names[i], float(p)) for p, i in zip(probs, idx)])
+            predicted += len(batch_paths)
+            if log_every and step % log_every == 0:
+                elapsed = time.perf_counter() - start
+                print(f"{predicted} images, {predicted / elapsed:.1f} images/s", file=sys.stderr)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        'images': predicted,
+        'skipped': paths.count - predicted,
+        'seconds': elapsed,
+        'images_per_second': predicted / elapsed if elapsed else 0.0,
+    }
+    print(f"Predicted {predicted} images in {elapsed:.1f}s "
+          f"({summary['images_per_second']:.1f} images/s), "
+          f"skipped {summary['skipped']} unreadable", file=sys.stderr)
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder, .keras file or SavedModel folder")
+    parser.add_argument('inputs', nargs='+', help="image folders, image files or .txt path lists ('-' = stdin)")
+    parser.add_argument('--output', '-o', default='predictions.csv', help=".csv, .jsonl or '-' for stdout")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--batch-size', type=int, default=64)
+    parser.add_argument('--threads', type=int, help="decode threads (default: tf.data autotune)")
+    parser.add_argument('--tta', type=int, default=1,
+                        help="average over this many augmented views per image (tta.py, 1-8)")
+    parser.add_argument('--class-names', help="class_names.json, if not next to the model")
+    parser.add_argument('--img-size', type=int, help="override preprocessing.json input_size")
+    parser.add_argument('--preprocessing', choices=('rescale', 'mobilenet_v2'),
+                        help="override preprocessing.json")
+    args = parser.parse_args(argv)
+
+    class_names = None
+    if args.class_names:
+        with open(args.class_names) as f:
+            class_names = json.load(f)
+    predictor = Predictor(args.model, class_names, args.img_size, args.preprocessing)
+    predict(predictor, args.inputs, args.output, args.top_k, args.batch_size, args.threads, tta=args.tta)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""
+Magnitude pruning with a polynomial sparsity schedule.
+
+Same idea as tensorflow_model_optimization's prune_low_magnitude +
+PolynomialDecay, done as a callback so it works with both Keras 2 and
+Keras 3 and leaves no wrapper layers behind: the smallest-magnitude kernel
+weights of every trainable Conv2D/Dense layer (except the output layer)
+are zeroed, the sparsity ramps from ``initial_sparsity`` to
+``final_sparsity`` between ``begin_step`` and ``end_step``, and the masks
+are re-applied after every step so fine-tuning cannot regrow pruned
+weights. The saved model is a plain model whose zeros gzip well.
+"""
+
+import gzip
+import json
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from .export import artifact_size
+
+
+def polynomial_sparsity(step, initial_sparsity, final_sparsity, begin_step, end_step, power=3):
+    """Target sparsity at ``step`` (tfmot's PolynomialDecay schedule)."""
+    if step <= begin_step:
+        return initial_sparsity
+    if step >= end_step:
+        return final_sparsity
+    progress = (step - begin_step) / (end_step - begin_step)
+    return final_sparsity + (initial_sparsity - final_sparsity) * (1 - progress) ** power
+
+
+def _flatten_layers(model):
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.Model):
+            yield from _flatten_layers(layer)
+        else:
+            yield layer
+
+
+def prunable_kernels(model, trainable_only=True):
+    """Kernels of the (trainable) Conv2D / Dense layers, minus the output layer."""
+    layers = list(_flatten_layers(model))
+    kernels = []
+    for layer in layers[:-1]:
+        if isinstance(layer, tf.keras.layers.DepthwiseConv2D):
+            continue
+        if isinstance(layer, (tf.keras.layers.Conv2D, tf.keras.layers.Dense)) \
+                and (layer.trainable or not trainable_only):
+            kernels.append(layer.kernel)
+    return kernels
+
+
+def model_sparsity(model):
+    """
+    Fraction of exactly-zero weights across the Conv2D / Dense kernels,
+    trainable or not: the trainable flags may have changed since pruning.
+    """
+    kernels = [k.numpy() for k in prunable_kernels(model, trainable_only=False)]
+    total = sum(k.size for k in kernels)
+    return sum(int(np.sum(k == 0)) for k in kernels) / total if total else 0.0
+
+
+def weights_gzip_bytes(model):
+    """gzip size of all float32 weights, a download-size proxy independent of format."""
+    raw = b''.join(np.asarray(w, dtype=np.float32).tobytes() for w in model.get_weights())
+    return len(gzip.compress(raw))
+
+
+class MagnitudePruning(tf.keras.callbacks.Callback):
+    """Prune the model being fit on a polynomial schedule (see module docstring)."""
+
+    def __init__(self, final_sparsity, end_step, initial_sparsity=0.0, begin_step=0,
+                 power=3, frequency=100, initial_step=0, verbose=1):
+        super().__init__()
+        self.final_sparsity = final_sparsity
+        self.end_step = end_step
+        self.initial_sparsity = initial_sparsity
+        self.begin_step = begin_step
+        self.power = power
+        self.frequency = frequency
+        self.verbose = verbose
+        self.step = initial_step  # > 0 when resuming from a checkpoint
+        self.sparsity = 0.0
+        self._kernels = []
+        self._masks = []
+
+    def on_train_begin(self, logs=None):
+        self._kernels = prunable_kernels(self.model)
+        self._masks = [tf.Variable(tf.ones_like(k), trainable=False) for k in self._kernels]
+
+        @tf.function
+        def apply_masks():
+            for kernel, mask in zip(self._kernels, self._masks):
+                kernel.assign(kernel * tf.cast(mask, kernel.dtype))
+        self._apply_masks = apply_masks
+
+        if self.step > self.begin_step:
+            # Resumed: the pruned weights are the zeros, so this recovers the masks
+            self._update_masks(polynomial_sparsity(
+                self.step, self.initial_sparsity, self.final_sparsity,
+                self.begin_step, self.end_step, self.power))
+
+    def _update_masks(self, sparsity):
+        for kernel, mask in zip(self._kernels, self._masks):
+            magnitude = np.abs(kernel.numpy()).ravel()
+            k = int(sparsity * magnitude.size)
+            if k == 0:
+                continue
+            threshold = np.partition(magnitude, k - 1)[k - 1]
+            mask.assign((np.abs(kernel.numpy()) > threshold).astype(mask.dtype.as_numpy_dtype))
+        self.sparsity = sparsity
+
+    def on_train_batch_end(self, batch, logs=None):
+        self.step += 1
+        target = polynomial_sparsity(
+            self.step, self.initial_sparsity, self.final_sparsity,
+            self.begin_step, self.end_step, self.power)
+        due = self.step % self.frequency == 0 or self.step >= self.end_step
+        if self.step >= self.begin_step and due and target != self.sparsity:
+            self._update_masks(target)
+        self._apply_masks()
+
+    def on_epoch_end(self, epoch, logs=None):
+        if logs is not None:
+            logs['sparsity'] = self.sparsity
+        if self.verbose:
+            print(f"Epoch {epoch + 1}: target sparsity {self.sparsity * 100:.1f}%")
+
+    def on_train_end(self, logs=None):
+        self._apply_masks()
+
+
+def pruning_report(accuracy_before, accuracy_after, gzip_before, model, tfjs_dir=None,
+                   report_path=None):
+    """Sparsity, weight gzip size and validation accuracy before vs. after pruning."""
+    report = {
+        'sparsity': model_sparsity(model),
+        'val_accuracy_before': accuracy_before,
+        'val_accuracy_after': accuracy_after,
+        'accuracy_delta': accuracy_after - accuracy_before,
+        'weights_gzip_bytes_before': gzip_before,
+        'weights_gzip_bytes_after': weights_gzip_bytes(model),
+    }
+    if tfjs_dir:
+        report['tfjs_bytes'], report['tfjs_gzip_bytes'] = artifact_size(tfjs_dir)
+
+    print(f"\nPruned kernels to {report['sparsity'] * 100:.1f}% sparsity")
+    print(f"Weights (gzip): {gzip_before / 2**20:.2f} MB -> "
+          f"{report['weights_gzip_bytes_after'] / 2**20:.2f} MB")
+    if tfjs_dir:
+        print(f"Exported tfjs model: {report['tfjs_bytes'] / 2**20:.2f} MB, "
+              f"{report['tfjs_gzip_bytes'] / 2**20:.2f} MB gzipped")
+    print(f"Validation accuracy: {accuracy_before * 100:.2f}% -> {accuracy_after * 100:.2f}% "
+          f"({report['accuracy_delta'] * 100:+.2f} points)")
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def add_export_size(report_path, tfjs_dir):
+    """Add the size of the tfjs export in ``tfjs_dir`` to the pruning report at ``report_path``."""
+    with open(report_path) as f:
+        report = json.load(f)
+    report['tfjs_bytes'], report['tfjs_gzip_bytes'] = artifact_size(tfjs_dir)
+    print(f"Exported pruned tfjs model: {report['tfjs_bytes'] / 2**20:.2f} MB, "
+          f"{report['tfjs_gzip_bytes'] / 2**20:.2f} MB gzipped")
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    return report
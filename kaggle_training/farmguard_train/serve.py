@@ -0,0 +1,267 @@
+"""
+Local HTTP inference server with dynamic micro-batching.
+
+Serves a trained model (same inputs as predict.py) on CPU for kiosks and
+phones that are too slow to run the tfjs model themselves. Requests that
+arrive together are coalesced into one batch: the batcher waits at most
+``--max-latency-ms`` after the first queued image (or until
+``--max-batch-size`` images are queued) and runs them through the model in
+a single call. The model is warmed up at startup, like FarmGuardScanner.js
+does with ``tf.zeros([1, 224, 224, 3])``, so the first scan is not slow.
+
+    python -m farmguard_train.serve farmguard_output/model_output --port 8500
+
+    POST /predict[?top_k=3]   body: image bytes, or JSON {"image": "<base64>"}
+    GET  /metrics             request count, p50/p99 latency, batch sizes
+    GET  /health
+
+Only the Python standard library is used on top of TensorFlow.
+"""
+
+import argparse
+import base64
+import collections
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import tensorflow as tf
+
+from .predict import Predictor
+
+
+class Metrics:
+    """Rolling latency / batch-size statistics over the last ``window`` requests."""
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.batches = 0
+        self.latency_ms = collections.deque(maxlen=window)
+        self.queue_ms = collections.deque(maxlen=window)
+        self.batch_sizes = collections.deque(maxlen=window)
+        self.started = time.time()
+
+    def record_batch(self, size, queue_ms):
+        with self.lock:
+            self.batches += 1
+            self.batch_sizes.append(size)
+            self.queue_ms.extend(queue_ms)
+
+    def record_request(self, latency_ms, ok=True):
+        with self.lock:
+            self.requests += 1
+            self.errors += not ok
+            if ok:
+                self.latency_ms.append(latency_ms)
+
+    def snapshot(self):
+        def percentiles(values):
+            if not values:
+                return {'p50': None, 'p99': None, 'mean': None}
+            values = np.asarray(values)
+            return {'p50': float(np.percentile(values, 50)), 'p99': float(np.percentile(values, 99)),
+                    'mean': float(values.mean())}
+
+        with self.lock:
+            sizes = np.asarray(self.batch_sizes) if self.batch_sizes else np.zeros(0, int)
+            return {
+                'uptime_seconds': time.time() - self.started,
+                'requests': self.requests,
+                'errors': self.errors,
+                'batches': self.batches,
+                'latency_ms': percentiles(self.latency_ms),
+                'queue_ms': percentiles(self.queue_ms),
+                'batch_size': {
+                    'mean': float(sizes.mean()) if sizes.size else None,
+                    'max': int(sizes.max()) if sizes.size else None,
+                    'histogram': {int(s): int(n) for s, n in zip(*np.unique(sizes, return_counts=True))},
+                },
+            }
+
+
+class MicroBatcher:
+    """
+    Collect images from many threads into batches for one model call.
+
+    ``submit`` returns a Future with (top-k probabilities, top-k indices)
+    for that image. A single worker thread owns the model.
+    """
+
+    def __init__(self, predictor, max_batch_size=16, max_latency_ms=10, top_k=None, metrics=None):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_latency = max_latency_ms / 1000
+        self.metrics = metrics or Metrics()
+        self.queue = queue.Queue()
+        self._top_k = predictor.top_k_fn(top_k or len(predictor.class_names))
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+
+    def warm_up(self):
+        """Trace and run the model for a single image and for a full batch."""
+        size = self.predictor.img_size
+        start = time.perf_counter()
+        for batch in sorted({1, self.max_batch_size}):
+            self._top_k(tf.zeros([batch, size, size, 3]))
+        print(f"Model warmed up in {time.perf_counter() - start:.1f}s")
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def submit(self, image):
+        future = Future()
+        self.queue.put((image, future, time.perf_counter()))
+        return future
+
+    def _loop(self):
+        while True:
+            items = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_latency
+            while len(items) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(self.queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            started = time.perf_counter()
+            try:
+                probabilities, indices = self._top_k(tf.stack([image for image, _, _ in items]))
+                probabilities, indices = probabilities.numpy(), indices.numpy()
+            except Exception as error:
+                for _, future, _ in items:
+                    future.set_exception(error)
+                continue
+            self.metrics.record_batch(len(items), [(started - queued) * 1000 for _, _, queued in items])
+            for i, (_, future, _) in enumerate(items):
+                future.set_result((probabilities[i], indices[i]))
+
+
+def decode_image(data, img_size):
+    """Image file bytes -> float32 [img_size, img_size, 3] tensor in [0, 255]."""
+    image = tf.io.decode_image(data, channels=3, expand_animations=False)
+    return tf.image.resize(image, (img_size, img_size), method='bilinear')
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128  # listen backlog; the default of 5 resets bursts of scans
+
+
+def make_handler(batcher, timeout=30):
+    predictor = batcher.predictor
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == '/health':
+                self._send(200, {'status': 'ok', 'classes': len(predictor.class_names)})
+            elif path == '/metrics':
+                self._send(200, batcher.metrics.snapshot())
+            else:
+                self._send(404, {'error': f'unknown path {path}'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != '/predict':
+                self._send(404, {'error': f'unknown path {url.path}'})
+                return
+            start = time.perf_counter()
+            try:
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.headers.get('Content-Type', '').startswith('application/json'):
+                    body = base64.b64decode(json.loads(body)['image'])
+                top_k = int(parse_qs(url.query).get('top_k', [3])[0])
+                # Decoding runs here, in the request's thread, in parallel
+                image = decode_image(body, predictor.img_size)
+            except Exception as error:
+                batcher.metrics.record_request(0, ok=False)
+                self._send(400, {'error': f'bad request: {error}'})
+                return
+
+            try:
+                probabilities, indices = batcher.submit(image).result(timeout)
+            except Exception as error:
+                batcher.metrics.record_request(0, ok=False)
+                self._send(500, {'error': str(error)})
+                return
+            latency_ms = (time.perf_counter() - start) * 1000
+            batcher.metrics.record_request(latency_ms)
+            self._send(200, {
+                'predictions': [
+                    {'class': predictor.class_names[i], 'index': int(i), 'probability': float(p)}
+                    for p, i in list(zip(probabilities, indices))[:top_k]
+                ],
+                'latency_ms': latency_ms,
+            })
+
+        def log_message(self, format, *args):
+            pass  # /metrics replaces the per-request access log
+
+    return Handler
+
+
+def serve(predictor, host='127.0.0.1', port=8500, max_batch_size=16, max_latency_ms=10):
+    batcher = MicroBatcher(predictor, max_batch_size, max_latency_ms)
+    batcher.warm_up()
+    batcher.start()
+    server = _Server((host, port), make_handler(batcher))
+    print(f"Serving on http://{host}:{port} (batches of up to {max_batch_size}, "
+          f"waiting at most {max_latency_ms} ms)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder, .keras file or SavedModel folder")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8500)
+    parser.add_argument('--max-batch-size', type=int, default=16)
+    parser.add_argument('--max-latency-ms', type=float, default=10,
+                        help="how long the first queued image waits for others")
+    parser.add_argument('--class-names', help="class_names.json, if not next to the model")
+    parser.add_argument('--threads', type=int, help="TensorFlow intra-op threads (default: all cores)")
+    parser.add_argument('--gpu', action='store_true', help="allow a GPU (default: CPU only)")
+    args = parser.parse_args(argv)
+
+    if not args.gpu:
+        tf.config.set_visible_devices([], 'GPU')
+    if args.threads:
+        tf.config.threading.set_intra_op_parallelism_threads(args.threads)
+
+    class_names = None
+    if args.class_names:
+        with open(args.class_names) as f:
+            class_names = json.load(f)
+    serve(Predictor(args.model, class_names), args.host, args.port,
+          args.max_batch_size, args.max_latency_ms)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,262 @@
+"""
+Pre-decoded, pre-resized TFRecord shards of a PlantVillage folder tree.
+
+Packing decodes and resizes every JPEG once and stores raw uint8 pixels, so
+later training runs, sweeps and evaluations stream sequential shards
+instead of decoding JPEGs again.
+
+Records are packed in a seeded random order, so every shard is a sample of
+all classes and streaming a few shards through a shuffle buffer mixes
+classes within a batch the way a full-epoch permutation does. The
+training / validation split is applied when reading, as a filter over all
+shards: a validation pass reads (and skips) the training records too.
+
+Pack once, then point the trainers' dataset path at the output folder:
+
+    python -m farmguard_train.shards "/kaggle/input/plantdisease/PlantVillage" \\
+        /kaggle/working/plantvillage_shards --img-size 224
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from .data import (
+    AUTOTUNE, PREPROCESSING_MODES, DirectoryDataset, augment_batch,
+    decode_and_resize, list_image_files, preprocess,
+)
+from .index import load_or_build_index
+
+MANIFEST_NAME = 'manifest.json'
+FILES_NAME = 'files.txt'
+SHARD_FORMAT = 'farmguard-shards-v2'
+# v1 shards (records in class order, no 'order' in the manifest) are still read
+READABLE_FORMATS = ('farmguard-shards-v1', SHARD_FORMAT)
+
+_FEATURES = {
+    'image': tf.io.FixedLenFeature([], tf.string),
+    'label': tf.io.FixedLenFeature([], tf.int64),
+    'index': tf.io.FixedLenFeature([], tf.int64),
+}
+
+
+def is_shard_dir(path):
+    return os.path.isfile(os.path.join(path, MANIFEST_NAME))
+
+
+def load_manifest(shard_dir):
+    with open(os.path.join(shard_dir, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get('format') not in READABLE_FORMATS:
+        raise ValueError(f"{shard_dir} is not a {SHARD_FORMAT} shard directory")
+    return manifest
+
+
+def _example(image, label, index):
+    return tf.train.Example(features=tf.train.Features(feature={
+        'image': tf.train.Feature(bytes_list=tf.train.BytesList(value=[image.tobytes()])),
+        'label': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(label)])),
+        'index': tf.train.Feature(int64_list=tf.train.Int64List(value=[int(index)])),
+    })).SerializeToString()
+
+
+def pack_shards(directory, output_dir, img_size=224, shard_size=1024, index=None, seed=0):
+    """
+    Decode + resize every image under ``directory`` into uint8 TFRecord shards.
+
+    Records are written in a random order (``seed``) and carry their label
+    and index within the class, so the usual per-class validation split can
+    be applied when reading. Writes ``manifest.json`` (class list,
+    per-class counts, shard list and ``order``: the flow_from_directory
+    position of every record) and ``files.txt`` (source paths in
+    flow_from_directory order, class by class, files sorted). ``index`` (a
+    DatasetIndex) leaves out broken images. Returns the manifest.
+    """
+    filenames, labels, class_indices = list_image_files(directory, index=index)
+    if not filenames:
+        raise ValueError(f"No images found in {directory}")
+    class_names = list(class_indices)
+    counts = np.bincount(labels, minlength=len(class_names))
+    # Position of every file within its class (files are grouped by class)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    indices = np.arange(len(labels)) - starts[labels]
+    # Record i is file order[i]: shards mix all classes
+    order = np.random.default_rng(seed).permutation(len(filenames))
+
+    os.makedirs(output_dir, exist_ok=True)
+    num_shards = math.ceil(len(filenames) / shard_size)
+    ds = tf.data.Dataset.from_tensor_slices([filenames[i] for i in order]).map(
+        lambda path: tf.cast(tf.round(decode_and_resize(path, img_size)), tf.uint8),
+        num_parallel_calls=AUTOTUNE,
+        deterministic=True,
+    ).prefetch(AUTOTUNE)
+
+    print(f"Packing {len(filenames)} images from {len(class_names)} classes "
+          f"into {num_shards} shards at {img_size}x{img_size}...")
+    start = time.perf_counter()
+    shards = []
+    writer = None
+    for i, image in enumerate(ds.as_numpy_iterator()):
+        if i % shard_size == 0:
+            if writer is not None:
+                writer.close()
+            name = f'shard-{len(shards):05d}-of-{num_shards:05d}.tfrecord'
+            shards.append({'file': name, 'count': 0})
+            writer = tf.io.TFRecordWriter(os.path.join(output_dir, name))
+        writer.write(_example(image, labels[order[i]], indices[order[i]]))
+        shards[-1]['count'] += 1
+    writer.close()
+    seconds = time.perf_counter() - start
+
+    with open(os.path.join(output_dir, FILES_NAME), 'w') as f:
+        for path in filenames:
+            f.write(os.path.relpath(path, directory) + '\n')
+
+    manifest = {
+        'format': SHARD_FORMAT,
+        'source': os.path.abspath(directory),
+        'img_size': img_size,
+        'num_images': len(filenames),
+        'class_names': class_names,
+        'class_counts': {name: int(c) for name, c in zip(class_names, counts)},
+        'shards': shards,
+        'order': order.tolist(),
+    }
+    with open(os.path.join(output_dir, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    print(f"Packed {len(filenames)} images in {seconds:.1f}s "
+          f"({len(filenames) / seconds:.1f} images/sec) -> {output_dir}")
+    return manifest
+
+
+def shard_dataset(shard_dir, subset=None, img_size=224, batch_size=32,
+                  preprocessing='rescale', augmentation=None,
+                  validation_split=0.0, shuffle=True, seed=None,
+                  shuffle_buffer=1024, split=None):
+    """
+    Stream a shard directory as a DirectoryDataset (same API as directory_dataset).
+
+    ``img_size`` must match the size the shards were packed at. ``split``
+    (a SplitManifest of the folder the shards were packed from) replaces
+    the per-class ``validation_split``. Either subset is a filter over all
+    shards, so it reads the whole dataset; ``filenames`` / ``classes`` are
+    in record order, the order an unshuffled pass yields.
+    """
+    if preprocessing not in PREPROCESSING_MODES:
+        raise ValueError(f"Unknown preprocessing {preprocessing!r}, expected one of {PREPROCESSING_MODES}")
+    if subset not in (None, 'training', 'validation'):
+        raise ValueError(f"Invalid subset: {subset!r}")
+    manifest = load_manifest(shard_dir)
+    if manifest['img_size'] != img_size:
+        raise ValueError(
+            f"Shards in {shard_dir} were packed at {manifest['img_size']}px, "
+            f"not {img_size}px; repack or change IMG_SIZE"
+        )
+    class_names = manifest['class_names']
+    num_classes = len(class_names)
+    counts = np.array([manifest['class_counts'][name] for name in class_names])
+
+    # Same per-class split as flow_from_directory: first fraction is validation
+    val_counts = (validation_split * counts).astype(np.int64) if subset else np.zeros_like(counts)
+    labels = np.repeat(np.arange(num_classes, dtype=np.int32), counts)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    indices = np.arange(len(labels)) - starts[labels]
+    with open(os.path.join(shard_dir, FILES_NAME)) as f:
+        all_files = [line.rstrip('\n') for line in f]
+    if split is not None and subset:
+        members = split.subset_paths(subset)
+        keep = np.array([name in members for name in all_files])
+    elif subset == 'validation':
+        keep = indices < val_counts[labels]
+    elif subset == 'training':
+        keep = indices >= val_counts[labels]
+    else:
+        keep = np.ones(len(labels), dtype=bool)
+    # Position in flow_from_directory order of every record (v1 shards: the same)
+    order = np.asarray(manifest.get('order', np.arange(len(labels))), dtype=np.int64)
+    records = order[keep[order]]
+    filenames = [all_files[i] for i in records]
+    if not filenames:
+        raise ValueError(f"No images in {shard_dir} (subset={subset})")
+
+    files = [os.path.join(shard_dir, s['file']) for s in manifest['shards']]
+    if shuffle:
+        ds = tf.data.Dataset.from_tensor_slices(files).shuffle(len(files), seed=seed)
+        ds = ds.interleave(
+            lambda f: tf.data.TFRecordDataset(f),
+            cycle_length=min(len(files), 8),
+            num_parallel_calls=AUTOTUNE,
+            deterministic=False,
+        )
+    else:
+        ds = tf.data.TFRecordDataset(files, buffer_size=8 * 1024 * 1024)
+
+    val_limit = tf.constant(val_counts, dtype=tf.int64)
+    # Record position in pack order = class start + index within the class
+    keep_records = tf.constant(keep)
+    class_starts = tf.constant(starts, dtype=tf.int64)
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, _FEATURES)
+        return example['image'], example['label'], example['index']
+
+    def selected(image, label, index):
+        if split is not None and subset:
+            return tf.gather(keep_records, tf.gather(class_starts, label) + index)
+        if subset == 'validation':
+            return index < tf.gather(val_limit, label)
+        if subset == 'training':
+            return index >= tf.gather(val_limit, label)
+        return tf.constant(True)
+
+    def decode(image, label, index):
+        image = tf.reshape(tf.io.decode_raw(image, tf.uint8), (img_size, img_size, 3))
+        return tf.cast(image, tf.float32), tf.one_hot(label, num_classes)
+
+    ds = ds.map(parse, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    ds = ds.filter(selected)
+    if shuffle:
+        ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    ds = ds.map(decode, num_parallel_calls=AUTOTUNE, deterministic=not shuffle)
+    ds = ds.batch(batch_size)
+    if augmentation:
+        ds = ds.map(lambda x, y: (augment_batch(x, **augmentation), y), num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: (preprocess(x, preprocessing), y), num_parallel_calls=AUTOTUNE)
+    # The filter hides the length: state it so Keras knows the steps per epoch
+    ds = ds.apply(tf.data.experimental.assert_cardinality(math.ceil(len(filenames) / batch_size)))
+    ds = ds.prefetch(AUTOTUNE)
+
+    return DirectoryDataset(
+        dataset=ds,
+        class_indices={name: i for i, name in enumerate(class_names)},
+        filenames=filenames,
+        classes=labels[records],
+        batch_size=batch_size,
+        preprocessing=preprocessing,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dataset', help="class-per-folder image tree (e.g. PlantVillage/color)")
+    parser.add_argument('output', help="folder to write shards + manifest.json into")
+    parser.add_argument('--img-size', type=int, default=224)
+    parser.add_argument('--shard-size', type=int, default=1024, help="images per shard")
+    parser.add_argument('--index', help="dataset index JSON (see index.py); built there if missing")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the record order")
+    args = parser.parse_args(argv)
+    index = None
+    if args.index:
+        index = load_or_build_index(args.dataset, args.index)
+    pack_shards(args.dataset, args.output, img_size=args.img_size, shard_size=args.shard_size,
+                index=index, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
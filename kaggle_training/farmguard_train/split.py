@@ -0,0 +1,321 @@
+"""
+Duplicate-aware train/validation split.
+
+PlantVillage holds near-identical and augmented copies of the same leaf.
+Splitting by filename order (flow_from_directory's ``validation_split``)
+puts copies on both sides and inflates validation accuracy. Here every
+image gets a 64-bit perceptual hash (DCT of a 32x32 grayscale thumbnail,
+computed for all images at once with NumPy), images within
+``threshold`` bits of each other are grouped (transitively), and whole
+groups are assigned to one split, aiming for ``validation_split`` of
+every class.
+
+The result is stored as a JSON manifest (every file with its hash, group
+and subset). Runs and sweep trials pointing at the same manifest reuse it;
+it is only rebuilt when the dataset or the split settings change, and then
+the hashes of known files are reused.
+
+    python -m farmguard_train.split PlantVillage/ --output split_manifest.json
+"""
+
+import argparse
+import collections
+import contextlib
+import fcntl
+import json
+import os
+import time
+from dataclasses import dataclass
+
+import numpy as np
+import tensorflow as tf
+
+from .data import AUTOTUNE, list_image_files
+from .index import load_or_build_index
+
+SPLIT_FORMAT = 'farmguard-split-v1'
+THUMBNAIL_SIZE = 32
+HASH_SIZE = 8  # 8x8 low-frequency DCT coefficients -> 64 bits
+
+# Set bits of every byte value, for Hamming distances of packed hashes
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+@dataclass
+class SplitManifest:
+    """Files (flow_from_directory order) with their hash, group and subset."""
+    root: str
+    class_names: list
+    params: dict  # validation_split, threshold, seed
+    files: list  # dicts: path (relative to root), label, phash (hex), group, subset
+
+    def class_files(self, class_name, subset):
+        """Absolute paths of ``class_name`` in ``subset`` ('training' / 'validation')."""
+        label = self.class_names.index(class_name)
+        return [os.path.join(self.root, f['path']) for f in self.files
+                if f['label'] == label and f['subset'] == subset]
+
+    def subset_paths(self, subset):
+        return {f['path'] for f in self.files if f['subset'] == subset}
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'format': SPLIT_FORMAT, 'root': self.root, 'class_names': self.class_names,
+                       'params': self.params, 'stats': split_stats(self), 'files': self.files}, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get('format') != SPLIT_FORMAT:
+            raise ValueError(f"{path} is not a {SPLIT_FORMAT} manifest")
+        return cls(data['root'], data['class_names'], data['params'], data['files'])
+
+
+def thumbnails(paths, size=THUMBNAIL_SIZE, batch_size=256):
+    """(N, size, size) float32 grayscale thumbnails, decoded in parallel."""
+    def load(path):
+        image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+        image = tf.image.rgb_to_grayscale(tf.cast(image, tf.float32))
+        # Area averaging: a clean low-pass for hashing
+        return tf.image.resize(image, (size, size), method='area')[..., 0]
+
+    ds = tf.data.Dataset.from_tensor_slices(list(paths))
+    ds = ds.map(load, num_parallel_calls=AUTOTUNE, deterministic=True).batch(batch_size).prefetch(AUTOTUNE)
+    batches = list(ds.as_numpy_iterator())
+    return np.concatenate(batches) if batches else np.zeros((0, size, size), np.float32)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)[:, None]
+    matrix = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+def perceptual_hashes(thumbs, hash_size=HASH_SIZE):
+    """
+    pHash of a stack of thumbnails: 2-D DCT (two matrix products for the
+    whole stack), keep the low-frequency ``hash_size`` x ``hash_size``
+    block, one bit per coefficient above the block's median (DC excluded).
+    Returns (N, hash_size**2 / 8) uint8.
+    """
+    dct = _dct_matrix(thumbs.shape[-1]).astype(np.float32)
+    low = (dct @ thumbs @ dct.T)[:, :hash_size, :hash_size].reshape(len(thumbs), -1)
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return np.packbits(low > median, axis=1)
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def group_near_duplicates(hashes, threshold=6, block=1024):
+    """
+    Group ids (N,) joining every pair of hashes within ``threshold`` bits.
+
+    Candidate pairs come from the hash bytes: two 64-bit hashes that differ
+    in at most 7 bits agree on at least one of their 8 bytes, so comparing
+    only images that share a byte value at the same position finds every
+    pair (threshold must be below the number of bytes).
+    """
+    n, num_bytes = hashes.shape
+    if threshold >= num_bytes:
+        raise ValueError(f"threshold must be below {num_bytes} bits for the banded search")
+    pairs = []
+    for b in range(num_bytes):
+        order = np.argsort(hashes[:, b], kind='stable')
+        keys = hashes[order, b]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        for members in np.split(order, bounds):
+            if len(members) < 2:
+                continue
+            for start in range(0, len(members), block):
+                rows = members[start:start + block]
+                distance = _POPCOUNT[hashes[rows][:, None, :] ^ hashes[members][None, :, :]].sum(-1)
+                i, j = np.nonzero(distance <= threshold)
+                keep = rows[i] < members[j]
+                pairs.append(np.stack([rows[i][keep], members[j][keep]], axis=1))
+
+    parent = list(range(n))
+    if pairs:
+        for i, j in np.unique(np.concatenate(pairs), axis=0):
+            ri, rj = _find(parent, i), _find(parent, j)
+            if ri != rj:
+                parent[max(ri, rj)] = min(ri, rj)
+    return np.array([_find(parent, i) for i in range(n)])
+
+
+def assign_groups(groups, labels, num_classes, validation_split, seed=0):
+    """
+    'training' / 'validation' per image. Groups are visited in a seeded
+    random order and go to validation while their (majority) class is
+    below its ``validation_split`` target, never overshooting it by more
+    than half the group.
+    """
+    members = collections.defaultdict(list)
+    for i, g in enumerate(groups):
+        members[g].append(i)
+    counts = np.bincount(labels, minlength=num_classes)
+    target = (validation_split * counts).astype(np.int64)
+    taken = np.zeros(num_classes, dtype=np.int64)
+
+    subset = np.array(['training'] * len(groups), dtype=object)
+    group_ids = sorted(members)
+    np.random.default_rng(seed).shuffle(group_ids)
+    for g in group_ids:
+        idx = members[g]
+        label = np.bincount(labels[idx], minlength=num_classes).argmax()
+        if taken[label] + len(idx) / 2 <= target[label]:
+            subset[idx] = 'validation'
+            np.add.at(taken, labels[idx], 1)
+    return subset
+
+
+def build_split(directory, validation_split=0.2, threshold=6, seed=0, index=None, previous=None):
+    """
+    Hash, group and split ``directory`` (its good files per ``index`` when
+    given). Hashes of files already in ``previous`` are reused.
+    """
+    start = time.perf_counter()
+    root = os.path.abspath(directory)
+    filenames, labels, class_indices = list_image_files(root, index=index)
+    paths = [os.path.relpath(p, root) for p in filenames]
+
+    known = {}
+    if previous is not None and previous.root == root:
+        known = {f['path']: f['phash'] for f in previous.files}
+    hashes = np.zeros((len(paths), HASH_SIZE * HASH_SIZE // 8), dtype=np.uint8)
+    todo = [i for i, p in enumerate(paths) if p not in known]
+    for i, p in enumerate(paths):
+        if p in known:
+            hashes[i] = np.frombuffer(bytes.fromhex(known[p]), dtype=np.uint8)
+    if todo:
+        print(f"Hashing {len(todo)} images ({len(paths) - len(todo)} known)...")
+        hashes[todo] = perceptual_hashes(thumbnails([filenames[i] for i in todo]))
+
+    groups = group_near_duplicates(hashes, threshold)
+    subset = assign_groups(groups, labels, len(class_indices), validation_split, seed)
+    split = SplitManifest(
+        root=root,
+        class_names=list(class_indices),
+        params={'validation_split': validation_split, 'threshold': threshold, 'seed': seed},
+        files=[{'path': p, 'label': int(l), 'phash': h.tobytes().hex(), 'group': int(g), 'subset': s}
+               for p, l, h, g, s in zip(paths, labels, hashes, groups, subset)],
+    )
+    stats = split_stats(split)
+    print(f"Split {stats['images']} images into {stats['groups']} groups in "
+          f"{time.perf_counter() - start:.1f}s: {stats['duplicate_images']} images have a "
+          f"near-duplicate, {stats['cross_class_groups']} groups span classes; "
+          f"validation {stats['validation_fraction'] * 100:.1f}%")
+    return split
+
+
+def extend_split(split):
+    """
+    ``split`` plus the class folders under its root that it does not know
+    yet (appended to its class names), hashed, grouped and split among
+    themselves with its settings. Files already in ``split`` keep their
+    subset, so a model validated on it is still validated on unseen images.
+    """
+    filenames, labels, class_indices = list_image_files(split.root)
+    new = [name for name in class_indices if name not in split.class_names]
+    if not new:
+        return split
+    class_names = split.class_names + new
+    keep = np.isin(labels, [class_indices[name] for name in new])
+    filenames = [f for f, k in zip(filenames, keep) if k]
+    remap = {class_indices[name]: class_names.index(name) for name in new}
+    labels = np.array([remap[l] for l in labels[keep]], dtype=np.int64)
+
+    print(f"Hashing {len(filenames)} images of {len(new)} new classes...")
+    hashes = perceptual_hashes(thumbnails(filenames))
+    params = split.params
+    groups = group_near_duplicates(hashes, params['threshold'])
+    first = len(split.class_names)
+    subset = assign_groups(groups, labels - first, len(new), params['validation_split'], params['seed'])
+    offset = max((f['group'] for f in split.files), default=-1) + 1
+    files = [{'path': os.path.relpath(p, split.root), 'label': int(l), 'phash': h.tobytes().hex(),
+              'group': int(g) + offset, 'subset': s}
+             for p, l, h, g, s in zip(filenames, labels, hashes, groups, subset)]
+    return SplitManifest(split.root, class_names, params, split.files + files)
+
+
+def split_stats(split):
+    groups = collections.defaultdict(list)
+    for f in split.files:
+        groups[f['group']].append(f)
+    validation = sum(f['subset'] == 'validation' for f in split.files)
+    return {
+        'images': len(split.files),
+        'groups': len(groups),
+        'duplicate_images': sum(len(g) for g in groups.values() if len(g) > 1),
+        'largest_group': max((len(g) for g in groups.values()), default=0),
+        'cross_class_groups': sum(len({f['label'] for f in g}) > 1 for g in groups.values()),
+        'validation_fraction': validation / len(split.files) if split.files else 0.0,
+    }
+
+
+@contextlib.contextmanager
+def _lock(path):
+    # Parallel sweep trials share one manifest: the first builds it
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + '.lock', 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_or_build_split(directory, manifest_path, validation_split=0.2, threshold=6, seed=0,
+                        index=None):
+    """
+    The split stored at ``manifest_path`` if it was built for the same
+    folder, settings and (with an ``index``) the same files; else build and
+    save a new one.
+    """
+    params = {'validation_split': validation_split, 'threshold': threshold, 'seed': seed}
+    with _lock(manifest_path):
+        previous = None
+        if os.path.exists(manifest_path):
+            previous = SplitManifest.load(manifest_path)
+            same_files = index is None or {f['path'] for f in previous.files} == {
+                e['path'] for e in index.entries}
+            if previous.root == os.path.abspath(directory) and previous.params == params and same_files:
+                stats = split_stats(previous)
+                print(f"Using split manifest {manifest_path}: {stats['images']} images in "
+                      f"{stats['groups']} groups, validation {stats['validation_fraction'] * 100:.1f}%")
+                return previous
+            print(f"Dataset or split settings changed, rebuilding {manifest_path}")
+
+        split = build_split(directory, validation_split, threshold, seed, index, previous)
+        split.save(manifest_path)
+        return split
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('dataset', help="class-per-folder image tree")
+    parser.add_argument('--output', default='split_manifest.json')
+    parser.add_argument('--validation-split', type=float, default=0.2)
+    parser.add_argument('--threshold', type=int, default=6, help="max differing hash bits of duplicates")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--index', help="dataset index JSON (see index.py) to take the files from")
+    args = parser.parse_args(argv)
+
+    index = None
+    if args.index:
+        index = load_or_build_index(args.dataset, args.index)
+    split = load_or_build_split(args.dataset, args.output, args.validation_split, args.threshold,
+                                args.seed, index)
+    print(json.dumps(split_stats(split), indent=2))
+
+
+if __name__ == '__main__':
+    main()
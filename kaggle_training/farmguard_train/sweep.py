@@ -0,0 +1,347 @@
+"""
+Parallel hyperparameter sweeps over TrainConfig.
+
+The search space is a JSON file mapping TrainConfig fields to a list of
+choices, or (random search only) to a range:
+
+    {
+        "learning_rate": {"min": 1e-4, "max": 3e-3, "log": true},
+        "batch_size": [16, 32, 64],
+        "unfreeze_layers": [null, 30, 60],
+        "head": [[0.2], [0.3, 128, 0.2], [512, 0.3, 256, 0.2]]
+    }
+
+Trials run in a process pool, one worker per GPU (``--gpus``) or per group
+of CPU cores (``--workers``). All trials share one dataset index, split
+manifest, bottleneck-feature cache and the dataset shards, so the images are
+verified once and the frozen backbone runs once per preprocessing mode
+rather than once per trial. A trial whose best val_accuracy falls
+below the median of the other trials at the same epoch is stopped early
+(median stopping rule). Results are written to ``results.json`` and
+``results.csv``, ranked by accuracy, then training time, then exported size.
+
+    python -m farmguard_train.sweep space.json --preset fixed \\
+        --dataset PlantVillage/ --output-dir runs/sweep --workers 4 --random 16
+
+Finished trials are skipped and interrupted ones resume from their
+checkpoints when the same command is run again.
+"""
+
+import argparse
+import csv
+import glob
+import itertools
+import json
+import math
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# TensorFlow is only imported inside the workers, after each one has been
+# pinned to its GPU / CPU cores
+
+_SLOT = {}
+
+
+class TrialStopped(Exception):
+    """Raised inside a trial's fit when the median stopping rule fires."""
+
+
+def grid(space):
+    """Every combination of the choices in ``space``."""
+    for name, values in space.items():
+        if not isinstance(values, list):
+            raise ValueError(f"Grid search needs a list of choices for {name!r}, got {values!r}")
+    names = list(space)
+    for values in itertools.product(*(space[n] for n in names)):
+        yield dict(zip(names, values))
+
+
+def _sample(values, rng):
+    if isinstance(values, list):
+        return rng.choice(values)
+    low, high = values['min'], values['max']
+    if values.get('log'):
+        value = math.exp(rng.uniform(math.log(low), math.log(high)))
+    else:
+        value = rng.uniform(low, high)
+    return int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+
+
+def random_search(space, trials, seed=0):
+    """``trials`` random points of ``space``."""
+    rng = random.Random(seed)
+    for _ in range(trials):
+        yield {name: _sample(values, rng) for name, values in space.items()}
+
+
+def worker_slots(workers=None, gpus=False):
+    """
+    One entry per worker: ``{'gpu': i}`` per visible GPU, or an even split of
+    this process' CPU cores into ``workers`` groups.
+    """
+    if gpus:
+        visible = os.environ.get('CUDA_VISIBLE_DEVICES')
+        if visible:
+            devices = [d for d in visible.split(',') if d]
+        else:
+            import tensorflow as tf
+            devices = [str(i) for i in range(len(tf.config.list_physical_devices('GPU')))]
+        if not devices:
+            raise RuntimeError("--gpus given but no GPU is visible")
+        return [{'gpu': d} for d in devices[:workers or len(devices)]]
+
+    cores = sorted(os.sched_getaffinity(0))
+    workers = max(1, min(workers or 1, len(cores)))
+    size = len(cores) // workers
+    return [{'cores': cores[i * size:(i + 1) * size]} for i in range(workers)]
+
+
+def _init_worker(slots):
+    # Runs before TensorFlow is imported in this process
+    slot = slots.get()
+    _SLOT.update(slot)
+    if 'gpu' in slot:
+        os.environ['CUDA_VISIBLE_DEVICES'] = slot['gpu']
+    else:
+        os.environ['CUDA_VISIBLE_DEVICES'] = ''
+        os.sched_setaffinity(0, slot['cores'])
+        os.environ['OMP_NUM_THREADS'] = str(len(slot['cores']))
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(len(slot['cores']))
+        tf.config.threading.set_inter_op_parallelism_threads(2)
+
+
+def _load_json(path):
+    # Other workers rewrite their curves concurrently (atomically, via os.replace)
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _curve_best(curve, phase, epoch):
+    """Best val_accuracy of ``curve`` up to (phase, epoch), None if not reached."""
+    if phase == 'phase2':
+        seen = curve.get('phase1', []) + curve.get('phase2', [])[:epoch + 1]
+        reached = len(curve.get('phase2', [])) > epoch
+    else:
+        seen = curve.get('phase1', [])[:epoch + 1]
+        reached = len(curve.get('phase1', [])) > epoch
+    seen = [v for v in seen if v is not None]
+    return max(seen) if reached and seen else None
+
+
+def _make_median_stopping(tf):
+    class MedianStopping(tf.keras.callbacks.Callback):
+        """
+        Median stopping rule across the trials of a sweep.
+
+        Each trial records its val_accuracy curve in ``<trial>/curve.json``.
+        After ``grace_epochs`` epochs a trial is stopped (TrialStopped) when
+        its best val_accuracy so far is below the median best of the other
+        trials at the same point, once ``min_trials`` others got that far.
+        """
+
+        def __init__(self, sweep_dir, trial_dir, phase, grace_epochs=2, min_trials=3):
+            super().__init__()
+            self.sweep_dir = sweep_dir
+            self.path = os.path.join(trial_dir, 'curve.json')
+            self.phase = phase
+            self.grace_epochs = grace_epochs
+            self.min_trials = min_trials
+
+        def on_epoch_end(self, epoch, logs=None):
+            curve = _load_json(self.path)
+            values = curve.setdefault(self.phase, [])
+            del values[epoch:]
+            values.extend([None] * (epoch - len(values)))
+            values.append(float((logs or {}).get('val_accuracy', 0.0)))
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(curve, f)
+            os.replace(self.path + '.tmp', self.path)
+
+            done = len(curve.get('phase1', [])) if self.phase == 'phase2' else 0
+            if done + epoch + 1 <= self.grace_epochs:
+                return
+            others = [
+                _curve_best(_load_json(p), self.phase, epoch)
+                for p in glob.glob(os.path.join(self.sweep_dir, 'trial-*', 'curve.json'))
+                if os.path.abspath(p) != os.path.abspath(self.path)
+            ]
+            others = [v for v in others if v is not None]
+            if len(others) < self.min_trials:
+                return
+            best = _curve_best(curve, self.phase, epoch)
+            median = statistics.median(others)
+            if best < median:
+                raise TrialStopped(
+                    f"{self.phase} epoch {epoch + 1}: best val_accuracy {best:.4f} "
+                    f"< median {median:.4f} of {len(others)} trials")
+
+    return MedianStopping
+
+
+def run_trial(trial_id, params, base, sweep_dir, grace_epochs=2, min_trials=3):
+    """Train one trial (in a worker process) and return its result row."""
+    import tensorflow as tf
+    from .export import artifact_size
+    from .train import preset, run
+
+    name = f'trial-{trial_id:03d}'
+    trial_dir = os.path.join(sweep_dir, name)
+    result_path = os.path.join(trial_dir, 'result.json')
+    if os.path.exists(result_path):
+        with open(result_path) as f:
+            return json.load(f)
+
+    os.makedirs(trial_dir, exist_ok=True)
+    config = preset(base.get('preset', 'main'), **{
+        # Sweeps compare the main model: no student, float32 export only
+        'distill_student': False,
+        'tfjs_quantizations': ['float32'],
+        'feature_cache_dir': os.path.join(sweep_dir, 'feature_cache'),
+        'keep_validation_cache': True,  # shared by the trials
+        'index_path': os.path.join(sweep_dir, 'dataset_index.json'),
+        'split_manifest': os.path.join(sweep_dir, 'split_manifest.json'),
+        **{k: v for k, v in base.items() if k != 'preset'},
+        **params,
+        'output_dir': trial_dir,
+    })
+    MedianStopping = _make_median_stopping(tf)
+
+    row = {'trial': name, 'params': params, 'device': _SLOT.get('gpu', _SLOT.get('cores'))}
+    start = time.perf_counter()
+    try:
+        result = run(config, phase_callbacks=lambda phase: [
+            MedianStopping(sweep_dir, trial_dir, phase, grace_epochs, min_trials)
+        ])
+        row.update(
+            status='done',
+            val_accuracy=float(result['val_accuracy']),
+            val_loss=float(result['val_loss']),
+            model_bytes=artifact_size(result['tfjs_dir'])[0],
+        )
+    except TrialStopped as stopped:
+        row.update(status='stopped', reason=str(stopped))
+    except Exception as error:  # one broken trial must not kill the sweep
+        row.update(status='failed', reason=f'{type(error).__name__}: {error}')
+    row['train_seconds'] = time.perf_counter() - start
+
+    if row['status'] != 'done':
+        # Best accuracy reached before it was stopped or crashed
+        curve = _load_json(os.path.join(trial_dir, 'curve.json'))
+        seen = [v for v in curve.get('phase1', []) + curve.get('phase2', []) if v is not None]
+        row['val_accuracy'] = max(seen) if seen else None
+    if row['status'] != 'failed':
+        with open(result_path, 'w') as f:
+            json.dump(row, f, indent=2)
+    return row
+
+
+def rank(rows):
+    """Finished trials by accuracy, then training time, then model size; then stopped, then failed."""
+    order = {'done': 0, 'stopped': 1, 'failed': 2}
+    return sorted(rows, key=lambda r: (
+        order[r['status']],
+        -(r.get('val_accuracy') or 0.0),
+        r['train_seconds'],
+        r.get('model_bytes') or 0,
+    ))
+
+
+def write_results(rows, sweep_dir):
+    rows = rank(rows)
+    with open(os.path.join(sweep_dir, 'results.json'), 'w') as f:
+        json.dump(rows, f, indent=2)
+
+    names = sorted({k for r in rows for k in r['params']})
+    with open(os.path.join(sweep_dir, 'results.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['rank', 'trial', 'status', 'val_accuracy', 'train_seconds', 'model_bytes'] + names)
+        for i, r in enumerate(rows, 1):
+            writer.writerow([i, r['trial'], r['status'], r.get('val_accuracy'), round(r['train_seconds'], 1),
+                             r.get('model_bytes')] + [json.dumps(r['params'].get(n)) for n in names])
+
+    print(f"\n{'rank':<5}{'trial':<11}{'status':<9}{'val_acc':>9}{'minutes':>9}{'size MB':>9}  params")
+    for i, r in enumerate(rows, 1):
+        accuracy = f"{r['val_accuracy'] * 100:.2f}%" if r.get('val_accuracy') is not None else '-'
+        size = f"{r['model_bytes'] / 2**20:.1f}" if r.get('model_bytes') else '-'
+        print(f"{i:<5}{r['trial']:<11}{r['status']:<9}{accuracy:>9}{r['train_seconds'] / 60:>9.1f}{size:>9}  "
+              f"{json.dumps(r['params'])}")
+    return rows
+
+
+def sweep(space, base, sweep_dir, trials=None, seed=0, workers=None, gpus=False,
+          grace_epochs=2, min_trials=3):
+    """
+    Run a grid (``trials=None``) or random search over ``space`` on top of
+    the TrainConfig fields in ``base`` (plus ``'preset'``). Returns the
+    ranked result rows.
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    points = list(grid(space) if trials is None else random_search(space, trials, seed))
+    with open(os.path.join(sweep_dir, 'sweep.json'), 'w') as f:
+        json.dump({'space': space, 'base': base, 'trials': points}, f, indent=2)
+
+    slots = worker_slots(workers, gpus)
+    print(f"Running {len(points)} trials on {len(slots)} workers: "
+          + ', '.join(f"GPU {s['gpu']}" if 'gpu' in s else f"{len(s['cores'])} cores" for s in slots))
+
+    # spawn: fresh interpreters, so each worker can pin itself before importing TensorFlow
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    for slot in slots:
+        queue.put(slot)
+
+    rows = []
+    with ProcessPoolExecutor(len(slots), mp_context=context, initializer=_init_worker,
+                             initargs=(queue,)) as pool:
+        futures = {
+            pool.submit(run_trial, i, params, base, sweep_dir, grace_epochs, min_trials): i
+            for i, params in enumerate(points)
+        }
+        for future in as_completed(futures):
+            row = future.result()
+            rows.append(row)
+            print(f"[{len(rows)}/{len(points)}] {row['trial']} {row['status']}"
+                  + (f" val_accuracy={row['val_accuracy']:.4f}" if row.get('val_accuracy') is not None else '')
+                  + (f" ({row['reason']})" if row.get('reason') else ''))
+
+    return write_results(rows, sweep_dir)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('space', help="JSON search space (TrainConfig field -> choices or range)")
+    parser.add_argument('--preset', default='main', help="training preset every trial starts from")
+    parser.add_argument('--config', help="JSON file of TrainConfig fields shared by all trials")
+    parser.add_argument('--dataset')
+    parser.add_argument('--output-dir', default='farmguard_sweep')
+    parser.add_argument('--random', type=int, metavar='N', help="N random trials instead of the full grid")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, help="parallel trials (default: 1, or one per GPU)")
+    parser.add_argument('--gpus', action='store_true', help="one worker per visible GPU")
+    parser.add_argument('--grace-epochs', type=int, default=2, help="epochs before a trial can be stopped")
+    parser.add_argument('--min-trials', type=int, default=3, help="trials to compare against before stopping")
+    args = parser.parse_args(argv)
+
+    with open(args.space) as f:
+        space = json.load(f)
+    base = {'preset': args.preset}
+    if args.config:
+        with open(args.config) as f:
+            base.update(json.load(f))
+    if args.dataset:
+        base['dataset'] = args.dataset
+
+    sweep(space, base, args.output_dir, trials=args.random, seed=args.seed, workers=args.workers,
+          gpus=args.gpus, grace_epochs=args.grace_epochs, min_trials=args.min_trials)
+
+
+if __name__ == '__main__':
+    main()
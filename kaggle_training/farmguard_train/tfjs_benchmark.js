@@ -0,0 +1,44 @@
+// Load time and first-inference latency of a tfjs model in Node.js, as JSON on stdout.
+// Used by export.tfjs_load_benchmark:
+//
+//     node tfjs_benchmark.js <graph|layers> http://127.0.0.1:8000/model.json 224
+//
+// Mirrors the scanners: load /model/model.json, then predict on a zero tensor.
+// Needs @tensorflow/tfjs (the app's dependency) on the module path.
+const tf = require('@tensorflow/tfjs');
+
+async function timeMs(fn) {
+  const start = performance.now();
+  await fn();
+  return performance.now() - start;
+}
+
+async function main() {
+  const [format, url, size] = process.argv.slice(2);
+  await tf.setBackend('cpu');
+  await tf.ready();
+
+  let model = null;
+  const loadMs = await timeMs(async () => {
+    model = format === 'graph' ? await tf.loadGraphModel(url) : await tf.loadLayersModel(url);
+  });
+  const input = tf.zeros([1, Number(size), Number(size), 3]);
+  const predict = async () => {
+    const output = model.predict(input);
+    await output.data();
+    output.dispose();
+  };
+  const firstMs = await timeMs(predict);
+  const secondMs = await timeMs(predict);
+
+  console.log(JSON.stringify({
+    load_ms: loadMs,
+    first_inference_ms: firstMs,
+    second_inference_ms: secondMs,
+  }));
+}
+
+main().catch((err) => {
+  console.error(err.message || err);
+  process.exit(1);
+});
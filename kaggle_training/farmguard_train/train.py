@@ -0,0 +1,1069 @@
+"""
+Configurable MobileNetV2 trainer behind the Kaggle training scripts.
+
+The three scripts used to be copies of one pipeline that differed in
+preprocessing, head, epoch split and unfreeze depth. Those differences are
+now options of TrainConfig and the scripts are the presets:
+
+    "main"  - kaggle_train.py: [0,1] input, 512-256 head, full fine-tune,
+              tfjs graph model
+    "fixed" - kaggle_train_FIXED.py: [-1,1] input, dropout-only head, last
+              30 layers fine-tuned with BatchNorm frozen
+    "fast"  - kaggle_train_FAST.py: [0,1] input, 128 head, 4 + 4 epochs,
+              last 30 layers fine-tuned, no early stopping
+
+All of them export a tfjs graph model (constants and BatchNorm folded) by
+default; export_format='layers' gives the old layers model. Distilling a
+small student model (distill_student) adds a phase and is off in every
+preset.
+
+Run it anywhere (Kaggle or a plain Linux box) with
+
+    python -m farmguard_train.train --preset fixed --dataset PlantVillage/ \\
+        --output-dir runs/fixed --fine-tune-epochs 12
+
+or ``--config run.json``; every TrainConfig field is also a ``--flag``. The
+resolved config is written to ``<output_dir>/train_config.json``.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import tempfile
+from dataclasses import asdict, dataclass, field, fields, replace
+
+import tensorflow as tf
+from tensorflow.keras.applications import MobileNetV2
+from tensorflow.keras.applications.mobilenet_v2 import preprocess_input
+from tensorflow.keras.callbacks import EarlyStopping, ModelCheckpoint, ReduceLROnPlateau
+from tensorflow.keras.layers import Dense, Dropout, GlobalAveragePooling2D
+from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
+from tensorflow.keras.preprocessing.image import ImageDataGenerator
+
+from .artifacts import ArtifactCache, code_version, dataset_fingerprint, stage_key
+from .callbacks import PerformanceTelemetry, write_telemetry
+from .checkpoint import TrainingCheckpoint
+from .data import dataset_classes, directory_dataset, find_dataset
+from .distill import (
+    build_student, distillation_loss, distillation_model, distillation_report, student_accuracy,
+)
+from .export import (
+    WEIGHT_SHARD_SIZE_BYTES, convert_saved_model, copy_to_variants, export_format_report,
+    quantization_report, save_layers_model, save_saved_model, top1_accuracy, variant_dir,
+)
+from .embeddings import build_embedding_index
+from .evaluate import evaluate, print_report
+from .features import extract_features, feature_extractor, head_model
+from .image_cache import cached_dataset, remove_cached
+from .index import load_or_build_index
+from .precision import float32_model, loss_scaled, set_precision
+from .pruning import MagnitudePruning, add_export_size, pruning_report, weights_gzip_bytes
+from .shards import is_shard_dir, load_manifest
+from .split import load_or_build_split
+from .tta import tta_report
+
+# Where the PlantVillage datasets end up when added to a Kaggle notebook
+KAGGLE_DATASET_PATHS = [
+    '/kaggle/input/plantdisease/PlantVillage',
+    '/kaggle/input/plantvillage-dataset/plantvillage dataset/color',
+    '/kaggle/input/plant-disease/PlantVillage',
+    '/kaggle/input/plantvillage/PlantVillage',
+    '/kaggle/input/plant-village/PlantVillage',
+    '/kaggle/input/plantvillage-dataset/PlantVillage',
+    '/kaggle/input/plantvillage-dataset/plantvillage dataset/PlantVillage',
+    '/kaggle/input/tomato-potato-pepper-plant-disease/PlantVillage',
+    '/kaggle/input/new-plant-diseases-dataset/New Plant Diseases Dataset(Augmented)/train',
+    '/kaggle/input/plant-village/Plant_leave_diseases_dataset_without_augmentation',
+]
+
+# Saved next to plant_disease_model.keras when a student is distilled
+STUDENT_MODEL_NAME = 'student_model.keras'
+
+# TrainConfig fields the trained model does not depend on: what the export
+# stage does with it, and where files are / go (the artifact cache hashes
+# the dataset's content instead of its path)
+EXPORT_FIELDS = (
+    'export_format', 'weight_shard_size_bytes', 'compare_export_formats', 'tfjs_quantizations',
+    'quantization_tolerance', 'zip_name',
+)
+RUN_FIELDS = (
+    'dataset', 'output_dir', 'shard_dir', 'dataset_index', 'index_path', 'refresh_index', 'split_manifest',
+    'feature_cache_dir', 'probe_batches', 'profile_phase', 'profile_steps', 'resume',
+    'artifact_cache', 'artifact_cache_dir', 'keep_validation_cache',
+)
+
+# How each preprocessing mode is reproduced in the browser
+NORMALIZATION = {
+    'rescale': ('divide_255', 'tensor.toFloat().div(255.0)'),
+    'mobilenet_v2': ('divide_127.5_subtract_1', 'tensor.toFloat().div(127.5).sub(1)'),
+}
+
+
+@dataclass
+class TrainConfig:
+    """Every knob of a training run; defaults are the "main" preset."""
+    # Data
+    dataset: str = None  # None = search the Kaggle input folder
+    output_dir: str = None  # None = /kaggle/working on Kaggle, else ./farmguard_output
+    shard_dir: str = None  # used instead of dataset when it holds shards
+    input_pipeline: str = 'tf_data'  # or 'generator' (ImageDataGenerator)
+    dataset_index: bool = True  # verified file list at index_path (index.py)
+    index_path: str = None  # None = <output_dir>/dataset_index.json
+    refresh_index: bool = False  # re-list the folders and re-verify changed files
+    img_size: int = 224
+    batch_size: int = 32
+    validation_split: float = 0.2
+    split: str = 'phash'  # near-duplicates kept on one side (split.py), or 'filename' (Keras order)
+    split_manifest: str = None  # None = <output_dir>/split_manifest.json
+    split_threshold: int = 6  # max differing perceptual-hash bits of near-duplicates
+    split_seed: int = 0
+    preprocessing: str = 'rescale'  # or 'mobilenet_v2' ([-1, 1])
+    augmentation: dict = field(default_factory=lambda: dict(
+        rotation_range=30,
+        width_shift_range=0.2,
+        height_shift_range=0.2,
+        shear_range=0.2,
+        zoom_range=0.2,
+        horizontal_flip=True,
+        vertical_flip=True,
+        fill_mode='nearest',
+    ))
+    augment_validation: bool = False
+    cache_validation: bool = True  # decode validation once into <feature_cache_dir> (image_cache.py)
+    keep_validation_cache: bool = False  # else the decoded array is deleted when the run ends
+
+    # Model: head layers after global pooling, ints are Dense(relu) units
+    # and floats Dropout rates
+    weights: str = 'imagenet'
+    head: list = field(default_factory=lambda: [512, 0.3, 256, 0.2])
+
+    # Phase 1: frozen backbone
+    phase1_mode: str = 'feature_cache'  # or 'images'
+    feature_cache_dir: str = None  # None = <output_dir>/feature_cache, also holds cached validation images
+    head_epochs: int = 5
+    learning_rate: float = 1e-4
+
+    # Phase 2: fine-tune with learning_rate * fine_tune_lr_factor
+    fine_tune_epochs: int = 15
+    fine_tune_lr_factor: float = 0.1
+    # Progressive resizing, e.g. [128, 160, 224]: fine_tune_epochs split evenly
+    # across the sizes, ending at img_size (the exported input size)
+    progressive_sizes: list = None
+    progressive_batch_scaling: bool = True  # batch_size * (img_size / size)^2 at the smaller sizes
+    unfreeze_layers: int = None  # None = whole backbone, N = last N layers
+    freeze_batchnorm: bool = False
+
+    # Callbacks (None disables)
+    early_stopping_patience: int = 5
+    reduce_lr_patience: int = 3
+    save_best_model: bool = True
+
+    # Performance (see precision.py); opt in with precision='auto' and jit_compile=True
+    precision: str = 'float32'
+    jit_compile: bool = False
+
+    # Telemetry (see callbacks.PerformanceTelemetry), written to model_output/telemetry.json
+    probe_batches: int = 5  # input vs. compute probe after the first epoch, 0 disables
+    profile_phase: str = 'phase2'
+    profile_steps: list = None  # e.g. [20, 30]: TensorBoard trace of those steps
+
+    # Test-time augmentation report after evaluation, e.g. [1, 2, 4, 8] views (see tta.py)
+    tta_views: list = None
+
+    # Nearest-neighbour index of the training images' embeddings (see embeddings.py)
+    embedding_index: bool = False
+
+    # Resumable checkpoints (see checkpoint.py)
+    resume: bool = True
+
+    # Skip training / export when their inputs are unchanged (see artifacts.py); opt-in, as it
+    # keeps a second copy of every output
+    artifact_cache: bool = False
+    artifact_cache_dir: str = None  # None = <output_dir>/artifact_cache
+
+    # Optional magnitude pruning after phase 2
+    prune: bool = False
+    prune_epochs: int = 4
+    prune_final_sparsity: float = 0.5
+
+    # Knowledge distillation into a small student: an extra phase and tfjs export, so opt-in
+    distill_student: bool = False
+    student_alpha: float = 0.35
+    student_img_size: int = 128
+    distill_epochs: int = 10
+    distill_learning_rate: float = 0.001
+    distill_temperature: float = 4.0
+    distill_hard_weight: float = 0.1
+
+    # Export
+    export_format: str = 'graph'  # tfjs 'graph' (via SavedModel) or 'layers' model
+    weight_shard_size_bytes: int = WEIGHT_SHARD_SIZE_BYTES  # per .bin file, fetched in parallel
+    compare_export_formats: bool = False  # opt-in: also write both formats, compare size / load time
+    tfjs_quantizations: list = field(default_factory=lambda: ['float32', 'float16', 'uint8'])
+    quantization_tolerance: float = 0.01
+    zip_name: str = 'farmguard_model'
+
+    def path(self, *parts):
+        return os.path.join(self.output_dir, *parts)
+
+
+PRESETS = {
+    'main': {},
+    'fixed': dict(
+        preprocessing='mobilenet_v2',
+        augmentation=dict(
+            rotation_range=25,
+            width_shift_range=0.15,
+            height_shift_range=0.15,
+            shear_range=0.15,
+            zoom_range=0.15,
+            horizontal_flip=True,
+            fill_mode='nearest',
+        ),
+        head=[0.2],
+        head_epochs=8,
+        learning_rate=1e-3,
+        fine_tune_epochs=12,
+        unfreeze_layers=30,
+        freeze_batchnorm=True,
+        reduce_lr_patience=2,
+    ),
+    'fast': dict(
+        augmentation=dict(
+            rotation_range=20,
+            width_shift_range=0.2,
+            height_shift_range=0.2,
+            horizontal_flip=True,
+            zoom_range=0.2,
+        ),
+        head=[0.3, 128, 0.2],
+        head_epochs=4,
+        learning_rate=1e-3,
+        fine_tune_epochs=4,
+        unfreeze_layers=30,
+        early_stopping_patience=None,
+        reduce_lr_patience=None,
+        save_best_model=False,
+        zip_name='farmguard_model_15class',
+    ),
+}
+
+
+def preset(name, **overrides):
+    """TrainConfig of a named preset, with ``overrides`` applied."""
+    if name not in PRESETS:
+        raise ValueError(f"Unknown preset {name!r}, expected one of {sorted(PRESETS)}")
+    return replace(TrainConfig(), **{**PRESETS[name], **overrides})
+
+
+def resolve_paths(config):
+    """Fill in the dataset / output folders left as None."""
+    if config.output_dir is None:
+        config.output_dir = '/kaggle/working' if os.path.isdir('/kaggle/working') else 'farmguard_output'
+    if config.shard_dir is None:
+        config.shard_dir = config.path('plantvillage_shards')
+    if config.feature_cache_dir is None:
+        config.feature_cache_dir = config.path('feature_cache')
+    if config.artifact_cache_dir is None:
+        config.artifact_cache_dir = config.path('artifact_cache')
+    if config.index_path is None:
+        config.index_path = config.path('dataset_index.json')
+    if config.split_manifest is None:
+        config.split_manifest = config.path('split_manifest.json')
+    if config.dataset is None:
+        config.dataset = find_dataset(KAGGLE_DATASET_PATHS)
+    if is_shard_dir(config.shard_dir) and not (config.dataset and is_shard_dir(config.dataset)):
+        # Only shards packed from this dataset stand in for it, never a stale folder of another one
+        source = load_manifest(config.shard_dir).get('source')
+        if config.dataset is None or source == os.path.abspath(config.dataset):
+            print(f"Using packed shards at {config.shard_dir} (packed from {source})")
+            config.dataset = config.shard_dir
+        else:
+            print(f"Ignoring packed shards at {config.shard_dir}: packed from {source}, "
+                  f"not {os.path.abspath(config.dataset)}")
+    if config.dataset is None or not os.path.exists(config.dataset):
+        raise FileNotFoundError(f"Dataset not found: {config.dataset} (pass --dataset)")
+    os.makedirs(config.output_dir, exist_ok=True)
+    return config
+
+
+def load_data(config, index=None, split=None):
+    """
+    (train_data, val_data): DirectoryDataset or DirectoryIterator per split.
+
+    ``index`` (a DatasetIndex) lists the files and ``split`` (a
+    SplitManifest) assigns them to the subsets for the tf.data pipeline;
+    the ImageDataGenerator pipeline always lists and splits the folders
+    itself.
+    """
+    val_augmentation = config.augmentation if config.augment_validation else None
+    if config.input_pipeline == 'tf_data':
+        common = dict(
+            img_size=config.img_size,
+            batch_size=config.batch_size,
+            preprocessing=config.preprocessing,
+            validation_split=config.validation_split,
+            index=index,
+            split=split,
+        )
+        train_data = directory_dataset(config.dataset, subset='training', shuffle=True,
+                                       augmentation=config.augmentation, **common)
+        val_data = directory_dataset(config.dataset, subset='validation', shuffle=False,
+                                     augmentation=val_augmentation, **common)
+        return train_data, val_data
+
+    if index is not None and index.broken:
+        print(f"Warning: {len(index.broken)} broken images are still listed by the 'generator' "
+              f"pipeline (use input_pipeline='tf_data' to skip them)")
+    if split is not None:
+        print("Warning: the 'generator' pipeline splits by filename order, "
+              "near-duplicates can end up in both subsets (use input_pipeline='tf_data')")
+    if config.preprocessing == 'mobilenet_v2':
+        scaling = dict(preprocessing_function=preprocess_input)
+    else:
+        scaling = dict(rescale=1./255)
+    train_datagen = ImageDataGenerator(validation_split=config.validation_split,
+                                       **scaling, **config.augmentation)
+    val_datagen = ImageDataGenerator(validation_split=config.validation_split,
+                                     **scaling, **(val_augmentation or {}))
+    common = dict(
+        target_size=(config.img_size, config.img_size),
+        batch_size=config.batch_size,
+        class_mode='categorical',
+    )
+    train_data = train_datagen.flow_from_directory(
+        config.dataset, subset='training', shuffle=True, **common)
+    val_data = val_datagen.flow_from_directory(
+        config.dataset, subset='validation', shuffle=False, **common)
+    return train_data, val_data
+
+
+def build_model(config, num_classes, variable_size=False):
+    """
+    (model, base_model): MobileNetV2 with a frozen backbone and the
+    configured head. ``variable_size`` leaves the input height / width open
+    (progressive resizing), the weights are the same as at img_size.
+    """
+    size = None if variable_size else config.img_size
+    base_model = MobileNetV2(
+        weights=config.weights,
+        include_top=False,
+        input_shape=(size, size, 3)
+    )
+    base_model.trainable = False
+
+    x = GlobalAveragePooling2D()(base_model.output)
+    for spec in config.head:
+        if isinstance(spec, int):
+            x = Dense(spec, activation='relu')(x)
+        else:
+            x = Dropout(spec)(x)
+    predictions = Dense(num_classes, activation='softmax', dtype='float32')(x)
+    return Model(inputs=base_model.input, outputs=predictions), base_model
+
+
+def unfreeze(config, base_model):
+    """Make the backbone (or its last ``unfreeze_layers`` layers) trainable."""
+    base_model.trainable = True
+    if config.unfreeze_layers is not None:
+        for layer in base_model.layers[:-config.unfreeze_layers]:
+            layer.trainable = False
+    if config.freeze_batchnorm:
+        for layer in base_model.layers:
+            if isinstance(layer, tf.keras.layers.BatchNormalization):
+                layer.trainable = False
+
+
+def compile_model(config, model, learning_rate, loss='categorical_crossentropy', metrics=('accuracy',)):
+    model.compile(
+        optimizer=loss_scaled(Adam(learning_rate=learning_rate), config.precision),
+        loss=loss,
+        metrics=list(metrics),
+        jit_compile=config.jit_compile
+    )
+
+
+def training_callbacks(config):
+    """Early stopping / LR schedule / best model, as configured."""
+    callbacks = []
+    if config.early_stopping_patience is not None:
+        callbacks.append(EarlyStopping(
+            monitor='val_accuracy',
+            patience=config.early_stopping_patience,
+            restore_best_weights=True,
+            verbose=1
+        ))
+    if config.reduce_lr_patience is not None:
+        callbacks.append(ReduceLROnPlateau(
+            monitor='val_loss',
+            factor=0.5,
+            patience=config.reduce_lr_patience,
+            min_lr=1e-7,
+            verbose=1
+        ))
+    if config.save_best_model:
+        callbacks.append(ModelCheckpoint(
+            config.path('best_model.keras'),
+            monitor='val_accuracy',
+            save_best_only=True,
+            verbose=1
+        ))
+    return callbacks
+
+
+def progressive_stages(config):
+    """
+    [(first_epoch, last_epoch, img_size, batch_size)] of phase 2: one stage
+    at img_size, or fine_tune_epochs split evenly across progressive_sizes
+    (later stages get the remainder).
+    """
+    sizes = config.progressive_sizes or [config.img_size]
+    if sizes[-1] != config.img_size:
+        raise ValueError(f"progressive_sizes must end at img_size ({config.img_size}), got {sizes}")
+    bounds = [config.fine_tune_epochs * i // len(sizes) for i in range(len(sizes) + 1)]
+    stages = []
+    for size, first, last in zip(sizes, bounds, bounds[1:]):
+        if last <= first:
+            continue
+        batch_size = config.batch_size
+        if config.progressive_batch_scaling and size < config.img_size:
+            # Same pixels per step; multiple of 8 for the accelerators
+            scaled = config.batch_size * config.img_size ** 2 // size ** 2 // 8 * 8
+            batch_size = max(config.batch_size, scaled)
+        stages.append((first, last, size, batch_size))
+    return stages
+
+
+def stage_training_data(config, size, batch_size, index=None, split=None):
+    """Training DirectoryDataset of a progressive stage: ``size`` px, ``batch_size`` images."""
+    data = directory_dataset(
+        config.dataset,
+        subset='training',
+        # Shards only exist at img_size: decode those, resize the batches below
+        img_size=config.img_size if is_shard_dir(config.dataset) else size,
+        batch_size=batch_size,
+        preprocessing=config.preprocessing,
+        augmentation=config.augmentation,
+        validation_split=config.validation_split,
+        shuffle=True,
+        index=index,
+        split=split,
+    )
+    if is_shard_dir(config.dataset):
+        data.dataset = data.dataset.map(
+            lambda x, y: (tf.image.resize(x, (size, size)), y), num_parallel_calls=tf.data.AUTOTUNE
+        ).prefetch(tf.data.AUTOTUNE)
+    return data
+
+
+def telemetry_callback(config, log, phase, num_images, data=None, label=None):
+    """PerformanceTelemetry for one fit; ``data`` enables the input/compute probe."""
+    profile = config.profile_steps if phase == config.profile_phase else None
+    return PerformanceTelemetry(
+        log, phase, num_images,
+        data=data if config.probe_batches else None,
+        probe_batches=config.probe_batches,
+        profile_steps=profile,
+        profile_dir=config.path('profile', phase),
+        label=f'{phase}, {label}' if label else phase,
+    )
+
+
+def experiment_config(config, class_names):
+    """The options that change what is trained; checkpoints only resume into the same."""
+    return dict(
+        dataset=config.dataset,
+        classes=class_names,
+        img_size=config.img_size,
+        batch_size=config.batch_size,
+        preprocessing=config.preprocessing,
+        split=[config.split, config.split_threshold, config.split_seed],
+        head=config.head,
+        learning_rate=config.learning_rate,
+        fine_tune_lr_factor=config.fine_tune_lr_factor,
+        progressive_sizes=config.progressive_sizes,
+        unfreeze_layers=config.unfreeze_layers,
+        freeze_batchnorm=config.freeze_batchnorm,
+        precision=config.precision,
+        phase1_mode=config.phase1_mode,
+        prune_final_sparsity=config.prune_final_sparsity if config.prune else None,
+        student=[config.student_alpha, config.student_img_size] if config.distill_student else None,
+    )
+
+
+def banner(text):
+    print("\n" + "=" * 50)
+    print(text)
+    print("=" * 50)
+
+
+def generators(config, train_data, val_data):
+    """What fit / evaluate consume: the tf.data pipelines, or the Keras iterators themselves."""
+    if config.input_pipeline == 'tf_data':
+        return train_data.dataset, val_data.dataset
+    return train_data, val_data
+
+
+def train_inputs(config, train_data, val_data, index=None):
+    """Everything the train stage's outputs depend on (the artifact cache key)."""
+    ignored = EXPORT_FIELDS + RUN_FIELDS
+    return {
+        'config': {name: value for name, value in asdict(config).items() if name not in ignored},
+        'dataset': dataset_fingerprint(config.dataset, {'training': train_data, 'validation': val_data},
+                                       index),
+        'code': code_version(),
+    }
+
+
+def train_outputs(config):
+    """Output paths of the train stage, relative to output_dir."""
+    paths = ['model_output', 'evaluation.json']
+    if config.tta_views:
+        paths.append('tta_report.json')
+    if config.prune:
+        paths.append('pruning_report.json')
+    if config.distill_student:
+        paths.append('distillation_report.json')
+    if config.embedding_index:
+        paths.append('embedding_index')
+    return paths
+
+
+def export_outputs(config):
+    """Output paths of the export stage, relative to output_dir."""
+    tfjs_dir = config.path('tfjs_model')
+    paths = ['quantization_report.json']
+    for quantization in config.tfjs_quantizations:
+        suffix = '' if quantization == 'float32' else f'_{quantization}'
+        paths += [os.path.relpath(variant_dir(tfjs_dir, quantization), config.output_dir),
+                  f'{config.zip_name}{suffix}.zip']
+    if config.export_format == 'graph' or config.compare_export_formats:
+        paths.append('saved_model')
+    if config.compare_export_formats:
+        paths += ['export_format_report.json', 'tfjs_format_compare']
+    if config.prune:
+        paths.append('pruning_report.json')
+    if config.distill_student:
+        student_zip = config.zip_name.replace('farmguard_model', 'farmguard_student')
+        paths += ['tfjs_student', f'{student_zip}.zip']
+    return paths
+
+
+def model_metadata(config, class_names, input_size):
+    """What the browser needs besides the weights, kept small: input size, normalization, classes."""
+    normalization, js = NORMALIZATION[config.preprocessing]
+    return {
+        'input_size': input_size,
+        'preprocessing': config.preprocessing,
+        'normalization': normalization,
+        'normalization_js': js,
+        'num_classes': len(class_names),
+        'class_names': class_names,
+    }
+
+
+def load_trained(config):
+    """(model, student) saved by the train stage, for exporting a cached training run."""
+    model = tf.keras.models.load_model(config.path('model_output', 'plant_disease_model.keras'),
+                                       compile=False)
+    student = None
+    if config.distill_student:
+        student = tf.keras.models.load_model(config.path('model_output', STUDENT_MODEL_NAME), compile=False)
+    return model, student
+
+
+def train(config, train_data, val_data, class_names, index=None, split=None, phase_callbacks=None):
+    """
+    Build, train, evaluate and distill, then save the model (and student) to
+    ``<output_dir>/model_output``. Returns (model, student, results) with
+    the validation accuracy and loss.
+    """
+    train_generator, val_generator = generators(config, train_data, val_data)
+    num_classes = len(class_names)
+
+    # ============================================
+    # BUILD MODEL
+    # ============================================
+    banner("Building MobileNetV2 model...")
+
+    # Must be set before any layer is created
+    config.precision = set_precision(config.precision)
+    perf_label = f"{config.precision}, XLA {'on' if config.jit_compile else 'off'}"
+    print(f"Performance mode: {perf_label}")
+
+    if config.progressive_sizes and config.input_pipeline != 'tf_data':
+        raise ValueError("progressive_sizes needs input_pipeline='tf_data'")
+    model, base_model = build_model(config, num_classes, variable_size=bool(config.progressive_sizes))
+    compile_model(config, model, config.learning_rate)
+    print(f"Model has {model.count_params():,} parameters")
+
+    callbacks = training_callbacks(config)
+    checkpoint = TrainingCheckpoint(
+        # Without resume: a private folder, so concurrent runs never restore each other's weights
+        config.path('checkpoints') if config.resume else tempfile.mkdtemp(prefix='farmguard_checkpoints_'),
+        config=experiment_config(config, class_names)
+    )
+    if not config.resume:
+        checkpoint.reset()
+    if phase_callbacks is None:
+        phase_callbacks = lambda phase: []
+
+    # Per-phase performance log, kept across resumed runs
+    telemetry_path = config.path('model_output', 'telemetry.json')
+    telemetry = {}
+    if config.resume and checkpoint.state['completed_phases'] and os.path.exists(telemetry_path):
+        with open(telemetry_path) as f:
+            telemetry = json.load(f)
+    telemetry['performance_mode'] = perf_label
+
+    def telemetry_for(phase, data=None, size=None):
+        label = f'{perf_label}, {size}px' if size else perf_label
+        return telemetry_callback(config, telemetry, phase, train_data.samples, data, label)
+
+    # ============================================
+    # PHASE 1: Train only the head
+    # ============================================
+    banner("PHASE 1: Training classification head...")
+
+    if checkpoint.phase_done('phase1'):
+        checkpoint.restore_phase('phase1', model)
+    elif config.phase1_mode == 'feature_cache':
+        # Unaugmented, unshuffled passes over each split, one backbone run per image
+        extractor = feature_extractor(base_model)
+        cached = {}
+        for subset, name in [('training', 'train'), ('validation', 'val')]:
+            cached[name] = extract_features(
+                extractor,
+                directory_dataset(
+                    config.dataset,
+                    subset=subset,
+                    img_size=config.img_size,
+                    batch_size=config.batch_size,
+                    preprocessing=config.preprocessing,
+                    validation_split=config.validation_split,
+                    shuffle=False,
+                    index=index,
+                    split=split
+                ),
+                config.feature_cache_dir,
+                name
+            )
+
+        # Shares its layers with `model`, so phase 2 starts from this head
+        head = head_model(model)
+        compile_model(config, head, config.learning_rate, loss='sparse_categorical_crossentropy')
+        # EarlyStopping + ReduceLROnPlateau only, the head alone is not worth saving
+        head_callbacks = [cb for cb in callbacks if not isinstance(cb, ModelCheckpoint)]
+        head.fit(
+            cached['train'].features,
+            cached['train'].labels,
+            batch_size=config.batch_size,
+            epochs=config.head_epochs,
+            initial_epoch=checkpoint.initial_epoch('phase1'),
+            validation_data=(cached['val'].features, cached['val'].labels),
+            callbacks=(head_callbacks + [checkpoint.callback('phase1', head_callbacks)]
+                       + [telemetry_for('phase1')] + phase_callbacks('phase1')),
+            verbose=1
+        )
+        checkpoint.finish_phase('phase1', model)
+        write_telemetry(telemetry, telemetry_path)
+    else:
+        model.fit(
+            train_generator,
+            epochs=config.head_epochs,
+            initial_epoch=checkpoint.initial_epoch('phase1'),
+            validation_data=val_generator,
+            callbacks=(callbacks + [checkpoint.callback('phase1', callbacks)]
+                       + [telemetry_for('phase1', train_generator)] + phase_callbacks('phase1')),
+            verbose=1
+        )
+        checkpoint.finish_phase('phase1', model)
+        write_telemetry(telemetry, telemetry_path)
+
+    # ============================================
+    # PHASE 2: Fine-tune
+    # ============================================
+    depth = 'all' if config.unfreeze_layers is None else f'last {config.unfreeze_layers}'
+    banner(f"PHASE 2: Fine-tuning ({depth} backbone layers)...")
+
+    fine_tune_lr = config.learning_rate * config.fine_tune_lr_factor
+    unfreeze(config, base_model)
+    compile_model(config, model, fine_tune_lr)
+
+    if checkpoint.phase_done('phase2'):
+        checkpoint.restore_phase('phase2', model)
+    else:
+        # Progressive resizing: one fit per size, validation stays at img_size
+        for first, last, size, batch_size in progressive_stages(config):
+            done = checkpoint.initial_epoch('phase2')
+            if done >= last:
+                continue
+            stage_data = train_generator
+            if (size, batch_size) != (config.img_size, config.batch_size):
+                print(f"Phase 2 epochs {first + 1}-{last}: {size}px, batch size {batch_size}")
+                stage_data = stage_training_data(config, size, batch_size, index, split).dataset
+            model.fit(
+                stage_data,
+                epochs=last,
+                initial_epoch=max(first, done),
+                validation_data=val_generator,
+                callbacks=(callbacks + [checkpoint.callback('phase2', callbacks)]
+                           + [telemetry_for('phase2', stage_data, size if config.progressive_sizes else None)]
+                           + phase_callbacks('phase2')),
+                verbose=1
+            )
+            if model.stop_training:  # early stopping ends the whole phase
+                break
+        checkpoint.finish_phase('phase2', model)
+        write_telemetry(telemetry, telemetry_path)
+
+    if config.progressive_sizes:
+        # Same weights on a fixed img_size input for pruning, distillation and export
+        trained = model
+        model, base_model = build_model(config, num_classes)
+        unfreeze(config, base_model)
+        compile_model(config, model, fine_tune_lr)
+        model.set_weights(trained.get_weights())
+
+    # ============================================
+    # OPTIONAL: MAGNITUDE PRUNING
+    # ============================================
+    if config.prune:
+        banner(f"Pruning to {config.prune_final_sparsity * 100:.0f}% sparsity while fine-tuning...")
+
+        # Measured on the dense model, kept in the checkpoint for resumed runs
+        accuracy_before_pruning = checkpoint.remember(
+            'accuracy_before_pruning', lambda: top1_accuracy(model, val_generator))
+        gzip_before_pruning = checkpoint.remember(
+            'gzip_before_pruning', lambda: weights_gzip_bytes(model))
+
+        if checkpoint.phase_done('prune'):
+            checkpoint.restore_phase('prune', model)
+        else:
+            steps_per_epoch = math.ceil(train_data.samples / config.batch_size)
+            initial_epoch = checkpoint.initial_epoch('prune')
+            pruning = MagnitudePruning(
+                final_sparsity=config.prune_final_sparsity,
+                end_step=int(config.prune_epochs * steps_per_epoch * 0.75),
+                initial_step=initial_epoch * steps_per_epoch
+            )
+            compile_model(config, model, fine_tune_lr)
+            # No EarlyStopping/ModelCheckpoint here: they would restore denser weights.
+            # The checkpoint goes first so the weights are restored before pruning starts.
+            model.fit(
+                train_generator,
+                epochs=config.prune_epochs,
+                initial_epoch=initial_epoch,
+                validation_data=val_generator,
+                callbacks=[
+                    checkpoint.callback('prune'),
+                    pruning,
+                    telemetry_for('prune')
+                ],
+                verbose=1
+            )
+            checkpoint.finish_phase('prune', model)
+            write_telemetry(telemetry, telemetry_path)
+
+    # ============================================
+    # EVALUATE
+    # ============================================
+    banner("Evaluating model...")
+
+    # Confusion matrix + per-class precision / recall / top-3, streamed batch by batch
+    evaluation = evaluate(model, val_generator, class_names, report_path=config.path('evaluation.json'))
+    val_loss, val_acc = evaluation['overall']['loss'], evaluation['overall']['accuracy']
+    print_report(evaluation)
+    print(f"\nFinal Validation Accuracy: {val_acc*100:.2f}%")
+    print(f"Final Validation Loss: {val_loss:.4f}")
+    print(f"Per-class report: {config.path('evaluation.json')}")
+    if config.tta_views:
+        # Accuracy gain vs. throughput cost of averaging over augmented views
+        tta_report(model, val_generator, class_names, config.tta_views, config.path('tta_report.json'))
+    if config.prune:
+        # Sparsity, weight gzip size and accuracy vs. before pruning, before distillation touches anything
+        pruning_report(accuracy_before_pruning, top1_accuracy(model, val_generator), gzip_before_pruning,
+                       model, report_path=config.path('pruning_report.json'))
+
+    # ============================================
+    # PHASE 3: DISTILL STUDENT
+    # ============================================
+    student = None
+    if config.distill_student:
+        banner("PHASE 3: Distilling into a small student model...")
+
+        # Teacher = the fine-tuned model above (frozen); student sees the same
+        # batches resized to student_img_size and keeps the same normalization
+        student = build_student(num_classes, config.student_img_size, config.student_alpha,
+                                weights=config.weights)
+        distiller = distillation_model(model, student)
+        compile_model(
+            config, distiller, config.distill_learning_rate,
+            loss=distillation_loss(num_classes, config.distill_temperature, config.distill_hard_weight),
+            metrics=[student_accuracy(num_classes)]
+        )
+        if checkpoint.phase_done('distill'):
+            checkpoint.restore_phase('distill', distiller)
+        else:
+            distill_callbacks = [cb for cb in callbacks if not isinstance(cb, ModelCheckpoint)]
+            distiller.fit(
+                train_generator,
+                epochs=config.distill_epochs,
+                initial_epoch=checkpoint.initial_epoch('distill'),
+                validation_data=val_generator,
+                callbacks=(distill_callbacks + [checkpoint.callback('distill', distill_callbacks)]
+                           + [telemetry_for('distill')]),
+                verbose=1
+            )
+            checkpoint.finish_phase('distill', distiller)
+            write_telemetry(telemetry, telemetry_path)
+
+        # Params / FLOPs (latency proxy) vs. accuracy, teacher against student
+        distillation_report(model, student, val_generator, config.path('distillation_report.json'))
+
+    # ============================================
+    # SAVE MODEL
+    # ============================================
+    banner("Saving model...")
+
+    # Exported artifacts are always float32, whatever precision trained with
+    if config.precision != 'float32':
+        model = float32_model(model)
+        if student is not None:
+            student = float32_model(student)
+
+    os.makedirs(config.path('model_output'), exist_ok=True)
+    model.save(config.path('model_output', 'plant_disease_model.keras'))
+    if student is not None:
+        student.save(config.path('model_output', STUDENT_MODEL_NAME))
+    with open(config.path('model_output', 'class_names.json'), 'w') as f:
+        json.dump(class_names, f, indent=2)
+    normalization, js = NORMALIZATION[config.preprocessing]
+    with open(config.path('model_output', 'preprocessing.json'), 'w') as f:
+        json.dump({
+            "input_size": config.img_size,
+            "preprocessing": config.preprocessing,
+            "normalization": normalization,
+            "note": f"Use: {js} for preprocessing"
+        }, f, indent=2)
+    with open(config.path('model_output', 'metadata.json'), 'w') as f:
+        json.dump(model_metadata(config, class_names, config.img_size), f, indent=2)
+    print("Saved Keras model, class_names.json, preprocessing.json and metadata.json")
+
+    if config.embedding_index:
+        # Similar-case lookup / OOD flag: reference embeddings of the training images
+        reference = directory_dataset(
+            config.dataset,
+            subset='training',
+            img_size=config.img_size,
+            batch_size=config.batch_size,
+            preprocessing=config.preprocessing,
+            validation_split=config.validation_split,
+            shuffle=False,
+            index=index,
+            split=split
+        )
+        build_embedding_index(model, reference, val_data, class_names, config.path('embedding_index'),
+                              model_dir=config.path('model_output'))
+
+    if not config.resume:
+        shutil.rmtree(checkpoint.directory, ignore_errors=True)
+
+    return model, student, {
+        'val_accuracy': val_acc,
+        'val_loss': val_loss,
+    }
+
+
+def export(config, model, student, val_generator, trained):
+    """tfjs variants with their quantization (and pruning) report, the ZIPs and the student export."""
+    # ============================================
+    # CONVERT TO TENSORFLOW.JS
+    # ============================================
+    banner(f"Converting to TensorFlow.js {config.export_format} model...")
+
+    tfjs_dir = config.path('tfjs_model')
+    # Input size, normalization and classes, also embedded in model.json (userDefinedMetadata)
+    metadata_path = config.path('model_output', 'metadata.json')
+    with open(metadata_path) as f:
+        metadata = json.load(f)
+    if config.export_format == 'graph':
+        save_saved_model(model, config.path('saved_model'))
+    for quantization in config.tfjs_quantizations:
+        print(f"Converting {quantization} variant...")
+        if config.export_format == 'graph':
+            convert_saved_model(config.path('saved_model'), variant_dir(tfjs_dir, quantization), quantization,
+                                config.weight_shard_size_bytes, metadata_path)
+        else:
+            save_layers_model(model, variant_dir(tfjs_dir, quantization), quantization,
+                              config.weight_shard_size_bytes, metadata)
+
+    for sidecar in ['class_names.json', 'preprocessing.json', 'metadata.json']:
+        copy_to_variants(config.path('model_output', sidecar), tfjs_dir, config.tfjs_quantizations)
+
+    # Size + accuracy of each variant against float32
+    quantization_report(
+        model,
+        val_generator,
+        tfjs_dir,
+        config.tfjs_quantizations,
+        tolerance=config.quantization_tolerance,
+        report_path=config.path('quantization_report.json')
+    )
+
+    # Pruning: size of the export, next to the sparsity and accuracy written by training
+    if config.prune:
+        add_export_size(config.path('pruning_report.json'), tfjs_dir)
+
+    # Both formats of the float32 model: topology size, ops left, Node.js load / first-inference time
+    if config.compare_export_formats:
+        banner("Comparing tfjs layers and graph models...")
+        export_format_report(
+            model,
+            config.path('saved_model'),
+            config.path('tfjs_format_compare'),
+            config.img_size,
+            config.weight_shard_size_bytes,
+            metadata,
+            report_path=config.path('export_format_report.json')
+        )
+
+    # ============================================
+    # CREATE ZIPS FOR DOWNLOAD
+    # ============================================
+    banner("Creating downloadable ZIPs...")
+
+    for quantization in config.tfjs_quantizations:
+        suffix = '' if quantization == 'float32' else f'_{quantization}'
+        shutil.make_archive(config.path(config.zip_name + suffix), 'zip', variant_dir(tfjs_dir, quantization))
+        print(f"Created {config.zip_name}{suffix}.zip")
+
+    # Student model for low-end browsers (tfjs layers model)
+    if student is not None:
+        student_dir = config.path('tfjs_student')
+        student_zip = config.zip_name.replace('farmguard_model', 'farmguard_student')
+        student_metadata = {**metadata, 'input_size': config.student_img_size}
+        save_layers_model(student, student_dir, weight_shard_size_bytes=config.weight_shard_size_bytes,
+                          metadata=student_metadata)
+        for sidecar in ['class_names.json', 'preprocessing.json']:
+            shutil.copy(config.path('model_output', sidecar), student_dir)
+        with open(os.path.join(student_dir, 'metadata.json'), 'w') as f:
+            json.dump(student_metadata, f, indent=2)
+        shutil.make_archive(config.path(student_zip), 'zip', student_dir)
+        print(f"Saved {config.student_img_size}px student to {student_dir} ({student_zip}.zip)")
+
+
+def run(config, phase_callbacks=None):
+    """
+    Train, evaluate, distill and export according to ``config``.
+
+    ``phase_callbacks(phase)`` may return extra callbacks for the 'phase1'
+    and 'phase2' fits (the sweep runner stops losing trials this way).
+
+    Returns a dict with the validation accuracy/loss, class names and the
+    paths of the written artifacts.
+    """
+    print("TensorFlow version:", tf.__version__)
+    print("GPU Available:", tf.config.list_physical_devices('GPU'))
+
+    config = resolve_paths(replace(config))
+    print(f"Using dataset path: {config.dataset}")
+    print(f"Found {len(dataset_classes(config.dataset))} classes")
+    with open(config.path('train_config.json'), 'w') as f:
+        json.dump(asdict(config), f, indent=2)
+
+    # ============================================
+    # DATA
+    # ============================================
+    banner("Setting up data pipeline...")
+    index = None
+    if config.dataset_index and not is_shard_dir(config.dataset):
+        index = load_or_build_index(config.dataset, config.index_path, refresh=config.refresh_index)
+    split = None
+    if config.split == 'phash':
+        source = load_manifest(config.dataset)['source'] if is_shard_dir(config.dataset) else config.dataset
+        split = load_or_build_split(source, config.split_manifest, config.validation_split,
+                                    config.split_threshold, config.split_seed, index)
+    elif config.split != 'filename':
+        raise ValueError(f"Unknown split {config.split!r}, expected 'phash' or 'filename'")
+    train_data, val_data = load_data(config, index, split)
+    if config.cache_validation and config.input_pipeline == 'tf_data' and not config.augment_validation:
+        # Same batches every epoch: decode them once, reuse them for every evaluation
+        val_data = cached_dataset(val_data, config.feature_cache_dir, 'val')
+    val_generator = generators(config, train_data, val_data)[1]
+
+    class_names = list(train_data.class_indices.keys())
+    print(f"\nInput pipeline: {config.input_pipeline}")
+    print(f"Number of classes: {len(class_names)}")
+    print(f"Training samples: {train_data.samples}")
+    print(f"Validation samples: {val_data.samples}")
+
+    # Training and export are skipped when their inputs are unchanged (artifacts.py)
+    cache = ArtifactCache(config.artifact_cache_dir) if config.artifact_cache else None
+    inputs = train_inputs(config, train_data, val_data, index)
+    train_key = stage_key('train', inputs)
+    trained = cache.restore('train', train_key, config.output_dir) if cache else None
+    model = student = None
+    if trained is None:
+        model, student, trained = train(config, train_data, val_data, class_names, index, split,
+                                        phase_callbacks)
+        # A sweep trial stopped early is not the result of its config alone
+        if cache and phase_callbacks is None:
+            cache.store('train', train_key, config.output_dir, train_outputs(config), inputs, trained)
+
+    export_settings = {name: getattr(config, name) for name in EXPORT_FIELDS}
+    export_key = stage_key('export', {'train': train_key, 'export': export_settings, 'code': inputs['code']})
+    if cache is None or cache.restore('export', export_key, config.output_dir) is None:
+        if model is None:
+            model, student = load_trained(config)
+        export(config, model, student, val_generator, trained)
+        if cache and phase_callbacks is None:
+            cache.store('export', export_key, config.output_dir, export_outputs(config), export_settings)
+    if config.cache_validation and not config.keep_validation_cache:
+        # Hundreds of MB of pixels: not something to leave in (Kaggle's) output folder
+        remove_cached(config.feature_cache_dir, 'val')
+
+    return {
+        'val_accuracy': trained['val_accuracy'],
+        'val_loss': trained['val_loss'],
+        'class_names': class_names,
+        'config': config,
+        'model': config.path('model_output', 'plant_disease_model.keras'),
+        'tfjs_dir': config.path('tfjs_model'),
+        'student_dir': config.path('tfjs_student') if config.distill_student else None,
+    }
+
+
+def _parse_value(text):
+    # JSON where possible (numbers, booleans, null, lists, dicts), else a plain string
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return text
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--preset', default='main', choices=sorted(PRESETS))
+    parser.add_argument('--config', help="JSON file of TrainConfig fields, applied over the preset")
+    for f in fields(TrainConfig):
+        parser.add_argument(f"--{f.name.replace('_', '-')}", dest=f.name, type=_parse_value,
+                            default=argparse.SUPPRESS, metavar='VALUE')
+    args = vars(parser.parse_args(argv))
+
+    name, config_file = args.pop('preset'), args.pop('config', None)
+    overrides = {}
+    if config_file:
+        with open(config_file) as f:
+            overrides.update(json.load(f))
+    overrides.update(args)
+    result = run(preset(name, **overrides))
+    print(f"\nFinal accuracy: {result['val_accuracy']*100:.2f}%")
+    print(f"TensorFlow.js model: {result['tfjs_dir']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""
+Batched test-time augmentation (TTA).
+
+Every image of a batch is expanded into ``n`` deterministic views (flips,
+crops, small rotations), all ``batch * n`` views go through the model in a
+single forward pass, and the softmax outputs of each image's views are
+averaged. Works on preprocessed batches, so it wraps any model the
+evaluation and inference code already calls.
+
+``tta_report`` scores a model at several view counts and sets the accuracy
+gain against the throughput cost, to pick a setting for a latency budget:
+
+    python -m farmguard_train.tta farmguard_output/model_output PlantVillage/ \\
+        --split-manifest farmguard_output/split_manifest.json --views 1 2 4 8
+"""
+
+import argparse
+import json
+import math
+import os
+import time
+
+import tensorflow as tf
+
+from .evaluate import evaluate
+from .export import batches
+
+CROP_FRACTION = 0.85
+ROTATION_DEGREES = 15
+
+
+def _rotate(images, degrees):
+    """Rotate a [N, H, W, C] batch about its centre, reflecting at the borders."""
+    shape = tf.shape(images)
+    height = tf.cast(shape[1], tf.float32)
+    width = tf.cast(shape[2], tf.float32)
+    theta = degrees * math.pi / 180.0
+    cos, sin = math.cos(theta), math.sin(theta)
+    cx = (width - 1.0) / 2.0
+    cy = (height - 1.0) / 2.0
+    # Output -> input mapping, as in data.augment_batch
+    transform = tf.stack([cos, -sin, cx - cos * cx + sin * cy,
+                          sin, cos, cy - sin * cx - cos * cy, 0.0, 0.0])
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=tf.tile(transform[None], [shape[0], 1]),
+        output_shape=shape[1:3],
+        fill_value=0.0,
+        interpolation='BILINEAR',
+        fill_mode='REFLECT',
+    )
+
+
+def _crop(images, top, left):
+    """Crop CROP_FRACTION of each image at (top, left) (fractions of the free margin), resize back."""
+    n = tf.shape(images)[0]
+    margin = 1.0 - CROP_FRACTION
+    box = tf.constant([top * margin, left * margin, top * margin + CROP_FRACTION,
+                       left * margin + CROP_FRACTION])
+    return tf.image.crop_and_resize(images, tf.tile(box[None], [n, 1]), tf.range(n), images.shape[1:3])
+
+
+# In order of use: n views = the first n
+VIEWS = [
+    ('identity', lambda x: x),
+    ('horizontal_flip', lambda x: tf.reverse(x, axis=[2])),
+    ('center_crop', lambda x: _crop(x, 0.5, 0.5)),
+    ('vertical_flip', lambda x: tf.reverse(x, axis=[1])),
+    ('rotate_left', lambda x: _rotate(x, -ROTATION_DEGREES)),
+    ('rotate_right', lambda x: _rotate(x, ROTATION_DEGREES)),
+    ('top_left_crop', lambda x: _crop(x, 0.0, 0.0)),
+    ('bottom_right_crop', lambda x: _crop(x, 1.0, 1.0)),
+]
+
+
+def expand_views(images, n):
+    """[B, H, W, C] -> [B * n, H, W, C]: the first ``n`` VIEWS of each image, image by image."""
+    if not 1 <= n <= len(VIEWS):
+        raise ValueError(f"TTA views must be between 1 and {len(VIEWS)}, got {n}")
+    views = tf.stack([view(images) for _, view in VIEWS[:n]], axis=1)
+    return tf.reshape(views, tf.concat([[-1], tf.shape(images)[1:]], axis=0))
+
+
+def tta_forward(forward, images, n):
+    """Mean of ``forward``'s probabilities over ``n`` views of ``images``, in one call of ``forward``."""
+    if n == 1:
+        return tf.cast(forward(images), tf.float32)
+    probabilities = tf.cast(forward(expand_views(images, n)), tf.float32)
+    probabilities = tf.reshape(probabilities, [tf.shape(images)[0], n, -1])
+    return tf.reduce_mean(probabilities, axis=1)
+
+
+class TTAModel:
+    """Callable like a Keras model (preprocessed batch -> probabilities), with ``views`` TTA."""
+
+    def __init__(self, model, views):
+        self.model = model
+        self.views = views
+        self._predict = tf.function(
+            lambda images: tta_forward(lambda x: model(x, training=False), images, views),
+            reduce_retracing=True,
+        )
+
+    def __call__(self, images, training=False):
+        return self._predict(images)
+
+
+def tta_report(model, data, class_names, views=(1, 2, 4, 8), report_path=None):
+    """
+    Evaluate ``model`` on ``data`` (one-hot labels) at every view count in
+    ``views``: accuracy, top-3, macro F1, images/sec and cost relative to
+    the first setting. Each setting is traced on one batch before it is
+    timed.
+    """
+    rows = []
+    for n in views:
+        tta = TTAModel(model, n)
+        x, _ = next(iter(batches(data)))
+        tta(x)
+        start = time.perf_counter()
+        report = evaluate(tta, data, class_names)
+        seconds = time.perf_counter() - start
+        overall = report['overall']
+        rows.append({
+            'views': n,
+            'view_names': [name for name, _ in VIEWS[:n]],
+            'accuracy': overall['accuracy'],
+            'top3_accuracy': overall.get('top3_accuracy'),
+            'macro_f1': overall['macro_f1'],
+            'seconds': round(seconds, 3),
+            'images_per_sec': round(overall['samples'] / seconds, 2) if seconds > 0 else 0.0,
+            'ms_per_image': round(seconds * 1000 / overall['samples'], 3) if overall['samples'] else 0.0,
+        })
+
+    base = rows[0]
+    for row in rows:
+        row['accuracy_gain'] = round(row['accuracy'] - base['accuracy'], 4)
+        row['relative_cost'] = round(row['seconds'] / base['seconds'], 2) if base['seconds'] else None
+
+    print(f"\n{'views':>5}{'accuracy':>10}{'gain':>9}{'images/s':>11}{'ms/image':>10}{'cost':>7}")
+    for row in rows:
+        print(f"{row['views']:>5}{row['accuracy'] * 100:>9.2f}%{row['accuracy_gain'] * 100:>+8.2f}"
+              f"{row['images_per_sec']:>11.1f}{row['ms_per_image']:>10.2f}{row['relative_cost']:>6.2f}x")
+
+    if report_path:
+        os.makedirs(os.path.dirname(report_path) or '.', exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump({'baseline_views': base['views'], 'settings': rows}, f, indent=2)
+    return rows
+
+
+def main(argv=None):
+    from .data import directory_dataset
+    from .predict import Predictor
+    from .split import SplitManifest
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('model', help="model_output folder, .keras file or SavedModel")
+    parser.add_argument('dataset', help="class-per-folder image tree or shard folder")
+    parser.add_argument('--split-manifest', help="evaluate the validation subset of this split (split.py)")
+    parser.add_argument('--validation-split', type=float, default=0.0,
+                        help="evaluate the first fraction of each class (filename order)")
+    parser.add_argument('--views', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch-size', type=int, default=32, help="images per batch (before expanding)")
+    parser.add_argument('--output', default='tta_report.json')
+    args = parser.parse_args(argv)
+
+    predictor = Predictor(args.model)
+    split = SplitManifest.load(args.split_manifest) if args.split_manifest else None
+    subset = 'validation' if split is not None or args.validation_split else None
+    data = directory_dataset(
+        args.dataset, subset=subset, img_size=predictor.img_size, batch_size=args.batch_size,
+        preprocessing=predictor.preprocessing, validation_split=args.validation_split,
+        shuffle=False, split=split, classes=predictor.class_names,
+    )
+    tta_report(predictor, data.dataset, predictor.class_names, args.views, args.output)
+    print(f"Report written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -25,6 +25,7 @@ import {
   Check
 } from 'lucide-react';
 import { useLanguage } from '@/context/LanguageContext';
+import { loadModel } from '@/lib/loadModel';
 
 // 2-class model: Healthy vs Diseased
 const DISEASE_CLASSES = [
@@ -303,7 +304,7 @@ export default function FarmGuardScanner({ onClose, isOfflineMode }) {
         
         try {
           // Attempt to load the model from public/model folder
-          loadedModel = await tf.loadLayersModel('/model/model.json');
+          loadedModel = await loadModel('/model/model.json');
           setLoadingProgress(90);
           setLoadingMessage('modelLoaded');
         } catch (modelError) {
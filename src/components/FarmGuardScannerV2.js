@@ -23,6 +23,7 @@ import {
   Zap
 } from 'lucide-react';
 import { useLanguage } from '@/context/LanguageContext';
+import { loadModel } from '@/lib/loadModel';
 import CropSelector from './CropSelector';
 import DiseaseResultCard from './DiseaseResultCard';
 import TreatmentPlan from './TreatmentPlan';
@@ -186,7 +187,7 @@ export default function FarmGuardScanner({ onClose, isOfflineMode, modelType = '
         let loadedModel = null;
         
         try {
-          loadedModel = await tf.loadLayersModel('/model/model.json');
+          loadedModel = await loadModel('/model/model.json');
           setLoadingProgress(90);
           setLoadingMessage('modelLoaded');
         } catch (modelError) {
@@ -0,0 +1,17 @@
+// Loads the exported TensorFlow.js model whichever format it was converted to.
+// Training exports a graph model by default (constants and batch norm folded,
+// smaller topology); older exports and the student are layers models.
+
+import * as tf from '@tensorflow/tfjs';
+
+export async function loadModel(url) {
+  const response = await fetch(url);
+  if (!response.ok) {
+    throw new Error(`Model not found at ${url} (${response.status})`);
+  }
+  const manifest = await response.json();
+  // model.json is usually served from the HTTP cache the second time
+  return manifest.format === 'graph-model'
+    ? tf.loadGraphModel(url)
+    : tf.loadLayersModel(url);
+}